@@ -1,97 +1,175 @@
 
+from startup import PROFILE
+import argparse
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import cv2
 import os
-import numpy as np
-import pandas as pd
-import pickle
-import json
 from datetime import datetime, timedelta
-import face_recognition
-from PIL import Image, ImageTk
 import threading
+import time
+import settings
+from settings import DETECTOR_BACKENDS, ENCODER_BACKENDS, missing_dnn_models
+from ledger_service import open_ledger
+import exporter
+from rosters import Rosters
+from tracking import box_area
+from metrics import METRICS, SAMPLER, start_metrics_server
+
+# Only the standard library and the light modules above are imported here.
+# OpenCV, PIL, numpy, the recognition pipeline (engine and everything it
+# pulls in) and face_recognition with dlib's model files are imported by the
+# background warm-up, so the window appears before any of them are loaded.
+# The widgets that need them stay disabled until then; the methods behind
+# those widgets import what they use locally, which by then is a lookup.
+PROFILE.mark("imports")
 
 class KashviSmartFaceAttendanceGUI:
-    def __init__(self, root):
+    def __init__(self, root, exit_when_ready=False):
         self.root = root
+        self.exit_when_ready = exit_when_ready
         self.root.title("Smart Face Recognition Attendance System")
         self.root.geometry("1000x700")
         self.root.configure(bg='#f0f0f0')
 
-        self.faces_dir = "registered_faces"
-        self.attendance_dir = "attendance_photos"
-        self.report_dir = "reports"
-        self.attendance_file = "attendance.csv"
-        self.face_data_file = "face_encodings.pkl"
-        self.config_file = "config.json"
+        self.faces_dir = settings.FACES_DIR
+        self.attendance_dir = settings.ATTENDANCE_DIR
+        self.report_dir = settings.REPORT_DIR
+        self.attendance_file = settings.ATTENDANCE_FILE
+        self.attendance_db = settings.ATTENDANCE_DB
+        self.face_data_file = settings.FACE_DATA_FILE
+        self.config_file = settings.CONFIG_FILE
 
         os.makedirs(self.faces_dir, exist_ok=True)
         os.makedirs(self.attendance_dir, exist_ok=True)
         os.makedirs(self.report_dir, exist_ok=True)
 
         self.load_config()
-        self.load_faces()
 
-        if not os.path.exists(self.attendance_file):
-            pd.DataFrame(columns=['Name', 'Student_ID', 'Date', 'Time', 'Status', 'Photo_Path']).to_csv(self.attendance_file, index=False)
+        # Filled in by the background warm-up; widgets that need them stay
+        # disabled until it finishes
+        self.faces = None
+        self.ledger = None
+        self.ledger_server = None
+        self.engine = None
+        self.ready = False
+        self._warmup_widgets = []
+        self._records_loaded = False
 
         self.cap = None
         self.is_camera_running = False
         self.camera_thread = None
+        self._camera_stop = None
+        self._preview_job = None
+        self._last_preview_seq = None
+        # Built once the warm-up has imported OpenCV and PIL
+        self.preview = None
+        self.registration_preview = None
+        # Latest registration frame and whether the Tk thread has one queued
+        self._registration_frame = None
+        self._registration_pending = False
 
         self.setup_gui()
+        PROFILE.mark("window_built")
+        threading.Thread(target=self._warm_up, name="warm-up", daemon=True).start()
+        
+        # Prometheus text endpoint on http://<metrics_host>:<metrics_port>/metrics
+        try:
+            self.metrics_server = start_metrics_server(self.config['metrics_host'], self.config['metrics_port'])
+        except OSError as e:
+            self.metrics_server = None
+            self.status_var.set(f"Metrics endpoint unavailable: {e}")
 
     def load_config(self):
-        default = {
-            "work_start": "09:00",
-            "work_end": "17:00",
-            "late_threshold": 15,
-            "recognition_tolerance": 0.6,
-            "location": "Main Office"
-        }
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r') as f:
-                    self.config = json.load(f)
-            except json.JSONDecodeError:
-                self.config = default
-        else:
-            self.config = default
-
-        updated = False
-        for key, value in default.items():
-            if key not in self.config:
-                self.config[key] = value
-                updated = True
-
-        if updated or not os.path.exists(self.config_file):
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=4)
-
-    # The rest of your code remains unchanged...
-
+        self.config = settings.load_config(self.config_file)
+    
+    def save_config(self):
+        settings.save_config(self.config, self.config_file)
     
     def load_faces(self):
-        if os.path.exists(self.face_data_file):
-            with open(self.face_data_file, 'rb') as f:
-                data = pickle.load(f)
-                self.known_encodings = data['encodings']
-                self.known_names = data['names']
-                self.known_ids = data['ids']
-        else:
-            self.known_encodings = []
-            self.known_names = []
-            self.known_ids = []
-    
-    def save_faces(self):
-        data = {
-            "encodings": self.known_encodings,
-            "names": self.known_names,
-            "ids": self.known_ids
-        }
-        with open(self.face_data_file, 'wb') as f:
-            pickle.dump(data, f)
+        from engine import FaceStore
+        self.faces = FaceStore(self.config, self.face_data_file)
+    
+    def _warm_up(self):
+        # Heavy imports, model files, the gallery and the ledger, off the Tk thread.
+        # Each import's cost is recorded in startup_profile.json.
+        try:
+            PROFILE.timed_import('numpy')
+            PROFILE.timed_import('cv2')
+            PROFILE.timed_import('PIL.ImageTk')
+            PROFILE.timed_import('engine')
+            PROFILE.timed_import('preview')
+            PROFILE.timed_import('enrollment')
+            PROFILE.mark("pipeline_imported")
+            PROFILE.timed_import('face_recognition')
+            PROFILE.mark("models_loaded")
+            from engine import RecognitionEngine
+            self.load_faces()
+            PROFILE.mark("gallery_loaded")
+            # Existing attendance.csv is imported into the ledger on first run. With
+            # ledger_mode "serve" camera daemons can share it; "connect" uses theirs.
+            ledger, ledger_server = open_ledger(self.config, self.attendance_db, self.attendance_file)
+            PROFILE.mark("ledger_opened")
+            recognizer = RecognitionEngine(self.config, self.faces, ledger, self.attendance_dir,
+                                           on_mark=self._on_mark)
+        except Exception as e:
+            self.root.after(0, self._warm_up_failed, e)
+            return
+        self.root.after(0, self._warm_up_done, ledger, ledger_server, recognizer)
+    
+    def _warm_up_done(self, ledger, ledger_server, recognizer):
+        from preview import PreviewRenderer
+        self.ledger, self.ledger_server, self.engine = ledger, ledger_server, recognizer
+        self.preview = PreviewRenderer()
+        self.registration_preview = PreviewRenderer()
+        self.ready = True
+        for widget in self._warmup_widgets:
+            widget.config(state=tk.NORMAL)
+        self.update_faces_list()
+        self.update_summary()
+        self._on_tab_changed()
+        
+        ready = PROFILE.mark("ready")
+        METRICS.set_gauge("startup_ready_seconds", ready)
+        try:
+            PROFILE.write(self.config['startup_profile_file'])
+        except OSError:
+            pass
+        self.readiness_var.set(f"Ready in {ready:.1f}s")
+        self.readiness_label.config(fg='#27ae60')
+        if self.exit_when_ready:
+            self.root.after(0, self.on_closing)
+    
+    def _warm_up_failed(self, error):
+        self.readiness_var.set("Warm-up failed")
+        self.readiness_label.config(fg='#e74c3c')
+        messagebox.showerror("Error", f"Could not load models or data: {error}")
+    
+    def _requires_warm_up(self, widget):
+        # Disabled until the warm-up has loaded models, gallery and ledger
+        widget.config(state=tk.DISABLED)
+        self._warmup_widgets.append(widget)
+        return widget
+    
+    def _on_tab_changed(self, event=None):
+        # The Records tab queries the ledger only once it is first opened
+        if self.ready and not self._records_loaded and self.notebook.select() == str(self.records_tab):
+            self._records_loaded = True
+            self.refresh_records()
+        
+        # The attendance preview only renders while its tab is showing
+        if self._preview_visible():
+            if self.is_camera_running and self._preview_job is None:
+                self._render_preview()
+        elif self._preview_job is not None:
+            self.root.after_cancel(self._preview_job)
+            self._preview_job = None
+    
+    def _preview_visible(self):
+        return self.notebook.select() == str(self.attendance_tab)
+    
+    @property
+    def gallery(self):
+        return self.faces.gallery
     
     def setup_gui(self):
         # Main title
@@ -112,12 +190,19 @@ class KashviSmartFaceAttendanceGUI:
         self.create_attendance_tab()
         self.create_records_tab()
         self.create_settings_tab()
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
         
-        # Status bar
+        # Status bar, with a readiness indicator for the background warm-up
+        status_frame = tk.Frame(self.root, relief=tk.SUNKEN, bd=1, bg='#ecf0f1')
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
         self.status_var = tk.StringVar()
         self.status_var.set("Ready")
-        status_bar = tk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W, bg='#ecf0f1')
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        tk.Label(status_frame, textvariable=self.status_var, anchor=tk.W,
+                 bg='#ecf0f1').pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.readiness_var = tk.StringVar(value="Loading models...")
+        self.readiness_label = tk.Label(status_frame, textvariable=self.readiness_var, anchor=tk.E,
+                                        bg='#ecf0f1', fg='#e67e22')
+        self.readiness_label.pack(side=tk.RIGHT, padx=5)
     
     def create_registration_tab(self):
         reg_frame = ttk.Frame(self.notebook)
@@ -147,10 +232,16 @@ class KashviSmartFaceAttendanceGUI:
         button_frame = tk.Frame(form_frame, bg='white')
         button_frame.pack(pady=20)
         
-        tk.Button(button_frame, text="Register from Camera", command=self.register_from_camera,
-                 bg='#3498db', fg='white', font=('Arial', 10, 'bold'), width=20).pack(side=tk.LEFT, padx=5)
-        tk.Button(button_frame, text="Register from Image", command=self.register_from_image,
-                 bg='#2ecc71', fg='white', font=('Arial', 10, 'bold'), width=20).pack(side=tk.LEFT, padx=5)
+        self._requires_warm_up(tk.Button(button_frame, text="Register from Camera", command=self.register_from_camera,
+                 bg='#3498db', fg='white', font=('Arial', 10, 'bold'), width=20)).pack(side=tk.LEFT, padx=5)
+        self._requires_warm_up(tk.Button(button_frame, text="Register from Image", command=self.register_from_image,
+                 bg='#2ecc71', fg='white', font=('Arial', 10, 'bold'), width=20)).pack(side=tk.LEFT, padx=5)
+        self._requires_warm_up(tk.Button(button_frame, text="Bulk Enroll Folder", command=self.bulk_enroll_folder,
+                 bg='#9b59b6', fg='white', font=('Arial', 10, 'bold'), width=20)).pack(side=tk.LEFT, padx=5)
+        
+        # Bulk enrollment progress
+        self.enroll_progress = ttk.Progressbar(form_frame, orient=tk.HORIZONTAL, mode='determinate')
+        self.enroll_progress.pack(fill=tk.X, padx=20, pady=(0, 10))
         
         # Camera preview frame
         self.camera_frame = tk.Frame(reg_frame, bg='black', relief=tk.SUNKEN, bd=2)
@@ -159,6 +250,7 @@ class KashviSmartFaceAttendanceGUI:
         self.camera_label = tk.Label(self.camera_frame, text="Camera Preview", bg='black', fg='white', 
                                     font=('Arial', 12))
         self.camera_label.pack(expand=True)
+        self.camera_label.image = None
         
         # Registered faces list
         list_frame = tk.Frame(reg_frame, bg='white', relief=tk.RAISED, bd=2)
@@ -178,14 +270,15 @@ class KashviSmartFaceAttendanceGUI:
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         # Delete button
-        tk.Button(list_frame, text="Delete Selected", command=self.delete_selected_face,
-                 bg='#e74c3c', fg='white', font=('Arial', 10, 'bold')).pack(pady=5)
+        self._requires_warm_up(tk.Button(list_frame, text="Delete Selected", command=self.delete_selected_face,
+                 bg='#e74c3c', fg='white', font=('Arial', 10, 'bold'))).pack(pady=5)
         
         self.update_faces_list()
     
     def create_attendance_tab(self):
         att_frame = ttk.Frame(self.notebook)
         self.notebook.add(att_frame, text="Attendance")
+        self.attendance_tab = att_frame
         
         # Control buttons
         control_frame = tk.Frame(att_frame, bg='white', relief=tk.RAISED, bd=2)
@@ -196,8 +289,9 @@ class KashviSmartFaceAttendanceGUI:
         button_frame = tk.Frame(control_frame, bg='white')
         button_frame.pack(pady=10)
         
-        self.start_button = tk.Button(button_frame, text="Start Attendance", command=self.start_attendance,
-                                     bg='#27ae60', fg='white', font=('Arial', 12, 'bold'), width=15)
+        self.start_button = self._requires_warm_up(tk.Button(
+            button_frame, text="Start Attendance", command=self.start_attendance,
+            bg='#27ae60', fg='white', font=('Arial', 12, 'bold'), width=15))
         self.start_button.pack(side=tk.LEFT, padx=10)
         
         self.stop_button = tk.Button(button_frame, text="Stop Attendance", command=self.stop_attendance,
@@ -211,6 +305,22 @@ class KashviSmartFaceAttendanceGUI:
         self.attendance_camera_label = tk.Label(self.attendance_camera_frame, text="Attendance Camera View", 
                                                bg='black', fg='white', font=('Arial', 12))
         self.attendance_camera_label.pack(expand=True)
+        self.attendance_camera_label.image = None
+        
+        # Per-camera ingestion stats
+        self.camera_stats_var = tk.StringVar(value="")
+        tk.Label(att_frame, textvariable=self.camera_stats_var, font=('Arial', 9), justify=tk.LEFT,
+                 anchor=tk.W).pack(fill=tk.X, padx=20)
+        
+        # Rolling per-stage latency and counters
+        perf_frame = tk.Frame(att_frame, bg='white', relief=tk.RAISED, bd=2)
+        perf_frame.pack(fill=tk.X, padx=20, pady=5)
+        self.perf_stats_var = tk.StringVar(value="")
+        tk.Label(perf_frame, textvariable=self.perf_stats_var, font=('Courier', 9), justify=tk.LEFT,
+                 anchor=tk.W, bg='white').pack(side=tk.LEFT, fill=tk.X, expand=True, padx=10)
+        self.profile_button = tk.Button(perf_frame, text="Start Profiling", command=self.toggle_profiling,
+                                        bg='#7f8c8d', fg='white', font=('Arial', 9, 'bold'))
+        self.profile_button.pack(side=tk.RIGHT, padx=10, pady=5)
         
         # Today's attendance summary
         summary_frame = tk.Frame(att_frame, bg='white', relief=tk.RAISED, bd=2)
@@ -218,7 +328,7 @@ class KashviSmartFaceAttendanceGUI:
         
         tk.Label(summary_frame, text="Today's Attendance Summary", font=('Arial', 12, 'bold'), bg='white').pack(pady=5)
         
-        self.summary_text = tk.Text(summary_frame, height=4, font=('Arial', 9))
+        self.summary_text = tk.Text(summary_frame, height=6, font=('Arial', 9))
         self.summary_text.pack(fill=tk.X, padx=10, pady=5)
         
         self.update_summary()
@@ -226,6 +336,7 @@ class KashviSmartFaceAttendanceGUI:
     def create_records_tab(self):
         records_frame = ttk.Frame(self.notebook)
         self.notebook.add(records_frame, text="Records")
+        self.records_tab = records_frame
         
         # Control buttons
         control_frame = tk.Frame(records_frame, bg='white', relief=tk.RAISED, bd=2)
@@ -236,23 +347,78 @@ class KashviSmartFaceAttendanceGUI:
         button_frame = tk.Frame(control_frame, bg='white')
         button_frame.pack(pady=10)
         
-        tk.Button(button_frame, text="Refresh Records", command=self.refresh_records,
-                 bg='#3498db', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
-        tk.Button(button_frame, text="Export Report", command=self.export_report,
-                 bg='#f39c12', fg='white', font=('Arial', 10, 'bold')).pack(side=tk.LEFT, padx=5)
+        self._requires_warm_up(tk.Button(button_frame, text="Refresh Records", command=self.refresh_records,
+                 bg='#3498db', fg='white', font=('Arial', 10, 'bold'))).pack(side=tk.LEFT, padx=5)
+        self.export_button = self._requires_warm_up(tk.Button(button_frame, text="Export Report",
+                 command=self.export_report, bg='#f39c12', fg='white', font=('Arial', 10, 'bold')))
+        self.export_button.pack(side=tk.LEFT, padx=5)
+        self.export_format_var = tk.StringVar(value='csv')
+        ttk.Combobox(button_frame, textvariable=self.export_format_var, values=exporter.EXPORT_FORMATS,
+                     state='readonly', width=7).pack(side=tk.LEFT)
+        self.cancel_export_button = tk.Button(button_frame, text="Cancel", command=self.cancel_export,
+                                              font=('Arial', 10), state=tk.DISABLED)
+        self.cancel_export_button.pack(side=tk.LEFT, padx=5)
+        self._requires_warm_up(tk.Button(button_frame, text="Export Summary", command=self.export_summary,
+                 bg='#16a085', fg='white', font=('Arial', 10, 'bold'))).pack(side=tk.LEFT, padx=5)
+        
+        # Filters, applied by the attendance store rather than in the view
+        filter_frame = tk.Frame(control_frame, bg='white')
+        filter_frame.pack(pady=5)
+        self.filter_vars = {}
+        for key, label, width in (('date_from', "From (YYYY-MM-DD):", 11), ('date_to', "To:", 11),
+                                  ('student', "Student:", 14), ('location', "Location:", 14)):
+            tk.Label(filter_frame, text=label, font=('Arial', 9), bg='white').pack(side=tk.LEFT, padx=(5, 2))
+            self.filter_vars[key] = tk.StringVar()
+            tk.Entry(filter_frame, textvariable=self.filter_vars[key], font=('Arial', 9),
+                     width=width).pack(side=tk.LEFT)
+        tk.Label(filter_frame, text="Section:", font=('Arial', 9), bg='white').pack(side=tk.LEFT, padx=(5, 2))
+        self.filter_vars['section'] = tk.StringVar()
+        sections = [''] + sorted(Rosters.load(self.config['roster_file']).shards)
+        ttk.Combobox(filter_frame, textvariable=self.filter_vars['section'], values=sections,
+                     state='readonly', width=10).pack(side=tk.LEFT)
+        tk.Label(filter_frame, text="Status:", font=('Arial', 9), bg='white').pack(side=tk.LEFT, padx=(5, 2))
+        self.filter_vars['status'] = tk.StringVar()
+        ttk.Combobox(filter_frame, textvariable=self.filter_vars['status'], values=('', 'Present', 'Late'),
+                     state='readonly', width=8).pack(side=tk.LEFT)
+        self._requires_warm_up(tk.Button(filter_frame, text="Apply", command=self.apply_record_filters,
+                 bg='#3498db', fg='white', font=('Arial', 9, 'bold'))).pack(side=tk.LEFT, padx=5)
+        
+        # Export progress
+        self.export_progress = ttk.Progressbar(control_frame, orient=tk.HORIZONTAL, mode='determinate')
+        self.export_progress.pack(fill=tk.X, padx=20, pady=(0, 5))
+        self._export_cancel = None
+        
+        # Pagination
+        page_frame = tk.Frame(control_frame, bg='white')
+        page_frame.pack(pady=5)
+        self._requires_warm_up(tk.Button(page_frame, text="< Prev", command=lambda: self.change_records_page(-1),
+                 font=('Arial', 9))).pack(side=tk.LEFT, padx=5)
+        self.page_var = tk.StringVar(value="")
+        tk.Label(page_frame, textvariable=self.page_var, font=('Arial', 9), bg='white').pack(side=tk.LEFT, padx=5)
+        self._requires_warm_up(tk.Button(page_frame, text="Next >", command=lambda: self.change_records_page(1),
+                 font=('Arial', 9))).pack(side=tk.LEFT, padx=5)
+        
+        # Only one page of rows is ever held by the Treeview
+        self.records_page_size = 100
+        self.records_page = 0
+        self.records_sort = 'id'
+        self.records_descending = True
+        self.records_filters = {}
+        self.records_total = 0
+        self.records_last_id = None
         
         # Records table
         table_frame = tk.Frame(records_frame)
         table_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
         
         # Treeview for records
-        columns = ('Name', 'Student_ID', 'Date', 'Time', 'Status')
+        columns = ('Name', 'Student_ID', 'Date', 'Time', 'Status', 'Location')
         self.records_tree = ttk.Treeview(table_frame, columns=columns, show='headings', height=15)
         
-        # Define column headings
+        # Define column headings; clicking one sorts by it
         for col in columns:
-            self.records_tree.heading(col, text=col)
-            self.records_tree.column(col, width=150)
+            self.records_tree.heading(col, text=col, command=lambda c=col: self.sort_records(c))
+            self.records_tree.column(col, width=130)
         
         # Scrollbars
         v_scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=self.records_tree.yview)
@@ -264,7 +430,8 @@ class KashviSmartFaceAttendanceGUI:
         v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
         
-        self.refresh_records()
+        # Rows are loaded when the tab is first opened (see _on_tab_changed)
+        self.page_var.set("Open to load records")
     
     def create_settings_tab(self):
         settings_frame = ttk.Frame(self.notebook)
@@ -311,6 +478,66 @@ class KashviSmartFaceAttendanceGUI:
         self.location_var = tk.StringVar(value=self.config['location'])
         tk.Entry(location_frame, textvariable=self.location_var, font=('Arial', 10), width=30).pack(side=tk.RIGHT)
         
+        # Face detector backend
+        detector_frame = tk.Frame(form_frame, bg='white')
+        detector_frame.pack(fill=tk.X, padx=20, pady=5)
+        tk.Label(detector_frame, text="Face Detector:", font=('Arial', 10), bg='white').pack(side=tk.LEFT)
+        self.detector_var = tk.StringVar(value=self.config['detector_backend'])
+        ttk.Combobox(detector_frame, textvariable=self.detector_var, values=DETECTOR_BACKENDS,
+                     state='readonly', width=8).pack(side=tk.RIGHT)
+        
+        # Detector input scale
+        scale_frame = tk.Frame(form_frame, bg='white')
+        scale_frame.pack(fill=tk.X, padx=20, pady=5)
+        tk.Label(scale_frame, text="Detector Input Scale:", font=('Arial', 10), bg='white').pack(side=tk.LEFT)
+        self.detector_scale_var = tk.StringVar(value=str(self.config['detector_scale']))
+        tk.Entry(scale_frame, textvariable=self.detector_scale_var, font=('Arial', 10), width=10).pack(side=tk.RIGHT)
+        
+        # HOG upsample count
+        upsample_frame = tk.Frame(form_frame, bg='white')
+        upsample_frame.pack(fill=tk.X, padx=20, pady=5)
+        tk.Label(upsample_frame, text="Detector Upsample Count:", font=('Arial', 10), bg='white').pack(side=tk.LEFT)
+        self.upsample_var = tk.StringVar(value=str(self.config['detector_upsample']))
+        tk.Entry(upsample_frame, textvariable=self.upsample_var, font=('Arial', 10), width=10).pack(side=tk.RIGHT)
+        
+        # Motion gate threshold
+        motion_frame = tk.Frame(form_frame, bg='white')
+        motion_frame.pack(fill=tk.X, padx=20, pady=5)
+        tk.Label(motion_frame, text="Motion Threshold (0 = off):", font=('Arial', 10), bg='white').pack(side=tk.LEFT)
+        self.motion_var = tk.StringVar(value=str(self.config['motion_threshold']))
+        tk.Entry(motion_frame, textvariable=self.motion_var, font=('Arial', 10), width=10).pack(side=tk.RIGHT)
+        
+        # Face encoder backend and micro-batching
+        encoder_frame = tk.Frame(form_frame, bg='white')
+        encoder_frame.pack(fill=tk.X, padx=20, pady=5)
+        tk.Label(encoder_frame, text="Face Encoder:", font=('Arial', 10), bg='white').pack(side=tk.LEFT)
+        self.encoder_var = tk.StringVar(value=self.config['encoder_backend'])
+        ttk.Combobox(encoder_frame, textvariable=self.encoder_var, values=ENCODER_BACKENDS,
+                     state='readonly', width=8).pack(side=tk.RIGHT)
+        
+        batch_frame = tk.Frame(form_frame, bg='white')
+        batch_frame.pack(fill=tk.X, padx=20, pady=5)
+        tk.Label(batch_frame, text="Encoder Max Batch / Wait (ms):", font=('Arial', 10), bg='white').pack(side=tk.LEFT)
+        self.encoder_wait_var = tk.StringVar(value=str(self.config['encoder_max_wait_ms']))
+        tk.Entry(batch_frame, textvariable=self.encoder_wait_var, font=('Arial', 10), width=6).pack(side=tk.RIGHT)
+        self.encoder_batch_var = tk.StringVar(value=str(self.config['encoder_max_batch']))
+        tk.Entry(batch_frame, textvariable=self.encoder_batch_var, font=('Arial', 10), width=6).pack(side=tk.RIGHT)
+        
+        # Face quality gate
+        self.quality_var = tk.BooleanVar(value=bool(self.config['quality_gate']))
+        tk.Checkbutton(form_frame, text="Skip blurred, small or off-angle faces", variable=self.quality_var,
+                       font=('Arial', 10), bg='white').pack(anchor=tk.W, padx=20, pady=5)
+        
+        # Anti-spoofing before a match is marked
+        self.liveness_var = tk.BooleanVar(value=bool(self.config['liveness_check']))
+        tk.Checkbutton(form_frame, text="Require a blink or head turn before marking (liveness check)",
+                       variable=self.liveness_var, font=('Arial', 10), bg='white').pack(anchor=tk.W, padx=20, pady=5)
+        
+        # Haar cascade pre-filter
+        self.prefilter_var = tk.BooleanVar(value=bool(self.config['detector_haar_prefilter']))
+        tk.Checkbutton(form_frame, text="Use Haar cascade pre-filter", variable=self.prefilter_var,
+                       font=('Arial', 10), bg='white').pack(anchor=tk.W, padx=20, pady=5)
+        
         # Save button
         tk.Button(form_frame, text="Save Settings", command=self.save_settings,
                  bg='#27ae60', fg='white', font=('Arial', 10, 'bold')).pack(pady=20)
@@ -327,9 +554,17 @@ class KashviSmartFaceAttendanceGUI:
         self.registration_thread.start()
     
     def _register_camera_thread(self):
+        import cv2
+        from detectors import create_detector, detector_options
+        from encoders import align_faces, encode_faces, encoder_options
+        from quality import QualityGate, face_blur, quality_options
         cap = cv2.VideoCapture(0)
         name = self.name_entry.get().strip()
         student_id = self.id_entry.get().strip()
+        detector = create_detector(detector_options(self.config))
+        gate = QualityGate(**quality_options(self.config)) if self.config['quality_gate'] else None
+        best = None
+        window_start = None
         
         while self.is_registering:
             ret, frame = cap.read()
@@ -337,44 +572,71 @@ class KashviSmartFaceAttendanceGUI:
                 break
             
             rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            faces = face_recognition.face_locations(rgb)
-            
-            # Draw rectangles around faces
-            for (top, right, bottom, left) in faces:
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+            with METRICS.timer("registration_detect"):
+                faces = detector.detect(rgb)
             
-            # Convert frame for tkinter
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_pil = Image.fromarray(frame_rgb)
-            frame_pil = frame_pil.resize((640, 480), Image.Resampling.LANCZOS)
-            frame_tk = ImageTk.PhotoImage(frame_pil)
+            # Hand the latest frame to the Tk thread; while an update is still
+            # queued the frame is only replaced, so a slow UI drops frames
+            # instead of piling up callbacks
+            self._registration_frame = (frame, [((left, top, right, bottom), "", (0, 255, 0))
+                                                for (top, right, bottom, left) in faces])
+            if not self._registration_pending:
+                self._registration_pending = True
+                self.root.after(0, self._update_camera_preview)
             
-            # Update GUI in main thread
-            self.root.after(0, self._update_camera_preview, frame_tk)
+            # Score the largest face in every frame over a 3 second window and
+            # enroll the sharpest, most frontal one rather than the first. With
+            # the quality gate off, the largest face of the window is enrolled.
+            if faces:
+                face = max(faces, key=box_area)
+                top, right, bottom, left = face
+                if gate is None:
+                    score, reasons = float(box_area(face)), []
+                else:
+                    chips, points = align_faces(rgb, [face], with_landmarks=True)
+                    quality = gate.assess(chips[0], points[0], min(bottom - top, right - left),
+                                          face_blur(rgb, face))
+                    score, reasons = (quality.score if quality.ok else None), quality.reasons
+                if score is not None and (best is None or score > best[0]):
+                    best = (score, rgb, face, frame)
+                if window_start is None:
+                    window_start = time.time()
+                elif score is None and best is None:
+                    self.root.after(0, self.status_var.set, f"Face {', '.join(reasons)} - adjust position")
             
-            # Check for face capture
-            if faces and len(faces) > 0:
-                # Auto-capture after 3 seconds of stable face detection
-                encodings = face_recognition.face_encodings(rgb, faces)
+            if window_start is not None and time.time() - window_start >= 3:
+                if best is None:
+                    # Nothing usable yet; start a new window
+                    window_start = None
+                    continue
+                _, best_rgb, face, best_frame = best
+                with METRICS.timer("registration_encode"):
+                    encodings = encode_faces(best_rgb, [face], encoder_options(self.config))
                 if encodings:
-                    self.known_encodings.append(encodings[0])
-                    self.known_names.append(name)
-                    self.known_ids.append(student_id)
+                    self.faces.add(encodings[0], name, student_id)
                     
                     # Save photo
                     photo_name = f"{name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-                    cv2.imwrite(os.path.join(self.faces_dir, photo_name), frame)
-                    
-                    self.save_faces()
+                    cv2.imwrite(os.path.join(self.faces_dir, photo_name), best_frame)
                     self.root.after(0, self._registration_complete, name)
                     break
+                # The encoder found no face in the best frame; score a fresh window
+                best = None
+                window_start = None
+                self.root.after(0, self.status_var.set, "Could not encode the face - hold still and look at the camera")
         
         cap.release()
         self.is_registering = False
     
-    def _update_camera_preview(self, frame_tk):
-        self.camera_label.configure(image=frame_tk, text="")
-        self.camera_label.image = frame_tk
+    def _update_camera_preview(self):
+        # Cleared before the frame is read, so a frame stored after this point
+        # schedules another update
+        self._registration_pending = False
+        frame, overlay = self._registration_frame
+        frame_tk = self.registration_preview.render(frame, overlay)
+        if self.camera_label.image is not frame_tk:
+            self.camera_label.configure(image=frame_tk, text="")
+            self.camera_label.image = frame_tk
     
     def _registration_complete(self, name):
         self.status_var.set(f"Registration completed for {name}")
@@ -399,26 +661,38 @@ class KashviSmartFaceAttendanceGUI:
             return
         
         try:
+            import face_recognition
+            from PIL import Image
+            from detectors import create_detector, detector_options
+            from encoders import align_faces, encode_faces, encoder_options
+            from quality import QualityGate, face_blur, quality_options
             image = face_recognition.load_image_file(image_path)
-            faces = face_recognition.face_locations(image)
+            faces = create_detector(detector_options(self.config)).detect(image)
             
             if not faces:
                 messagebox.showerror("Error", "No face detected in the image.")
                 return
             
-            encodings = face_recognition.face_encodings(image, faces)
+            # Enroll the best-quality face in the photo
+            gate = QualityGate(**quality_options(self.config))
+            chips, points = align_faces(image, faces, with_landmarks=True)
+            scores = [gate.assess(chip, landmarks, min(face[2] - face[0], face[1] - face[3]), face_blur(image, face))
+                      for chip, landmarks, face in zip(chips, points, faces)]
+            best = max(range(len(faces)), key=lambda i: scores[i].score)
+            if not scores[best].ok:
+                messagebox.showwarning("Low Quality", f"Face is {', '.join(scores[best].reasons)}; "
+                                                      f"recognition may be unreliable.")
+            
+            encodings = encode_faces(image, [faces[best]], encoder_options(self.config))
             name = self.name_entry.get().strip()
             student_id = self.id_entry.get().strip()
             
-            self.known_encodings.append(encodings[0])
-            self.known_names.append(name)
-            self.known_ids.append(student_id)
+            self.faces.add(encodings[0], name, student_id)
             
             # Save image
             img = Image.open(image_path)
             img.save(os.path.join(self.faces_dir, f"{name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"))
             
-            self.save_faces()
             self.update_faces_list()
             
             messagebox.showinfo("Success", f"{name} registered successfully from image!")
@@ -429,10 +703,54 @@ class KashviSmartFaceAttendanceGUI:
         except Exception as e:
             messagebox.showerror("Error", f"Registration failed: {str(e)}")
     
+    def bulk_enroll_folder(self):
+        folder = filedialog.askdirectory(title="Select folder of <student_id>_<name> directories")
+        if not folder:
+            return
+        
+        self.status_var.set("Bulk enrollment running...")
+        self.enroll_progress['value'] = 0
+        threading.Thread(target=self._bulk_enroll_thread, args=(folder,), daemon=True).start()
+    
+    def _bulk_enroll_thread(self, folder):
+        import enrollment
+        from encoders import encoder_options
+        from quality import quality_options
+        try:
+            result = enrollment.bulk_enroll(
+                self.faces, folder,
+                progress=lambda done, total: self.root.after(0, self._update_enroll_progress, done, total),
+                encoder_options=encoder_options(self.config),
+                quality_options=quality_options(self.config) if self.config['quality_gate'] else None
+            )
+        except Exception as e:
+            self.root.after(0, messagebox.showerror, "Error", f"Bulk enrollment failed: {str(e)}")
+            return
+        self.root.after(0, self._bulk_enroll_complete, result)
+    
+    def _update_enroll_progress(self, done, total):
+        self.enroll_progress['maximum'] = total
+        self.enroll_progress['value'] = done
+        self.status_var.set(f"Encoding photos... {done}/{total}")
+    
+    def _bulk_enroll_complete(self, result):
+        self.update_faces_list()
+        message = (f"Enrolled {len(result.enrolled)} students.\n"
+                   f"{len(result.failures)} images failed, {len(result.skipped)} students already registered.")
+        if result.failures:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            failures_file = os.path.join(self.report_dir, f"enrollment_failures_{timestamp}.csv")
+            result.write_failures(failures_file)
+            message += f"\nFailures written to {failures_file}"
+        self.status_var.set(f"Bulk enrollment completed: {len(result.enrolled)} students")
+        messagebox.showinfo("Bulk Enrollment", message)
+    
     def update_faces_list(self):
+        if self.faces is None:
+            return
         self.faces_listbox.delete(0, tk.END)
-        for i, name in enumerate(self.known_names):
-            self.faces_listbox.insert(tk.END, f"{name} ({self.known_ids[i]})")
+        for name, student_id in zip(self.gallery.names, self.gallery.ids):
+            self.faces_listbox.insert(tk.END, f"{name} ({student_id})")
     
     def delete_selected_face(self):
         selection = self.faces_listbox.curselection()
@@ -441,13 +759,10 @@ class KashviSmartFaceAttendanceGUI:
             return
         
         index = selection[0]
-        name = self.known_names[index]
+        name = self.gallery.names[index]
         
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {name}?"):
-            self.known_names.pop(index)
-            self.known_encodings.pop(index)
-            self.known_ids.pop(index)
-            self.save_faces()
+            self.faces.remove(index)
             self.update_faces_list()
             messagebox.showinfo("Success", f"{name} deleted successfully!")
     
@@ -457,145 +772,318 @@ class KashviSmartFaceAttendanceGUI:
         self.stop_button.config(state=tk.NORMAL)
         self.status_var.set("Attendance system started")
         
-        self.camera_thread = threading.Thread(target=self._attendance_camera_thread)
+        # Each run gets its own stop event and waits for the previous run to
+        # finish stopping, so a quick Stop/Start never tears down the new run
+        self._camera_stop = threading.Event()
+        self.camera_thread = threading.Thread(target=self._attendance_camera_thread,
+                                              args=(self._camera_stop, self.camera_thread))
         self.camera_thread.daemon = True
         self.camera_thread.start()
+        
+        self._last_preview_seq = None
+        self._render_preview()
     
     def stop_attendance(self):
         self.is_camera_running = False
+        if self._camera_stop is not None:
+            self._camera_stop.set()
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
         self.status_var.set("Attendance system stopped")
         
+        if self._preview_job is not None:
+            self.root.after_cancel(self._preview_job)
+            self._preview_job = None
+        
         # Clear camera display
         self.attendance_camera_label.configure(image="", text="Attendance Camera View")
         self.attendance_camera_label.image = None
     
-    def _attendance_camera_thread(self):
-        cap = cv2.VideoCapture(0)
+    def _attendance_camera_thread(self, stop, previous):
+        if previous is not None:
+            previous.join()
+        if stop.is_set():
+            return
+        try:
+            self.engine.start()
+        except Exception as e:
+            self.engine.stop()
+            self.root.after(0, self._attendance_failed, stop, str(e))
+            return
         
-        while self.is_camera_running:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Face recognition
-            rgb_small = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-            rgb_small = cv2.cvtColor(rgb_small, cv2.COLOR_BGR2RGB)
-            
-            locations = face_recognition.face_locations(rgb_small)
-            encodings = face_recognition.face_encodings(rgb_small, locations)
-            
-            for encoding, (top, right, bottom, left) in zip(encodings, locations):
-                matches = face_recognition.compare_faces(self.known_encodings, encoding, 
-                                                       float(self.config['recognition_tolerance']))
-                name = "Unknown"
-                student_id = ""
-                
-                if True in matches:
-                    idx = matches.index(True)
-                    name = self.known_names[idx]
-                    student_id = self.known_ids[idx]
-                    
-                    if not self.is_already_marked(name):
-                        photo_name = f"{name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-                        photo_path = os.path.join(self.attendance_dir, photo_name)
-                        cv2.imwrite(photo_path, frame)
-                        self.mark_attendance(name, student_id, photo_path)
-                        
-                        # Update summary
-                        self.root.after(0, self.update_summary)
-                
-                # Draw rectangle and label
-                color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
-                scale = 4
-                cv2.rectangle(frame, (left * scale, top * scale), (right * scale, bottom * scale), color, 2)
-                cv2.putText(frame, name, (left * scale, top * scale - 10), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-            
-            # Add title
-            cv2.putText(frame, "Attendance System", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            
-            # Convert frame for tkinter
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_pil = Image.fromarray(frame_rgb)
-            frame_pil = frame_pil.resize((640, 480), Image.Resampling.LANCZOS)
-            frame_tk = ImageTk.PhotoImage(frame_pil)
-            
-            # Update GUI
-            self.root.after(0, self._update_attendance_camera, frame_tk)
+        # Report per-camera FPS, queue depth and drops while the sources run
+        while not stop.wait(1) and self.engine.alive():
+            self.root.after(0, self._update_camera_stats, self.engine.stats())
         
-        cap.release()
+        self.engine.stop()
+    
+    def _attendance_failed(self, stop, message):
+        # Only the current run resets the controls
+        if stop is self._camera_stop and not stop.is_set():
+            self.stop_attendance()
+        self.status_var.set("Attendance system failed to start")
+        messagebox.showerror("Error", f"Could not start the attendance system: {message}")
+    
+    def _render_preview(self):
+        # Runs on the Tk thread at a capped rate and always shows the latest
+        # captured frame with the last known boxes, so a slow recognizer never
+        # makes the preview lag or floods the event queue. The loop stops while
+        # the Attendance tab is hidden and _on_tab_changed restarts it.
+        from preview import preview_interval
+        self._preview_job = None
+        if not self.is_camera_running or not self._preview_visible():
+            return
+        
+        # A minimized window keeps the loop alive but draws nothing
+        latest = self.engine.latest_capture(0) if self.root.state() != 'iconic' else None
+        if latest is not None and latest[0] != self._last_preview_seq:
+            self._last_preview_seq, frame, overlay, title = latest
+            with METRICS.timer("preview_render"):
+                self._update_attendance_camera(self.preview.render(frame, overlay, title))
+        
+        self._preview_job = self.root.after(preview_interval(self.config), self._render_preview)
+    
+    def _update_camera_stats(self, stats):
+        lines = [
+            f"{s['name']}: {s['fps']} fps, queue {s['queue_depth']}/{s['queue_size']}, "
+            f"processed {s['processed']}, dropped {s['dropped']}, tracks {s['tracks']}, "
+            f"detect {s['detect_ms']} ms ({self.config['detector_backend']}), "
+            f"roster {s['shard']} ({s['shard_size']}), {s['mode']}"
+            for s in stats
+        ]
+        encoder = self.engine.encoder_stats()
+        if encoder:
+            lines.append(f"Encoder ({self.config['encoder_backend']}): {encoder['batches']} batches, "
+                         f"avg batch {encoder['avg_batch_size']}, latency {encoder['latency_ms']} ms, "
+                         f"cache hits {encoder['cache_hit_rate']}")
+        liveness = self.engine.liveness_stats()
+        if liveness:
+            lines.append(f"Liveness: {liveness['checks']} checks, {liveness['latency_ms']} ms per check")
+        self.camera_stats_var.set("\n".join(lines))
+        
+        counters, stages = METRICS.snapshot()
+        stage_lines = [
+            f"{stage:<20} p50 {st['p50_ms']:7.1f} ms  p95 {st['p95_ms']:7.1f} ms"
+            for stage, st in sorted(stages.items())
+        ]
+        counter_line = ", ".join(f"{name} {value}" for name, value in sorted(counters.items()))
+        self.perf_stats_var.set("\n".join(stage_lines + [counter_line]))
+    
+    def toggle_profiling(self):
+        if not SAMPLER.running:
+            SAMPLER.start()
+            self.profile_button.config(text="Stop Profiling")
+            self.status_var.set("Profiling all threads...")
+            return
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = SAMPLER.stop(os.path.join(self.report_dir, f"profile_{timestamp}.folded"))
+        self.profile_button.config(text="Start Profiling")
+        self.status_var.set(f"Profile written to {path}")
     
     def _update_attendance_camera(self, frame_tk):
-        self.attendance_camera_label.configure(image=frame_tk, text="")
-        self.attendance_camera_label.image = frame_tk
+        # The renderer updates one PhotoImage in place; the label only needs
+        # pointing at it once
+        if self.attendance_camera_label.image is not frame_tk:
+            self.attendance_camera_label.configure(image=frame_tk, text="")
+            self.attendance_camera_label.image = frame_tk
     
     def is_late(self, current_time):
-        work_start = datetime.strptime(self.config['work_start'], '%H:%M')
-        late_time = work_start + timedelta(minutes=int(self.config['late_threshold']))
-        return current_time > late_time.time()
+        return self.engine.is_late(current_time)
     
-    def is_already_marked(self, name):
-        df = pd.read_csv(self.attendance_file)
-        today = datetime.now().strftime("%Y-%m-%d")
-        return ((df['Name'] == name) & (df['Date'] == today)).any()
+    def is_already_marked(self, student_id):
+        return self.engine.is_already_marked(student_id)
     
-    def mark_attendance(self, name, student_id, photo_path):
-        now = datetime.now()
-        status = "Late" if self.is_late(now.time()) else "Present"
-        
-        df = pd.read_csv(self.attendance_file)
-        new_record = {
-            'Name': name,
-            'Student_ID': student_id,
-            'Date': now.strftime("%Y-%m-%d"),
-            'Time': now.strftime("%H:%M:%S"),
-            'Status': status,
-            'Photo_Path': photo_path
-        }
-        df = pd.concat([df, pd.DataFrame([new_record])], ignore_index=True)
-        df.to_csv(self.attendance_file, index=False)
-        
-        self.status_var.set(f"{name} marked {status} at {now.strftime('%H:%M:%S')}")
+    def mark_attendance(self, name, student_id, photo_path, location=None):
+        return self.engine.mark_attendance(name, student_id, photo_path, location)
+    
+    def _on_mark(self, name, student_id, status, when):
+        # Called from the recognition side; hand over to the Tk thread
+        self.root.after(0, self._attendance_marked, name, status, when)
+    
+    def _attendance_marked(self, name, status, when):
+        self.status_var.set(f"{name} marked {status} at {when.strftime('%H:%M:%S')}")
+        self.update_summary()
+        if self._records_loaded:
+            self.refresh_records()
     
     def update_summary(self):
-        df = pd.read_csv(self.attendance_file)
-        today = datetime.now().strftime("%Y-%m-%d")
-        today_records = df[df['Date'] == today]
+        # Reads the precomputed aggregates; never scans attendance history
+        if self.ledger is None:
+            return
+        now = datetime.now()
+        today = now.strftime("%Y-%m-%d")
+        counts = self.ledger.status_counts(today)
+        
+        present_count = counts.get('Present', 0)
+        late_count = counts.get('Late', 0)
+        total_count = sum(counts.values())
+        # Students, not enrollment rows: re-enrollments add rows for the same id
+        roster = self.roster()
+        absent_count = len(self.ledger.absentees(today, roster))
         
-        present_count = len(today_records[today_records['Status'] == 'Present'])
-        late_count = len(today_records[today_records['Status'] == 'Late'])
-        total_count = len(today_records)
+        week_start = (now - timedelta(days=now.weekday())).strftime("%Y-%m-%d")
+        week = self.ledger.period_rates(len(roster), 'week', week_start, today)
+        week_rate = f"{week[-1][3]:.0%}" if week else "n/a"
+        streaks = self.ledger.late_streaks(3)
         
         summary_text = f"""Today's Attendance Summary ({today}):
 Present: {present_count}
 Late: {late_count}
-Total: {total_count}"""
+Total: {total_count}
+Absent: {absent_count} of {len(roster)} registered
+This week's attendance rate: {week_rate}, students late 3+ days running: {len(streaks)}"""
         
         self.summary_text.delete(1.0, tk.END)
         self.summary_text.insert(tk.END, summary_text)
     
     def refresh_records(self):
+        # Newest-first first page: only fetch rows added since the last one shown
+        if self.records_last_id is not None and self.records_page == 0 \
+                and self.records_sort == 'id' and self.records_descending:
+            filters = dict(self.records_filters, after_id=self.records_last_id)
+            new_rows = self.ledger.query(filters, limit=self.records_page_size)
+            for row in reversed(new_rows):
+                self.records_tree.insert('', 0, values=row[1:6] + row[7:8])
+            if new_rows:
+                self.records_last_id = new_rows[0][0]
+                self.records_total += len(new_rows)
+                for item in self.records_tree.get_children()[self.records_page_size:]:
+                    self.records_tree.delete(item)
+            self._update_page_label()
+            return
+        self.load_records_page()
+    
+    def load_records_page(self):
         # Clear existing records
         for item in self.records_tree.get_children():
             self.records_tree.delete(item)
         
-        # Load and display records
-        df = pd.read_csv(self.attendance_file)
-        for _, row in df.iterrows():
-            self.records_tree.insert('', tk.END, values=(
-                row['Name'], row['Student_ID'], row['Date'], row['Time'], row['Status']
-            ))
+        # Load and display one page
+        self.records_total = self.ledger.count(self.records_filters)
+        rows = self.ledger.query(self.records_filters, self.records_sort, self.records_descending,
+                                 self.records_page_size, self.records_page * self.records_page_size)
+        for row in rows:
+            self.records_tree.insert('', tk.END, values=row[1:6] + row[7:8])
+        
+        if self.records_sort == 'id' and self.records_descending and self.records_page == 0:
+            self.records_last_id = rows[0][0] if rows else 0
+        else:
+            self.records_last_id = None
+        self._update_page_label()
+    
+    def _update_page_label(self):
+        pages = max(1, -(-self.records_total // self.records_page_size))
+        self.page_var.set(f"Page {self.records_page + 1} of {pages} ({self.records_total} records)")
+    
+    def change_records_page(self, step):
+        pages = max(1, -(-self.records_total // self.records_page_size))
+        page = min(max(0, self.records_page + step), pages - 1)
+        if page != self.records_page:
+            self.records_page = page
+            self.load_records_page()
+    
+    def sort_records(self, column):
+        if self.records_sort == column:
+            self.records_descending = not self.records_descending
+        else:
+            self.records_sort = column
+            self.records_descending = False
+        self.records_page = 0
+        self.load_records_page()
+    
+    def _record_filters(self):
+        # Store filters from the Records tab, or None after reporting bad input
+        filters = {key: var.get().strip() for key, var in self.filter_vars.items() if var.get().strip()}
+        for key in ('date_from', 'date_to'):
+            if key in filters:
+                try:
+                    datetime.strptime(filters[key], "%Y-%m-%d")
+                except ValueError:
+                    messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format.")
+                    return None
+        if 'section' in filters:
+            section = filters.pop('section')
+            filters['student_ids'] = sorted(Rosters.load(self.config['roster_file']).members([section]))
+        return filters
+    
+    def apply_record_filters(self):
+        filters = self._record_filters()
+        if filters is None:
+            return
+        self.records_filters = filters
+        self.records_page = 0
+        self.load_records_page()
     
     def export_report(self):
-        df = pd.read_csv(self.attendance_file)
+        # Streams the filtered records, plus a per-student summary, off the Tk thread
+        filters = self._record_filters()
+        if filters is None:
+            return
+        fmt = self.export_format_var.get()
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        report_file = os.path.join(self.report_dir, f"report_{timestamp}.csv")
-        df.to_csv(report_file, index=False)
-        messagebox.showinfo("Success", f"Report exported to {report_file}")
-        self.status_var.set(f"Report exported successfully")
+        report_file = os.path.join(self.report_dir, f"report_{timestamp}.{fmt}")
+        
+        self._export_cancel = threading.Event()
+        self.export_button.config(state=tk.DISABLED)
+        self.cancel_export_button.config(state=tk.NORMAL)
+        self.export_progress['value'] = 0
+        self.status_var.set("Exporting records...")
+        threading.Thread(target=self._export_thread, args=(report_file, fmt, filters, self.roster()),
+                         name="report-export", daemon=True).start()
+    
+    def _export_thread(self, report_file, fmt, filters, roster):
+        try:
+            paths = exporter.export_records(
+                self.ledger, report_file, fmt, filters, roster,
+                progress=lambda done, total: self.root.after(0, self._update_export_progress, done, total),
+                cancel=self._export_cancel
+            )
+        except exporter.ExportCancelled:
+            self.root.after(0, self._export_finished, None, "Export cancelled")
+        except Exception as e:
+            self.root.after(0, self._export_finished, None, f"Export failed: {str(e)}")
+        else:
+            self.root.after(0, self._export_finished, paths, None)
+    
+    def _update_export_progress(self, done, total):
+        self.export_progress['maximum'] = max(1, total)
+        self.export_progress['value'] = done
+        self.status_var.set(f"Exporting records... {done}/{total}")
+    
+    def cancel_export(self):
+        if self._export_cancel is not None:
+            self._export_cancel.set()
+    
+    def _export_finished(self, paths, error):
+        self.export_button.config(state=tk.NORMAL)
+        self.cancel_export_button.config(state=tk.DISABLED)
+        self.export_progress['value'] = 0
+        if error:
+            self.status_var.set(error)
+            if not error.startswith("Export cancelled"):
+                messagebox.showerror("Error", error)
+            return
+        messagebox.showinfo("Success", "Report exported to\n" + "\n".join(paths))
+        self.status_var.set("Report exported successfully")
+    
+    def roster(self):
+        return dict(zip(self.gallery.ids, self.gallery.names))
+    
+    def export_summary(self):
+        # Per-student totals, rates and late streaks from the aggregate tables
+        filters = self._record_filters()
+        if filters is None:
+            return
+        roster = self.roster()
+        if 'student_ids' in filters:
+            section = set(filters['student_ids'])
+            roster = {sid: name for sid, name in roster.items() if str(sid) in section}
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        summary_file = os.path.join(self.report_dir, f"summary_{timestamp}.csv")
+        self.ledger.export_summary_csv(summary_file, roster,
+                                       filters.get('date_from') or None, filters.get('date_to') or None)
+        messagebox.showinfo("Success", f"Summary exported to {summary_file}")
+        self.status_var.set("Summary exported successfully")
     
     def save_settings(self):
         try:
@@ -604,6 +1092,20 @@ Total: {total_count}"""
             self.config['late_threshold'] = int(self.late_threshold_var.get())
             self.config['recognition_tolerance'] = float(self.tolerance_var.get())
             self.config['location'] = self.location_var.get()
+            self.config['detector_backend'] = self.detector_var.get()
+            self.config['detector_scale'] = float(self.detector_scale_var.get())
+            self.config['detector_upsample'] = int(self.upsample_var.get())
+            self.config['motion_threshold'] = float(self.motion_var.get())
+            self.config['detector_haar_prefilter'] = self.prefilter_var.get()
+            self.config['encoder_backend'] = self.encoder_var.get()
+            self.config['quality_gate'] = self.quality_var.get()
+            self.config['liveness_check'] = self.liveness_var.get()
+            self.config['encoder_max_batch'] = int(self.encoder_batch_var.get())
+            self.config['encoder_max_wait_ms'] = float(self.encoder_wait_var.get())
+            missing = missing_dnn_models(self.config) if self.config['detector_backend'] == 'dnn' else []
+            if missing:
+                messagebox.showerror("Error", "DNN detector model files not found:\n" + "\n".join(missing)
+                                     + "\n\nDownload them or pick another detector; HOG is used until then.")
             
             self.save_config()
             messagebox.showinfo("Success", "Settings saved successfully!")
@@ -616,13 +1118,32 @@ Total: {total_count}"""
             self.stop_attendance()
         if hasattr(self, 'is_registering') and self.is_registering:
             self.is_registering = False
+        self.cancel_export()
+        if SAMPLER.running:
+            SAMPLER.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+        if self.engine is not None:
+            self.engine.close()
+        if self.ledger_server is not None:
+            self.ledger_server.stop()
+        if self.ledger is not None:
+            self.ledger.close()
         self.root.destroy()
 
 def main():
+    parser = argparse.ArgumentParser(description="Smart Face Recognition Attendance System")
+    parser.add_argument("--exit-when-ready", action="store_true",
+                        help="quit once warm-up finishes; used to measure cold start")
+    args = parser.parse_args()
+    
     root = tk.Tk()
-    app = KashviSmartFaceAttendanceGUI(root)
+    app = KashviSmartFaceAttendanceGUI(root, exit_when_ready=args.exit_when_ready)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
+    root.after_idle(PROFILE.mark, "window_shown")
     root.mainloop()
+    if args.exit_when_ready:
+        print(PROFILE.report())
 
 if __name__ == "__main__":
     main()
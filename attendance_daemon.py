@@ -0,0 +1,124 @@
+import argparse
+import signal
+import threading
+from datetime import datetime
+
+import cv2
+
+import engine
+from engine import FaceStore, RecognitionEngine
+from ledger_service import open_ledger
+from metrics import SAMPLER, start_metrics_server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="attendance-daemon",
+        description="Run face recognition attendance headless, without the Tk GUI."
+    )
+    parser.add_argument("--config", default=engine.CONFIG_FILE, help="path to config.json")
+    parser.add_argument("--source", action="append", default=[],
+                        help="camera index, video file or stream URL; repeat for several "
+                             "(defaults to camera_sources from the config)")
+    parser.add_argument("--workers", type=int, help="recognition worker processes")
+    parser.add_argument("--location", help="location recorded for marks from --source cameras")
+    parser.add_argument("--preview", action="store_true", help="show an OpenCV preview window per camera")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Prometheus /metrics port (defaults to metrics_port from the config, 0 disables)")
+    parser.add_argument("--ledger", choices=("local", "serve", "connect"),
+                        help="ledger mode (defaults to ledger_mode from the config); 'connect' shares the "
+                             "ledger served by ledger_service.py or another process")
+    parser.add_argument("--stats-interval", type=float, default=10.0,
+                        help="seconds between stats lines (0 disables)")
+    return parser.parse_args(argv)
+
+
+def print_mark(name, student_id, status, when):
+    print(f"{when.strftime('%Y-%m-%d %H:%M:%S')} {name} ({student_id}) marked {status}", flush=True)
+
+
+def print_stats(stats, encoder=None, liveness=None):
+    for s in stats:
+        print(f"[stats] {s['name']}: {s['fps']} fps, queue {s['queue_depth']}/{s['queue_size']}, "
+              f"processed {s['processed']}, dropped {s['dropped']}, tracks {s['tracks']}, "
+              f"detect {s['detect_ms']} ms, roster {s['shard']} ({s['shard_size']}), {s['mode']}", flush=True)
+    if encoder:
+        print(f"[stats] encoder: {encoder['batches']} batches, avg batch {encoder['avg_batch_size']}, "
+              f"latency {encoder['latency_ms']} ms, cache hits {encoder['cache_hit_rate']}", flush=True)
+    if liveness:
+        print(f"[stats] liveness: {liveness['checks']} checks, {liveness['latency_ms']} ms per check", flush=True)
+
+
+def toggle_profiling():
+    if not SAMPLER.running:
+        SAMPLER.start()
+        print("Profiling started", flush=True)
+        return
+    path = SAMPLER.stop(f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded")
+    print(f"Profile written to {path}", flush=True)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = engine.load_config(args.config)
+    if args.workers:
+        config['recognition_workers'] = args.workers
+
+    sources = None
+    if args.source:
+        sources = [
+            {"name": f"Camera {i}", "source": src, "location": args.location or config['location']}
+            for i, src in enumerate(args.source)
+        ]
+
+    if args.ledger:
+        config['ledger_mode'] = args.ledger
+
+    faces = FaceStore(config)
+    ledger, ledger_server = open_ledger(config, engine.ATTENDANCE_DB, engine.ATTENDANCE_FILE)
+    recognizer = RecognitionEngine(config, faces, ledger, on_mark=print_mark)
+
+    # SIGTERM from systemd or a container runtime stops cleanly like Ctrl+C
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 toggles the all-thread stack sampler at runtime
+        signal.signal(signal.SIGUSR1, lambda *_: toggle_profiling())
+
+    metrics_port = config['metrics_port'] if args.metrics_port is None else args.metrics_port
+    metrics_server = start_metrics_server(config['metrics_host'], metrics_port)
+
+    print(f"Starting attendance daemon with {len(faces.gallery)} registered faces", flush=True)
+    recognizer.start(sources)
+    last_stats = datetime.now()
+    try:
+        while not stop.is_set() and recognizer.alive():
+            if args.preview:
+                for i in range(len(recognizer.ingest.captures)):
+                    latest = recognizer.latest_frame(i)
+                    if latest is not None:
+                        cv2.imshow(latest[2], latest[1])
+                if cv2.waitKey(int(1000 / max(1, int(config['preview_fps'])))) & 0xFF == ord('q'):
+                    break
+            else:
+                stop.wait(0.5)
+
+            if args.stats_interval and (datetime.now() - last_stats).total_seconds() >= args.stats_interval:
+                print_stats(recognizer.stats(), recognizer.encoder_stats(), recognizer.liveness_stats())
+                last_stats = datetime.now()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recognizer.close()
+        if ledger_server is not None:
+            ledger_server.stop()
+        ledger.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if args.preview:
+            cv2.destroyAllWindows()
+    print("Attendance daemon stopped", flush=True)
+
+
+if __name__ == "__main__":
+    main()
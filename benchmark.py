@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import engine
+from detectors import create_detector, detector_options
+from encoders import encode_faces, encoder_options
+from ledger import AttendanceLedger
+from metrics import METRICS
+
+# Higher is better for these; every other metric is a cost
+HIGHER_IS_BETTER = ('fps', 'match_queries_per_s')
+
+
+def peak_rss_mb(children=False):
+    # Lifetime high-water mark, so each gallery size runs in its own process;
+    # children covers pool workers that have already been joined
+    try:
+        import resource
+    except ImportError:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0, 1)
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "count": 0}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3),
+        "count": len(samples)
+    }
+
+
+def synthetic_store(size, folder, config, enrolled=(), seed=0):
+    # A throwaway FaceStore under folder: the enrolled (encoding, name, id)
+    # triples plus size random encodings with roughly the spread of dlib face
+    # descriptors, so the fixture's faces match among many strangers
+    store = engine.FaceStore(dict(config, adaptive_templates=False),
+                             face_data_file=os.path.join(folder, "none.pkl"),
+                             gallery_file=os.path.join(folder, "gallery.json"))
+    dim = len(enrolled[0][0]) if enrolled else store.gallery.dim
+    rng = np.random.default_rng(seed)
+    encodings = [encoding for encoding, _, _ in enrolled] + list(
+        rng.normal(0.0, 0.09, size=(size, dim)).astype(np.float32))
+    names = [name for _, name, _ in enrolled] + [f"Synthetic {i}" for i in range(size)]
+    ids = [sid for _, _, sid in enrolled] + [f"S{i:06d}" for i in range(size)]
+    store.add_many(np.asarray(encodings, dtype=np.float32), names, ids)
+    return store
+
+
+def enroll_fixture_faces(faces, config):
+    # [(encoding, name, student_id)] for the photos pasted into a fixture
+    detector = create_detector(detector_options(config))
+    enrolled = []
+    for i, image in enumerate(faces):
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        locations = detector.detect(rgb)
+        if not locations:
+            continue
+        largest = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+        encodings = encode_faces(rgb, [largest], encoder_options(config))
+        if encodings:
+            enrolled.append((np.asarray(encodings[0], dtype=np.float32), f"Fixture {i}", f"F{i:03d}"))
+    return enrolled
+
+
+def _fixture_faces(folder, limit=4):
+    # Up to `limit` photos to paste into a fixture, centre-cropped to squares
+    faces = []
+    if not folder or not os.path.isdir(folder):
+        return faces
+    for name in sorted(os.listdir(folder)):
+        image = cv2.imread(os.path.join(folder, name))
+        if image is not None:
+            height, width = image.shape[:2]
+            side = min(height, width)
+            top, left = (height - side) // 2, (width - side) // 2
+            faces.append(image[top:top + side, left:left + side])
+        if len(faces) >= limit:
+            break
+    return faces
+
+
+def make_fixture(path, faces=(), seconds=10, fps=15, size=(640, 480), seed=0):
+    # Writes a synthetic video: the given face photos drift across a noisy,
+    # slowly changing background, so decode, motion and detection see realistic
+    # work. Without photos, drawn head shapes stand in; the detector then finds
+    # nothing and only decode and detection cost is measured.
+    rng = np.random.default_rng(seed)
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    if not writer.isOpened():
+        raise IOError(f"cannot write video: {path}")
+    side = height // 2
+    sprites = [cv2.resize(face, (side, side), interpolation=cv2.INTER_AREA) for face in faces]
+    if not sprites:
+        for shade in (150, 190):
+            sprite = np.full((side, side, 3), 90, np.uint8)
+            cv2.ellipse(sprite, (side // 2, side // 2), (side // 3, side * 2 // 5), 0, 0, 360, (shade,) * 3, -1)
+            for x in (side // 3, side * 2 // 3):
+                cv2.circle(sprite, (x, side * 2 // 5), side // 16, (40, 40, 40), -1)
+            sprites.append(sprite)
+    paths = [(rng.uniform(0, width - side), rng.uniform(0, height - side),
+              rng.uniform(-3, 3), rng.uniform(-2, 2)) for _ in sprites]
+    background = rng.integers(60, 120, size=(height, width, 3), dtype=np.uint8)
+    try:
+        for index in range(int(seconds * fps)):
+            frame = background + np.uint8(index % 20)
+            for sprite, (x, y, dx, dy) in zip(sprites, paths):
+                left = int(abs((x + dx * index) % (2 * (width - side)) - (width - side)))
+                top = int(abs((y + dy * index) % (2 * (height - side)) - (height - side)))
+                frame[top:top + side, left:left + side] = sprite
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def bench_video(path, faces, config, folder, max_frames=0):
+    # Plays the video as a camera through the live attendance path: capture,
+    # quality-gated detection in the pool, EncoderService batching and cache,
+    # tracking and vote confirmation, roster shard search and ledger.mark.
+    # Files are paced at their native frame rate like a real stream, so fps
+    # below the video's own rate means recognition fell behind.
+    name = os.path.basename(path)
+    ledger = AttendanceLedger(os.path.join(folder, f"{name}.db"))
+    recognizer = engine.RecognitionEngine(config, faces, ledger, attendance_dir=os.path.join(folder, "evidence"))
+    METRICS.reset()
+    started = time.perf_counter()
+    recognizer.start([{"name": name, "source": path, "location": config['location']}])
+    capture = recognizer.ingest.captures[0]
+    try:
+        while recognizer.alive() and not (max_frames and capture.captured >= max_frames):
+            time.sleep(0.05)
+    finally:
+        recognizer.close()
+    elapsed = time.perf_counter() - started
+    counters, stages = METRICS.snapshot()
+    marks = ledger.count()
+    ledger.close()
+    return {
+        "video": name,
+        "frames": capture.captured,
+        "processed": capture.processed,
+        "dropped": capture.dropped + capture.stale,
+        "faces": counters.get("faces_detected", 0),
+        "low_quality": counters.get("faces_low_quality", 0),
+        "marks": marks,
+        "fps": round(capture.processed / elapsed, 2) if elapsed else None,
+        "stages": {stage: {"p50": round(st['p50_ms'], 3), "p95": round(st['p95_ms'], 3), "count": st['count']}
+                   for stage, st in stages.items()}
+    }
+
+
+def bench_matching(gallery, queries=1000, batch=8, seed=1):
+    # Frame-sized batches of random queries against the gallery alone
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0.0, 0.09, size=(queries, gallery.dim)).astype(np.float32)
+    samples = []
+    started = time.perf_counter()
+    for i in range(0, queries, batch):
+        t0 = time.perf_counter()
+        gallery.search(data[i:i + batch])
+        samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return {
+        "match_queries_per_s": round(queries / elapsed, 1) if elapsed else None,
+        "match_batch": percentiles(samples)
+    }
+
+
+def run_size(args, size):
+    # One gallery size; run in its own process by run() so peak RSS is its own
+    config = engine.load_config(args.config, save=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        config = dict(config, roster_file=os.path.join(tmp, "rosters.json"), template_file=os.path.join(tmp, "t.json"))
+        enrolled = enroll_fixture_faces(_fixture_faces(args.fixture_faces), config) if args.video else []
+        faces = synthetic_store(size, tmp, dict(config, gallery_approximate=args.approximate), enrolled)
+        run_report = {"gallery_size": size, "approximate": args.approximate, "enrolled_fixture_faces": len(enrolled)}
+        run_report.update(bench_matching(faces.gallery, batch=args.batch))
+        run_report["videos"] = [bench_video(path, faces, config, tmp, args.max_frames) for path in args.video]
+    run_report["peak_rss_mb"] = peak_rss_mb()
+    run_report["worker_peak_rss_mb"] = peak_rss_mb(children=True)
+    return run_report
+
+
+def run(args):
+    config = engine.load_config(args.config, save=False)
+    report = {
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "detector": config['detector_backend'],
+        "detector_scale": config['detector_scale'],
+        "encoder": config['encoder_backend'],
+        "quality_gate": config['quality_gate'],
+        "runs": []
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.gallery_size:
+            output = os.path.join(tmp, f"run_{size}.json")
+            command = [sys.executable, os.path.abspath(__file__), "--run-size", str(size), "--output", output,
+                       "--config", args.config, "--fixture-faces", args.fixture_faces,
+                       "--batch", str(args.batch), "--max-frames", str(args.max_frames)]
+            command += ["--approximate"] if args.approximate else []
+            for path in args.video:
+                command += ["--video", path]
+            subprocess.run(command, check=True)
+            with open(output) as f:
+                run_report = json.load(f)
+            report["runs"].append(run_report)
+            print(f"gallery {size}: {run_report['match_queries_per_s']} match queries/s, "
+                  + ", ".join(f"{v['video']} {v['fps']} fps, {v['marks']} marks" for v in run_report["videos"]))
+    return report
+
+
+def flatten(report):
+    # {"<gallery size>/<metric path>": value} for comparing two reports
+    metrics = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}/{key}", item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[prefix] = value
+
+    for run_report in report["runs"]:
+        prefix = str(run_report["gallery_size"])
+        walk(prefix, {k: v for k, v in run_report.items() if k not in ("videos", "gallery_size")})
+        for video in run_report["videos"]:
+            walk(f"{prefix}/{video['video']}", {"fps": video["fps"], "stages": video["stages"]})
+    return metrics
+
+
+def compare(baseline, current, threshold=0.1):
+    regressions = []
+    old, new = flatten(baseline), flatten(current)
+    for key, before in old.items():
+        after = new.get(key)
+        if after is None or not before or key.endswith('/count'):
+            continue
+        change = (after - before) / float(before)
+        if key.rsplit('/', 1)[-1] in HIGHER_IS_BETTER:
+            change = -change
+        if change > threshold:
+            regressions.append((key, before, after, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the live attendance path on video fixtures.")
+    parser.add_argument("--video", action="append", default=[], help="recorded video fixture; repeatable")
+    parser.add_argument("--make-fixture", metavar="PATH",
+                        help="write a synthetic video fixture to PATH and benchmark it along with --video")
+    parser.add_argument("--fixture-faces", default=engine.FACES_DIR,
+                        help="photos pasted into the synthetic fixture and enrolled among the synthetic "
+                             "students (default: the enrollment photos)")
+    parser.add_argument("--fixture-seconds", type=float, default=10.0)
+    parser.add_argument("--gallery-size", type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument("--approximate", action="store_true", help="use the IVF gallery index")
+    parser.add_argument("--batch", type=int, default=8, help="faces per matching call")
+    parser.add_argument("--max-frames", type=int, default=0, help="frames per video (0 = all)")
+    parser.add_argument("--config", default=engine.CONFIG_FILE)
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--compare", help="baseline report to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_size is not None:
+        with open(args.output, 'w') as f:
+            json.dump(run_size(args, args.run_size), f)
+        return
+
+    if args.make_fixture:
+        make_fixture(args.make_fixture, _fixture_faces(args.fixture_faces), args.fixture_seconds)
+        print(f"Fixture written to {args.make_fixture}")
+        args.video.append(args.make_fixture)
+
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        for key, before, after, change in regressions:
+            print(f"REGRESSION {key}: {before} -> {after} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
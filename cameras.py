@@ -0,0 +1,392 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from functools import partial
+
+import cv2
+
+from detectors import MotionGate, create_detector
+from encoders import EmbeddingCache, EncoderService, align_faces, get_encoder
+from quality import QualityGate, face_blur, perceptual_hash
+from metrics import METRICS
+from tracking import FaceTracker, iou
+
+log = logging.getLogger(__name__)
+
+DETECT_SCALE = 0.25
+
+# Detector instances built inside each pool worker, keyed by their options
+_worker_detectors = {}
+
+
+def parse_source(source):
+    # Device indices may come from JSON as ints or digit strings; anything else is
+    # a video file path or a stream URL that cv2.VideoCapture can open directly
+    if isinstance(source, str) and source.strip().isdigit():
+        return int(source)
+    return source
+
+
+def get_detector(options):
+    key = tuple(sorted((options or {}).items()))
+    if key not in _worker_detectors:
+        _worker_detectors[key] = create_detector(options or {})
+    return _worker_detectors[key]
+
+
+def detect_and_gate(small_rgb, skip_boxes, iou_threshold, detector_options, quality_options, full_frame=None):
+    # Detects faces, drops those overlapping a settled track and aligns the rest.
+    # With quality_options, blurred, small, turned or badly lit crops are dropped
+    # too. Blur is judged on full_frame, the frame small_rgb was scaled from;
+    # without it the caller judges blur (MultiCameraIngest._sharp).
+    # Returns (locations, kept indices, their chips, rejected count, timings).
+    started = time.perf_counter()
+    locations = [tuple(loc) for loc in get_detector(detector_options).detect(small_rgb)]
+    detected = time.perf_counter()
+    timings = {"detect": detected - started}
+    todo = [i for i, loc in enumerate(locations)
+            if not any(iou(loc, box) >= iou_threshold for box in skip_boxes)]
+    if not todo:
+        return locations, [], [], 0, timings
+
+    chips, points = align_faces(small_rgb, [locations[i] for i in todo], with_landmarks=True)
+    rejected = 0
+    if quality_options:
+        gate = QualityGate(**quality_options)
+        scale = float((detector_options or {}).get('scale', DETECT_SCALE))
+        kept = []
+        for i, chip, landmarks in zip(todo, chips, points):
+            top, right, bottom, left = locations[i]
+            blur = face_blur(full_frame, locations[i], scale) if full_frame is not None else None
+            if gate.assess(chip, landmarks, min(bottom - top, right - left) / scale, blur).ok:
+                kept.append((i, chip))
+        rejected = len(todo) - len(kept)
+        todo, chips = [i for i, _ in kept], [chip for _, chip in kept]
+    timings["align"] = time.perf_counter() - detected
+    return locations, todo, chips, rejected, timings
+
+
+def detect_and_encode(small_rgb, skip_boxes=(), iou_threshold=0.3, detector_options=None, quality_options=None):
+    # Runs inside a pool worker process, outside the GIL of the GUI process.
+    # Faces overlapping a settled track or failing the quality gate are detected
+    # but not encoded; their slot in the returned encodings is None.
+    locations, todo, chips, rejected, timings = detect_and_gate(
+        small_rgb, skip_boxes, iou_threshold, detector_options, quality_options)
+    encodings = [None] * len(locations)
+    if chips:
+        started = time.perf_counter()
+        for i, encoding in zip(todo, get_encoder({}).encode(chips)):
+            encodings[i] = encoding
+        timings["encode"] = time.perf_counter() - started
+    return locations, encodings, rejected, timings
+
+
+def detect_and_align(small_rgb, skip_boxes=(), iou_threshold=0.3, detector_options=None, quality_options=None):
+    # Batched-encoder variant of detect_and_encode: returns the aligned chips of
+    # the faces worth encoding, their indices and perceptual hashes for the
+    # embedding cache, instead of encoding them here
+    locations, todo, chips, rejected, timings = detect_and_gate(
+        small_rgb, skip_boxes, iou_threshold, detector_options, quality_options)
+    return locations, todo, chips, [perceptual_hash(chip) for chip in chips], rejected, timings
+
+
+class CaptureThread(threading.Thread):
+    # One lightweight reader per source; the newest frames are kept in a bounded
+    # queue and the oldest one is dropped when recognition falls behind. The very
+    # latest frame is also published on its own for the display stage. While
+    # idle, only every idle_stride-th frame is decoded; the rest are grabbed.
+
+    def __init__(self, name, source, location='', queue_size=1, tracker=None, motion_gate=None,
+                 idle_stride=10, idle_gate=None):
+        super().__init__(daemon=True)
+        # Thread name shows up in py-spy dumps and the stack sampler
+        self.name = name
+        self.source = parse_source(source)
+        self.location = location
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.running = False
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.stale = 0
+        self.skipped = 0
+        self.motion_skipped = 0
+        self.detect_ms = 0.0
+        self.motion_gate = motion_gate
+        self.fps = 0.0
+        self.latest = None
+        self.tracker = tracker or FaceTracker()
+        self.idle = False
+        self.idle_stride = max(1, int(idle_stride))
+        self.idle_gate = idle_gate
+
+    def run(self):
+        cap = cv2.VideoCapture(self.source)
+        # Video files standing in for a stream are paced at their native frame rate
+        frame_delay = 0.0
+        if isinstance(self.source, str) and os.path.isfile(self.source):
+            file_fps = cap.get(cv2.CAP_PROP_FPS)
+            frame_delay = 1.0 / file_fps if file_fps > 0 else 0.0
+
+        window_start = time.time()
+        window_frames = 0
+        while self.running:
+            if self.idle and self.captured % self.idle_stride:
+                # Advance without decoding a frame nobody will look at
+                if not cap.grab():
+                    break
+                self.captured += 1
+                if frame_delay:
+                    time.sleep(frame_delay)
+                continue
+            with METRICS.timer("capture"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            self.captured += 1
+            window_frames += 1
+            METRICS.inc("frames_in")
+
+            item = (self.captured, time.time(), frame)
+            self.latest = item
+            try:
+                self.frames.put_nowait(item)
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                    METRICS.inc("frames_dropped")
+                except queue.Empty:
+                    pass
+                self.frames.put_nowait(item)
+
+            elapsed = time.time() - window_start
+            if elapsed >= 1.0:
+                self.fps = window_frames / elapsed
+                window_start = time.time()
+                window_frames = 0
+
+            if frame_delay:
+                time.sleep(frame_delay)
+
+        cap.release()
+        self.running = False
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "location": self.location,
+            "fps": round(self.fps, 1),
+            "queue_depth": self.frames.qsize(),
+            "queue_size": self.frames.maxsize,
+            "captured": self.captured,
+            "processed": self.processed,
+            "dropped": self.dropped + self.stale,
+            "skipped": self.skipped,
+            "motion_skipped": self.motion_skipped,
+            "detect_ms": round(self.detect_ms, 1),
+            "tracks": len(self.tracker.tracks),
+            "mode": "idle" if self.idle else "active",
+        }
+
+
+class MultiCameraIngest:
+    # Fans frames from every capture thread into a shared multiprocessing pool of
+    # detector/encoder workers. Results come back on the pool's result thread,
+    # so on_result calls (and therefore ledger writes) are serialized.
+    # With a batched encoder backend, workers only detect and align; the chips of
+    # several frames and cameras are then encoded together by an EncoderService.
+
+    def __init__(self, sources, on_result, workers=2, queue_size=1, default_location='', max_frame_age=1.0,
+                 detect_every=1, tracker_options=None, detector_options=None, motion_threshold=0.0,
+                 encoder_options=None, encoder_max_batch=16, encoder_max_wait=0.02, quality_options=None,
+                 cache_size=256, idle_stride=10, idle_motion_threshold=0.01,
+                 idle_detector_options=None):
+        self.captures = [
+            CaptureThread(
+                s.get('name', f"Camera {i}"), s.get('source', 0),
+                location=s.get('location', default_location), queue_size=queue_size,
+                tracker=FaceTracker(**(tracker_options or {})),
+                motion_gate=MotionGate(motion_threshold) if motion_threshold > 0 else None,
+                idle_stride=idle_stride,
+                idle_gate=MotionGate(idle_motion_threshold) if idle_motion_threshold > 0 else None
+            )
+            for i, s in enumerate(sources)
+        ]
+        self.detector_options = detector_options or {}
+        self.scale = float(self.detector_options.get('scale', DETECT_SCALE))
+        # Cheaper detection while a camera is idle; same scale, so boxes line up
+        self.idle_detector_options = dict(self.detector_options, **(idle_detector_options or {}))
+        self.idle_detector_options['scale'] = self.scale
+        self.on_result = on_result
+        self.max_frame_age = max_frame_age
+        self.detect_every = max(1, int(detect_every))
+        self.encoder_options = encoder_options or {}
+        self.batched = self.encoder_options.get('backend', 'inline') != 'inline'
+        self.encoder_max_batch = encoder_max_batch
+        self.encoder_max_wait = encoder_max_wait
+        self.quality_options = quality_options
+        self.blur_gate = QualityGate(**quality_options) if quality_options else None
+        self.cache_size = int(cache_size)
+        self.encoder = None
+        self.workers = max(1, int(workers))
+        self.errors = 0
+        self.running = False
+        self.pool = None
+        self._inflight = threading.BoundedSemaphore(self.workers * 2)
+        self._dispatcher = None
+
+    def start(self):
+        self.pool = multiprocessing.get_context('spawn').Pool(self.workers)
+        if self.batched:
+            cache = EmbeddingCache(self.cache_size) if self.cache_size > 0 else None
+            self.encoder = EncoderService(self.pool, self.encoder_options,
+                                          self.encoder_max_batch, self.encoder_max_wait, cache)
+        self.running = True
+        for capture in self.captures:
+            capture.running = True
+            capture.start()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="frame-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def alive(self):
+        return self.running and (
+            any(c.is_alive() for c in self.captures) or any(not c.frames.empty() for c in self.captures)
+        )
+
+    def _dispatch(self):
+        while self.running:
+            # Sleep only after a pass over the cameras found no frames at all
+            no_frames = True
+            for capture in self.captures:
+                try:
+                    seq, timestamp, frame = capture.frames.get_nowait()
+                except queue.Empty:
+                    continue
+                no_frames = False
+
+                # Detection only runs every Nth frame; tracks carry identities between.
+                # Idle cameras already publish only every idle_stride-th frame and
+                # are processed only when something moves.
+                idle_mode = capture.idle
+                if not idle_mode and seq % self.detect_every:
+                    capture.skipped += 1
+                    METRICS.inc("frames_skipped")
+                    continue
+                gate = capture.idle_gate if idle_mode else capture.motion_gate
+                if gate is not None and not gate.changed(frame):
+                    capture.motion_skipped += 1
+                    METRICS.inc("frames_skipped")
+                    continue
+
+                # Bounded in-flight work: while the pool is busy, frames wait in the
+                # capture queues where stale ones get dropped
+                while self.running and not self._inflight.acquire(timeout=0.5):
+                    pass
+                if not self.running:
+                    return
+
+                # A frame that waited too long is no longer worth recognizing
+                if time.time() - timestamp > self.max_frame_age:
+                    self._inflight.release()
+                    capture.stale += 1
+                    METRICS.inc("frames_dropped")
+                    continue
+
+                small = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale)
+                small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+                skip_boxes = capture.tracker.frozen_boxes(seq)
+                self.pool.apply_async(
+                    detect_and_align if self.batched else detect_and_encode,
+                    (small, skip_boxes, capture.tracker.iou_threshold,
+                     self.idle_detector_options if idle_mode else self.detector_options, self.quality_options),
+                    callback=partial(self._on_done, capture, seq, timestamp, frame),
+                    error_callback=self._on_error
+                )
+            if no_frames:
+                time.sleep(0.005)
+
+    def _on_done(self, capture, seq, timestamp, frame, result):
+        self._inflight.release()
+        capture.processed += 1
+        if self.batched:
+            locations, todo, chips, hashes, rejected, timings = result
+            sharp = self._sharp(frame, locations, todo)
+            if len(sharp) < len(todo):
+                kept = [k for k, i in enumerate(todo) if i in sharp]
+                todo, chips, hashes = sharp, [chips[k] for k in kept], [hashes[k] for k in kept]
+        else:
+            locations, encodings, rejected, timings = result
+            encoded = [i for i, encoding in enumerate(encodings) if encoding is not None]
+            for i in set(encoded) - set(self._sharp(frame, locations, encoded)):
+                encodings[i] = None
+        METRICS.inc("frames_out")
+        METRICS.inc("faces_detected", len(locations))
+        METRICS.inc("faces_low_quality", rejected)
+        for stage, seconds in timings.items():
+            METRICS.observe(stage, seconds)
+        # Exponential moving average of the detector's per-frame cost
+        detect_ms = timings["detect"] * 1000
+        capture.detect_ms = 0.9 * capture.detect_ms + 0.1 * detect_ms if capture.detect_ms else detect_ms
+        if self.batched and chips and self.encoder is not None:
+            self.encoder.submit(chips, partial(self._on_encoded, capture, seq, timestamp, frame, locations, todo),
+                                hashes, capture.name)
+            return
+        if self.batched:
+            encodings = [None] * len(locations)
+        self._deliver(capture, seq, timestamp, frame, locations, encodings)
+
+    def _sharp(self, frame, locations, indices):
+        # Workers only see the downscaled frame, so blur is judged here on the
+        # full-resolution one; returns the indices of the sharp faces
+        if self.blur_gate is None or not indices:
+            return indices
+        sharp = [i for i in indices if self.blur_gate.sharp(face_blur(frame, locations[i], self.scale))]
+        METRICS.inc("faces_low_quality", len(indices) - len(sharp))
+        return sharp
+
+    def _on_encoded(self, capture, seq, timestamp, frame, locations, todo, chip_encodings):
+        # Called on the pool's result thread like _on_done, so delivery stays serialized
+        encodings = [None] * len(locations)
+        for i, encoding in zip(todo, chip_encodings or ()):
+            encodings[i] = encoding
+        self._deliver(capture, seq, timestamp, frame, locations, encodings)
+
+    def _deliver(self, capture, seq, timestamp, frame, locations, encodings):
+        try:
+            self.on_result(capture, seq, timestamp, frame, locations, encodings)
+        except Exception:
+            self.errors += 1
+            METRICS.inc("result_errors")
+            log.exception("Handling a result from %s failed", capture.name)
+
+    def _on_error(self, exc):
+        self._inflight.release()
+        self.errors += 1
+        METRICS.inc("worker_errors")
+        log.error("Recognition task failed", exc_info=exc)
+
+    def stats(self):
+        return [capture.stats() for capture in self.captures]
+
+    def encoder_stats(self):
+        # Achieved batch sizes and latency of the batched encoder, if one is running
+        return self.encoder.stats() if self.encoder is not None else None
+
+    def stop(self):
+        self.running = False
+        for capture in self.captures:
+            capture.running = False
+        for capture in self.captures:
+            if capture.is_alive():
+                capture.join(timeout=2)
+        if self.encoder is not None:
+            self.encoder.stop()
+            self.encoder = None
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
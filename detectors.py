@@ -0,0 +1,130 @@
+import logging
+
+import cv2
+import numpy as np
+
+from settings import DETECTOR_BACKENDS, DNN_PROTOTXT, DNN_MODEL, missing_dnn_models
+
+log = logging.getLogger(__name__)
+
+
+def _xywh_to_css(x, y, w, h):
+    # OpenCV boxes -> face_recognition's (top, right, bottom, left)
+    return int(y), int(x + w), int(y + h), int(x)
+
+
+class HogDetector:
+    name = 'hog'
+
+    def __init__(self, upsample=1):
+        self.upsample = upsample
+
+    def detect(self, rgb):
+        import face_recognition
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=self.upsample, model='hog')
+
+
+class DnnDetector:
+    # OpenCV DNN (res10 SSD) face detector, CPU only
+    name = 'dnn'
+
+    def __init__(self, prototxt=DNN_PROTOTXT, model=DNN_MODEL, confidence=0.5):
+        self.net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.confidence = confidence
+
+    def detect(self, rgb):
+        h, w = rgb.shape[:2]
+        bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        blob = cv2.dnn.blobFromImage(cv2.resize(bgr, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()[0, 0]
+        boxes = []
+        for det in detections:
+            if det[2] < self.confidence:
+                continue
+            left, top, right, bottom = (det[3:7] * np.array([w, h, w, h])).astype(int)
+            left, top = max(0, left), max(0, top)
+            right, bottom = min(w - 1, right), min(h - 1, bottom)
+            if right > left and bottom > top:
+                boxes.append((int(top), int(right), int(bottom), int(left)))
+        return boxes
+
+
+class HaarDetector:
+    name = 'haar'
+
+    def __init__(self, scale_factor=1.1, min_neighbors=5):
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def detect(self, rgb):
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        faces = self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors)
+        return [_xywh_to_css(*face) for face in faces]
+
+
+class HaarPrefilter:
+    # Cheap Haar pass first; the accurate detector only runs when it finds something
+    def __init__(self, detector):
+        self.detector = detector
+        self.haar = HaarDetector(min_neighbors=3)
+        self.name = f"haar+{detector.name}"
+
+    def detect(self, rgb):
+        if not self.haar.detect(rgb):
+            return []
+        return self.detector.detect(rgb)
+
+
+def create_detector(options):
+    backend = options.get('backend', 'hog')
+    if backend == 'dnn':
+        detector = DnnDetector(options.get('dnn_prototxt', DNN_PROTOTXT), options.get('dnn_model', DNN_MODEL),
+                               float(options.get('dnn_confidence', 0.5)))
+    elif backend == 'haar':
+        detector = HaarDetector()
+    else:
+        detector = HogDetector(int(options.get('upsample', 1)))
+    if options.get('haar_prefilter') and backend != 'haar':
+        detector = HaarPrefilter(detector)
+    return detector
+
+
+def detector_options(config):
+    backend = config['detector_backend']
+    if backend == 'dnn':
+        missing = missing_dnn_models(config)
+        if missing:
+            # Every detection task would fail in the workers; detect with HOG instead
+            log.error("DNN detector model files not found (%s); falling back to hog", ", ".join(missing))
+            backend = 'hog'
+    return {
+        "backend": backend,
+        "scale": float(config['detector_scale']),
+        "upsample": int(config['detector_upsample']),
+        "haar_prefilter": bool(config['detector_haar_prefilter']),
+        "dnn_prototxt": config['dnn_prototxt'],
+        "dnn_model": config['dnn_model'],
+        "dnn_confidence": float(config['dnn_confidence'])
+    }
+
+
+class MotionGate:
+    # Frame differencing on a tiny grayscale copy; detection is skipped while the
+    # scene is static. The first frame always counts as motion.
+    def __init__(self, threshold=0.01, pixel_delta=25, size=(64, 48)):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.size = size
+        self._previous = None
+
+    def changed(self, frame):
+        gray = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        previous, self._previous = self._previous, gray
+        if previous is None:
+            return True
+        moving = np.count_nonzero(cv2.absdiff(gray, previous) > self.pixel_delta)
+        return moving / float(gray.size) >= self.threshold
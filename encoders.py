@@ -0,0 +1,235 @@
+import collections
+import threading
+import time
+from functools import partial
+
+import numpy as np
+
+from metrics import METRICS
+from settings import ENCODER_BACKENDS
+
+CHIP_SIZE = 150
+
+# Encoder instances built inside each pool worker, keyed by their options
+_worker_encoders = {}
+
+
+def align_faces(rgb, locations, with_landmarks=False):
+    # 150x150 aligned face chips, the same ones dlib's descriptor computes internally.
+    # with_landmarks also returns each face's 5 landmark points as a (5, 2) array.
+    import dlib
+    import face_recognition.api as fr_api
+    shapes = dlib.full_object_detections()
+    for location in locations:
+        shapes.append(fr_api.pose_predictor_5_point(rgb, fr_api._css_to_rect(location)))
+    chips = list(dlib.get_face_chips(rgb, shapes, size=CHIP_SIZE, padding=0.25)) if len(shapes) else []
+    if not with_landmarks:
+        return chips
+    points = [np.array([(p.x, p.y) for p in shape.parts()], dtype=np.float32) for shape in shapes]
+    return chips, points
+
+
+class DlibEncoder:
+    def encode(self, chips):
+        import face_recognition.api as fr_api
+        # One batched call over every chip instead of one call per image
+        return [np.array(d) for d in fr_api.face_encoder.compute_face_descriptor(chips, 0)]
+
+
+class OnnxEncoder:
+    # CPU-only ONNX Runtime embedding model (e.g. an ArcFace-style network).
+    # Galleries must be enrolled with the same backend and recognition_tolerance
+    # tuned for its embedding space.
+    def __init__(self, model_path, input_size=112, threads=1):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.input_size = input_size
+
+    def encode(self, chips):
+        import cv2
+        batch = np.stack([cv2.resize(chip, (self.input_size, self.input_size)) for chip in chips])
+        batch = ((batch.astype(np.float32) - 127.5) / 128.0).transpose(0, 3, 1, 2)
+        embeddings = self.session.run(None, {self.input_name: batch})[0]
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
+        return list(embeddings)
+
+
+def create_encoder(options):
+    if options.get('backend') == 'onnx':
+        return OnnxEncoder(options['onnx_model'], int(options.get('onnx_input_size', 112)))
+    return DlibEncoder()
+
+
+def get_encoder(options):
+    key = tuple(sorted((options or {}).items()))
+    if key not in _worker_encoders:
+        _worker_encoders[key] = create_encoder(options or {})
+    return _worker_encoders[key]
+
+
+def encoder_options(config):
+    return {
+        "backend": config['encoder_backend'],
+        "onnx_model": config['onnx_model'],
+        "onnx_input_size": int(config['onnx_input_size'])
+    }
+
+
+def encode_chips(chips, options=None):
+    # Pool worker entry point: (encodings, seconds)
+    started = time.perf_counter()
+    encodings = get_encoder(options).encode(chips) if chips else []
+    return encodings, time.perf_counter() - started
+
+
+def encode_faces(rgb, locations, options=None):
+    # Unbatched helper for registration paths, using the configured backend
+    if not options or options.get('backend', 'inline') in ('inline', 'dlib'):
+        import face_recognition
+        return face_recognition.face_encodings(rgb, locations)
+    return get_encoder(options).encode(align_faces(rgb, locations))
+
+
+class EmbeddingCache:
+    # LRU of embeddings keyed on a perceptual hash of the aligned crop, scoped per
+    # camera. Only an identical hash reuses an embedding: aligned crops are
+    # normalized so tightly that two people can land a few bits apart.
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope, phash):
+        with self._lock:
+            key = (scope, phash)
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, scope, phash, encoding):
+        with self._lock:
+            self._entries[(scope, phash)] = encoding
+            self._entries.move_to_end((scope, phash))
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+
+class EncoderService:
+    # Gathers face chips from many frames and cameras into micro-batches and runs
+    # each batch as one pool task. A batch is sent once it reaches max_batch
+    # chips or its oldest request has waited max_wait seconds.
+
+    def __init__(self, pool, options, max_batch=16, max_wait=0.02, cache=None):
+        self.pool = pool
+        self.cache = cache
+        self.options = options
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = float(max_wait)
+        self.batches = 0
+        self.chips = 0
+        self.last_latency_ms = 0.0
+        self._pending = []
+        self._cond = threading.Condition()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="encoder-service", daemon=True)
+        self._thread.start()
+
+    def submit(self, chips, callback, hashes=None, scope=None):
+        # callback(encodings) is called with one encoding per chip, or None on failure.
+        # With hashes, cached embeddings are reused and only the misses are batched.
+        if self.cache is not None and hashes is not None:
+            cached = [self.cache.get(scope, phash) for phash in hashes]
+            missing = [i for i, encoding in enumerate(cached) if encoding is None]
+            METRICS.inc("embedding_cache_hits", len(chips) - len(missing))
+            if not missing:
+                callback(cached)
+                return
+            callback = partial(self._merge, callback, cached, missing, [hashes[i] for i in missing], scope)
+            chips = [chips[i] for i in missing]
+        with self._cond:
+            self._pending.append((time.perf_counter(), chips, callback))
+            self._cond.notify()
+
+    def _pending_chips(self):
+        return sum(len(chips) for _, chips, _ in self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self.running and not self._pending:
+                    self._cond.wait()
+                if not self.running:
+                    return
+                deadline = self._pending[0][0] + self.max_wait
+                while self.running and self._pending_chips() < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                # Whole requests only, so each frame's faces stay in one batch
+                batch, size = [], 0
+                while self._pending and (not batch or size + len(self._pending[0][1]) <= self.max_batch):
+                    request = self._pending.pop(0)
+                    batch.append(request)
+                    size += len(request[1])
+                if not self.running:
+                    return
+
+            chips = [chip for _, request_chips, _ in batch for chip in request_chips]
+            self.batches += 1
+            self.chips += len(chips)
+            METRICS.inc("encode_batches")
+            METRICS.set_gauge("encode_batch_size_avg", round(self.chips / float(self.batches), 2))
+            self.pool.apply_async(encode_chips, (chips, self.options),
+                                  callback=partial(self._done, batch),
+                                  error_callback=partial(self._failed, batch))
+
+    def _done(self, batch, result):
+        encodings, seconds = result
+        METRICS.observe("encode", seconds)
+        # Queue wait plus compute, measured from the oldest request in the batch
+        self.last_latency_ms = (time.perf_counter() - batch[0][0]) * 1000
+        METRICS.observe("encode_batch_latency", self.last_latency_ms / 1000)
+        offset = 0
+        for _, chips, callback in batch:
+            callback(encodings[offset:offset + len(chips)])
+            offset += len(chips)
+
+    def _merge(self, callback, cached, missing, hashes, scope, encodings):
+        if encodings is not None:
+            for i, phash, encoding in zip(missing, hashes, encodings):
+                cached[i] = encoding
+                self.cache.put(scope, phash, encoding)
+        callback(cached)
+
+    def _failed(self, batch, exc):
+        METRICS.inc("worker_errors")
+        for _, _, callback in batch:
+            callback(None)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "avg_batch_size": round(self.chips / float(self.batches), 2) if self.batches else 0.0,
+            "latency_ms": round(self.last_latency_ms, 1),
+            "cache_hit_rate": round(self.cache.hit_rate(), 3) if self.cache is not None else None
+        }
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
@@ -0,0 +1,429 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+import cv2
+
+from settings import (FACES_DIR, ATTENDANCE_DIR, REPORT_DIR, ATTENDANCE_FILE, ATTENDANCE_DB, FACE_DATA_FILE,
+                      GALLERY_FILE, CONFIG_FILE, DEFAULT_CONFIG, load_config, save_config)
+from gallery import FaceGallery
+from gallery_store import GalleryFile, migrate_pickle
+from cameras import MultiCameraIngest
+from detectors import detector_options
+from encoders import encoder_options
+from quality import quality_options
+from liveness import LivenessChecker, liveness_options
+from templates import TemplateSet, template_options
+from rosters import ShardManager
+from timetable import Timetable
+from evidence import EvidenceWriter
+from metrics import METRICS
+
+
+def draw_overlay(frame, overlay, title=None):
+    # Draw rectangle and label
+    for (left, top, right, bottom), name, color in overlay:
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+        cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+    # Add title
+    if title:
+        cv2.putText(frame, title, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    return frame
+
+
+def is_late(config, current_time):
+    work_start = datetime.strptime(config['work_start'], '%H:%M')
+    late_time = work_start + timedelta(minutes=int(config['late_threshold']))
+    return current_time > late_time.time()
+
+
+def window_keys(timetable, location, student_id, now):
+    # The session windows open for a student at a location now; a track that
+    # was marked under one set owes the next window when it changes
+    return frozenset((session.key, phase) for session, phase in timetable.windows(location, now, student_id))
+
+
+def session_actions(ledger, timetable, student_id, location, now):
+    # [(session, phase)] a student still owes at a location now: a check-in
+    # not yet recorded, or a check-out after checking in
+    date = now.strftime("%Y-%m-%d")
+    actions = []
+    for session, phase in timetable.windows(location, now, student_id):
+        state = ledger.session_state(session.key, date, student_id)
+        if phase == 'checkin' and state is None:
+            actions.append((session, phase))
+        elif phase == 'checkout' and state is not None and state[0] and not state[1]:
+            actions.append((session, phase))
+    return actions
+
+
+def record_mark(config, ledger, timetable, name, student_id, photo_path, location, now):
+    # Writes what seeing a student at `now` means: check-ins and check-outs of
+    # open session windows, then the day's mark. Timetabled sessions decide
+    # Present/Late themselves. Returns (status or None when nothing was
+    # recorded, whether the daily mark was written).
+    date, clock = now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")
+    status = None
+    for session, phase in session_actions(ledger, timetable, student_id, location, now):
+        if phase == 'checkin':
+            session_status = session.status(now)
+            if ledger.check_in(session.key, name, student_id, date, clock, session_status, location):
+                METRICS.inc("session_check_ins")
+                status = status or session_status
+        elif ledger.check_out(session.key, student_id, date, clock):
+            METRICS.inc("session_check_outs")
+            status = status or "Checked out"
+
+    # Atomic check-and-insert: another camera process may have marked them first
+    daily = status if status in ("Present", "Late") else ("Late" if is_late(config, now.time()) else "Present")
+    written = ledger.mark(name, student_id, date, clock, daily, photo_path, location)
+    if not written and status is None:
+        return None, False
+    return status or daily, written
+
+
+def tracker_options(config):
+    return {
+        "iou_threshold": float(config['track_iou_threshold']),
+        "min_votes": int(config['track_min_votes']),
+        "reencode_interval": int(config['track_reencode_interval'])
+    }
+
+
+class FaceStore:
+    # Persistent gallery of enrolled faces shared by the GUI and the daemon. The
+    # old face_encodings.pkl is migrated to the memory-mapped format on first load.
+
+    def __init__(self, config, face_data_file=FACE_DATA_FILE, gallery_file=GALLERY_FILE):
+        self.config = config
+        self.face_data_file = face_data_file
+        self.file = GalleryFile(gallery_file, dtype=config['gallery_dtype'])
+        self.gallery = None
+        self.templates = None
+        self.load()
+
+    def _gallery_options(self):
+        return {
+            "approximate": bool(self.config['gallery_approximate']),
+            "n_lists": int(self.config['gallery_ivf_lists']),
+            "n_probe": int(self.config['gallery_ivf_probe'])
+        }
+
+    def load(self):
+        if self.file.exists():
+            self.gallery = self.file.load(**self._gallery_options())
+        elif os.path.exists(self.face_data_file):
+            self.gallery = migrate_pickle(self.face_data_file, self.file, **self._gallery_options())
+        else:
+            self.gallery = FaceGallery(**self._gallery_options())
+            self.file.write(self.gallery)
+        # Learned templates are matched alongside the enrolled faces (rosters.py)
+        if self.config['adaptive_templates']:
+            self.templates = TemplateSet(self, **template_options(self.config))
+
+    def save(self):
+        self.file.write(self.gallery)
+
+    def add(self, encoding, name, student_id):
+        self.gallery.add(encoding, name, student_id)
+        self.file.append([encoding], [name], [student_id])
+        if self.templates is not None:
+            self.templates.restart_trend(student_id)
+
+    def add_many(self, encodings, names, ids):
+        # Appended to the data file; bulk enrollment lands with a single write
+        self.gallery.extend(encodings, names, ids)
+        self.file.append(encodings, names, ids)
+
+    def remove(self, index):
+        student_id = self.gallery.ids[index]
+        self.gallery.remove(index)
+        self.file.delete(index, self.gallery)
+        if self.templates is not None and str(student_id) not in (str(i) for i in self.gallery.ids):
+            self.templates.forget(student_id)
+
+
+class RecognitionEngine:
+    # Capture, recognition and marking without any UI. Callers observe it through
+    # on_mark(name, student_id, status, when) and the per-camera overlays.
+
+    def __init__(self, config, faces, ledger, attendance_dir=ATTENDANCE_DIR, on_mark=None):
+        self.config = config
+        self.faces = faces
+        self.ledger = ledger
+        self.attendance_dir = attendance_dir
+        self.on_mark = on_mark
+        self.ingest = None
+        self.overlays = {}
+        os.makedirs(self.attendance_dir, exist_ok=True)
+        self.evidence = EvidenceWriter(
+            self.attendance_dir,
+            fmt=config['evidence_format'],
+            quality=config['evidence_quality'],
+            thumb_size=config['evidence_thumb_size'],
+            full_frame=bool(config['evidence_full_frame']),
+            full_frame_width=config['evidence_full_frame_width'],
+            archive=bool(config['evidence_archive']),
+            retention_days=config['evidence_retention_days'],
+            queue_size=int(config['evidence_queue_size'])
+        )
+        self.shards = ShardManager(faces, config['roster_file'], float(config['shard_recheck_seconds']),
+                                   bool(config['shard_fallback']))
+        self.liveness = None
+        # Sessions come from the roster schedule; reloaded when rosters.json changes
+        self.timetable = Timetable()
+        self._timetable_mtime = False
+        self._closed = set()
+        self._scheduler = None
+        self._scheduler_stop = threading.Event()
+        self._load_timetable()
+
+    def start(self, sources=None):
+        self.overlays = {}
+        self.liveness = LivenessChecker(**liveness_options(self.config)) if self.config['liveness_check'] else None
+        self.ingest = MultiCameraIngest(
+            sources or self.config['camera_sources'], self.handle_result,
+            workers=int(self.config['recognition_workers']),
+            queue_size=int(self.config['frame_queue_size']),
+            default_location=self.config['location'],
+            max_frame_age=float(self.config['max_frame_age']),
+            detect_every=int(self.config['detect_every_n_frames']),
+            tracker_options=tracker_options(self.config),
+            detector_options=detector_options(self.config),
+            motion_threshold=float(self.config['motion_threshold']),
+            encoder_options=encoder_options(self.config),
+            encoder_max_batch=int(self.config['encoder_max_batch']),
+            encoder_max_wait=float(self.config['encoder_max_wait_ms']) / 1000.0,
+            quality_options=quality_options(self.config) if self.config['quality_gate'] else None,
+            cache_size=int(self.config['embedding_cache_size']),
+            idle_stride=int(self.config['idle_frame_stride']),
+            idle_motion_threshold=float(self.config['idle_motion_threshold']),
+            idle_detector_options={"upsample": int(self.config['idle_detector_upsample'])}
+        )
+        # Build each camera's roster shard before the first frame arrives
+        self.shards.preload(capture.location for capture in self.ingest.captures)
+        self._apply_schedule(datetime.now())
+        self.ingest.start()
+        self._scheduler_stop.clear()
+        self._scheduler = threading.Thread(target=self._schedule, name="session-scheduler", daemon=True)
+        self._scheduler.start()
+
+    def _load_timetable(self):
+        path = self.config['roster_file']
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime != self._timetable_mtime:
+            self.timetable = Timetable.load(path, int(self.config['late_threshold']))
+            self._timetable_mtime = mtime
+
+    def _schedule(self):
+        while not self._scheduler_stop.wait(float(self.config['schedule_check_seconds'])):
+            try:
+                self._load_timetable()
+                now = datetime.now()
+                self._apply_schedule(now)
+                self.close_sessions(now)
+            except Exception:
+                METRICS.inc("schedule_errors")
+            self._flush_templates()
+
+    def _flush_templates(self):
+        if self.faces.templates is None:
+            return
+        try:
+            self.faces.templates.flush()
+        except OSError:
+            METRICS.inc("template_flush_errors")
+
+    def _apply_schedule(self, now):
+        # Full-rate recognition inside check-in/check-out windows, the low-rate
+        # motion-triggered idle mode outside them
+        for capture in self.ingest.captures:
+            idle = not self.timetable.busy(capture.location, now)
+            if idle != capture.idle:
+                capture.idle = idle
+                METRICS.inc("schedule_switches")
+        METRICS.set_gauge("cameras_idle", sum(capture.idle for capture in self.ingest.captures))
+
+    def close_sessions(self, now=None):
+        # Settles today's finished sessions at this engine's locations: Absent
+        # for no-shows, Left early for missed check-outs
+        now = now or datetime.now()
+        date = now.strftime("%Y-%m-%d")
+        locations = {capture.location for capture in self.ingest.captures} if self.ingest else None
+        names = dict(zip((str(i) for i in self.faces.gallery.ids), self.faces.gallery.names))
+        for session in self.timetable.due(now, locations):
+            if (session.key, date) in self._closed:
+                continue
+            self.ledger.close_session(session.key, date, self.timetable.roster(session, names),
+                                      session.location, session.checkout)
+            self._closed.add((session.key, date))
+            METRICS.inc("sessions_closed")
+
+    def alive(self):
+        return self.ingest is not None and self.ingest.alive()
+
+    def stats(self):
+        if self.ingest is None:
+            return []
+        stats = self.ingest.stats()
+        for s in stats:
+            names, size = self.shards.describe(s['location'])
+            s['shard'] = "+".join(names) or "global"
+            s['shard_size'] = size if names else len(self.faces.gallery)
+        return stats
+
+    def encoder_stats(self):
+        return self.ingest.encoder_stats() if self.ingest is not None else None
+
+    def liveness_stats(self):
+        # Checks run so far and their mean latency, or None when disabled
+        return self.liveness.stats() if self.liveness is not None else None
+
+    def stop(self):
+        self._scheduler_stop.set()
+        if self._scheduler is not None:
+            self._scheduler.join(timeout=2)
+            self._scheduler = None
+        if self.ingest is not None:
+            self.ingest.stop()
+        self._flush_templates()
+
+    def close(self):
+        # Flushes queued evidence photos; call once when shutting down
+        self.stop()
+        self.evidence.close()
+
+    def latest_capture(self, index=0):
+        # (seq, raw frame, overlay, title) of a source's newest frame, or None.
+        # The frame is shared with the capture thread and must not be drawn on.
+        if self.ingest is None or index >= len(self.ingest.captures):
+            return None
+        capture = self.ingest.captures[index]
+        latest = capture.latest
+        if latest is None:
+            return None
+        return latest[0], latest[2], self.overlays.get(capture.name, []), f"Attendance System - {capture.name}"
+
+    def latest_frame(self, index=0):
+        # (seq, annotated frame, camera name) of a source's newest frame, or None
+        latest = self.latest_capture(index)
+        if latest is None:
+            return None
+        seq, frame, overlay, title = latest
+        return seq, draw_overlay(frame.copy(), overlay, title), self.ingest.captures[index].name
+
+    def handle_result(self, capture, seq, timestamp, frame, locations, encodings):
+        tracker = capture.tracker
+        tracks = tracker.update(locations, seq)
+
+        # Only new, unsettled or drifting tracks were encoded; match those in one
+        # batch against the camera's roster shard, falling back to everyone
+        fresh = [(track, encoding) for track, encoding in zip(tracks, encodings) if encoding is not None]
+        if fresh:
+            with METRICS.timer("match"):
+                matches = self.shards.search(capture.location, [encoding for _, encoding in fresh],
+                                             float(self.config['recognition_tolerance']))
+            for (track, encoding), (identity, distance) in zip(fresh, matches):
+                METRICS.inc("matches" if identity is not None else "unknowns")
+                track.vote(identity, distance, seq, encoding)
+
+        scale = 1.0 / self.ingest.scale
+        overlay = []
+        for track in tracks:
+            (top, right, bottom, left) = track.box
+            box = tuple(int(v * scale) for v in (left, top, right, bottom))
+            name = "Unknown"
+            color = (0, 0, 255)
+
+            if track.identity is not None:
+                name, student_id = track.identity
+                color = (0, 255, 0)
+                now = datetime.now()
+
+                # Someone still in view when a new session window opens owes it a
+                # check-in or check-out
+                if track.marked and not self._window_keys(capture.location, student_id, now) <= track.windows:
+                    track.marked = False
+
+                # A student with nothing owed needs neither a mark nor a check
+                if not track.marked and tracker.is_confirmed(track) and \
+                        not self.needs_mark(student_id, capture.location, now):
+                    track.marked = True
+                    track.windows = self._window_keys(capture.location, student_id, now)
+
+                # Liveness is only checked for matched faces that still need a
+                # mark; the verdict is cached on the track
+                live = True
+                if not track.marked and self.liveness is not None:
+                    live = self.liveness.check(track, frame, (box[1], box[2], box[3], box[0]))
+                    if live is None:
+                        color = (0, 255, 255)
+                    elif not live:
+                        name, color = f"{name} (liveness failed)", (0, 0, 255)
+
+                # Commit only once enough frames agree on who this is
+                if live and not track.marked and tracker.is_confirmed(track):
+                    track.marked = True
+                    track.windows = self._window_keys(capture.location, student_id, now)
+                    self.mark_attendance(name, student_id, '', capture.location, evidence=(frame, box))
+                    self.learn(track)
+
+            overlay.append((box, name, color))
+
+        # The display stage draws these on whatever frame is newest
+        self.overlays[capture.name] = overlay
+
+    def learn(self, track):
+        # Folds a confidently matched, live track's best encoding into the
+        # student's adaptive templates
+        templates = self.faces.templates
+        identity = track.identity
+        if templates is None or identity not in track.best_encoding:
+            return
+        if track.confidence < float(self.config['template_min_confidence']):
+            return
+        if self.liveness is not None and (track.liveness is None or not track.liveness.live):
+            return
+        with METRICS.timer("template_fold"):
+            templates.fold(identity[0], identity[1], track.best_encoding[identity], track.best_distance[identity])
+
+    def is_late(self, current_time):
+        return is_late(self.config, current_time)
+
+    def is_already_marked(self, student_id):
+        today = datetime.now().strftime("%Y-%m-%d")
+        return self.ledger.is_marked(student_id, today)
+
+    def _window_keys(self, location, student_id, now):
+        return window_keys(self.timetable, location, student_id, now)
+
+    def _session_actions(self, student_id, location, now):
+        return session_actions(self.ledger, self.timetable, student_id, location, now)
+
+    def needs_mark(self, student_id, location, now=None):
+        # The day's first mark, or a check-in/check-out of an open session window
+        now = now or datetime.now()
+        return not self.is_already_marked(student_id) or bool(self._session_actions(student_id, location, now))
+
+    def mark_attendance(self, name, student_id, photo_path, location=None, evidence=None):
+        # evidence: (frame, box) to photograph the mark with. It is queued only
+        # once the ledger accepts the mark, so refused repeats leave no files;
+        # an empty path means the writer's queue was full.
+        now = datetime.now()
+        location = location or self.config['location']
+        if evidence is not None:
+            photo_path = self.evidence.path_for(name, student_id, now) or ''
+        with METRICS.timer("ledger_write"):
+            status, written = record_mark(self.config, self.ledger, self.timetable, name, student_id,
+                                          photo_path, location, now)
+        if written:
+            METRICS.inc("marks")
+            if evidence is not None and photo_path:
+                # Written in the background
+                self.evidence.submit(evidence[0], evidence[1], name, student_id, now)
+        if status is None:
+            return None
+
+        if self.on_mark is not None:
+            self.on_mark(name, student_id, status, now)
+        return status
@@ -0,0 +1,177 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+from encoders import align_faces, encode_chips
+from quality import QualityGate, face_blur
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def discover_folder(folder):
+    # <student_id>_<name>/<photo>.jpg -> {(student_id, name): [paths]}
+    students = {}
+    for entry in sorted(os.listdir(folder)):
+        path = os.path.join(folder, entry)
+        if not os.path.isdir(path) or '_' not in entry:
+            continue
+        student_id, name = entry.split('_', 1)
+        images = [
+            os.path.join(path, f) for f in sorted(os.listdir(path))
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        if images:
+            students[(student_id, name.replace('_', ' '))] = images
+    return students
+
+
+def discover_manifest(manifest_file):
+    # CSV with student_id,name,image_path columns; paths are relative to the manifest
+    base = os.path.dirname(os.path.abspath(manifest_file))
+    students = {}
+    with open(manifest_file, newline='') as f:
+        for row in csv.DictReader(f):
+            key = (row['student_id'].strip(), row['name'].strip())
+            students.setdefault(key, []).append(os.path.join(base, row['image_path'].strip()))
+    return students
+
+
+def discover(source):
+    if os.path.isfile(source):
+        return discover_manifest(source)
+    return discover_folder(source)
+
+
+def encode_image(task):
+    # Pool worker: returns (key, path, encoding or None, failure reason or None).
+    # With align_only set the "encoding" is the aligned face chip, encoded later
+    # in batches. With quality options, low-quality photos are reported as failures.
+    import face_recognition
+    key, path, align_only, quality = task
+    try:
+        image = face_recognition.load_image_file(path)
+    except Exception as e:
+        return key, path, None, f"unreadable image: {e}"
+    faces = face_recognition.face_locations(image)
+    if not faces:
+        return key, path, None, "no face"
+    if len(faces) > 1:
+        return key, path, None, f"multiple faces ({len(faces)})"
+    if quality:
+        chips, points = align_faces(image, faces, with_landmarks=True)
+        top, right, bottom, left = faces[0]
+        assessed = QualityGate(**quality).assess(chips[0], points[0], min(bottom - top, right - left),
+                                                 face_blur(image, faces[0]))
+        if not assessed.ok:
+            return key, path, None, f"low quality ({', '.join(assessed.reasons)})"
+    if align_only:
+        return key, path, align_faces(image, faces)[0], None
+    return key, path, face_recognition.face_encodings(image, faces)[0], None
+
+
+class EnrollmentResult:
+    def __init__(self):
+        self.enrolled = []
+        self.failures = []
+        self.skipped = []
+
+    def write_failures(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Student_ID', 'Name', 'Image', 'Reason'])
+            for (student_id, name), image, reason in self.failures:
+                writer.writerow([student_id, name, image, reason])
+
+
+def bulk_enroll(faces, source, workers=None, progress=None, encoder_options=None, batch_size=32,
+                quality_options=None):
+    # Encodes every photo in parallel, averages each student's photos into one
+    # template and commits all new students to the gallery in a single write.
+    # Batched encoder backends align faces first, then encode the chips in
+    # batches of batch_size.
+    students = discover(source)
+    encoder_options = encoder_options or {}
+    batched = encoder_options.get('backend', 'inline') != 'inline'
+    result = EnrollmentResult()
+
+    existing = set(str(i) for i in faces.gallery.ids)
+    tasks = []
+    for key, paths in students.items():
+        if key[0] in existing:
+            result.skipped.append(key)
+            continue
+        tasks.extend((key, path, batched, quality_options) for path in paths)
+
+    encodings = {}
+    if tasks:
+        workers = workers or os.cpu_count() or 1
+        with multiprocessing.get_context('spawn').Pool(workers) as pool:
+            aligned = []
+            for done, (key, path, encoding, reason) in enumerate(
+                    pool.imap_unordered(encode_image, tasks, chunksize=4), 1):
+                if encoding is None:
+                    result.failures.append((key, path, reason))
+                elif batched:
+                    aligned.append((key, encoding))
+                else:
+                    encodings.setdefault(key, []).append(encoding)
+                if progress is not None:
+                    progress(done, len(tasks))
+
+            batches = [aligned[i:i + batch_size] for i in range(0, len(aligned), batch_size)]
+            jobs = [([chip for _, chip in batch], encoder_options) for batch in batches]
+            for batch, (batch_encodings, _) in zip(batches, pool.starmap(encode_chips, jobs)):
+                for (key, _), encoding in zip(batch, batch_encodings):
+                    encodings.setdefault(key, []).append(encoding)
+
+    new_encodings, new_names, new_ids = [], [], []
+    for key in students:
+        if key in encodings:
+            new_encodings.append(np.mean(encodings[key], axis=0))
+            new_ids.append(key[0])
+            new_names.append(key[1])
+            result.enrolled.append(key)
+
+    if new_encodings:
+        faces.add_many(new_encodings, new_names, new_ids)
+    return result
+
+
+def _print_progress(done, total):
+    width = 40
+    filled = int(width * done / total)
+    sys.stdout.write(f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total}")
+    sys.stdout.flush()
+    if done == total:
+        sys.stdout.write("\n")
+
+
+def main(argv=None):
+    import engine
+    from engine import FaceStore
+    from encoders import encoder_options
+    from quality import quality_options
+
+    parser = argparse.ArgumentParser(description="Bulk enroll students from a photo folder or manifest CSV.")
+    parser.add_argument("source", help="folder of <student_id>_<name>/ directories, or a manifest CSV")
+    parser.add_argument("--workers", type=int, help="encoder processes (defaults to CPU count)")
+    parser.add_argument("--config", default=engine.CONFIG_FILE)
+    parser.add_argument("--failures", help="write failed images to this CSV")
+    args = parser.parse_args(argv)
+
+    config = engine.load_config(args.config)
+    faces = FaceStore(config)
+    result = bulk_enroll(faces, args.source, args.workers, _print_progress, encoder_options(config),
+                         quality_options=quality_options(config) if config['quality_gate'] else None)
+    print(f"Enrolled {len(result.enrolled)} students, {len(result.failures)} images failed, "
+          f"{len(result.skipped)} already registered")
+    if args.failures and result.failures:
+        result.write_failures(args.failures)
+
+
+if __name__ == "__main__":
+    main()
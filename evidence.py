@@ -0,0 +1,200 @@
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+import cv2
+
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+ENCODE_PARAMS = {
+    'jpg': cv2.IMWRITE_JPEG_QUALITY,
+    'webp': cv2.IMWRITE_WEBP_QUALITY
+}
+
+
+class EvidenceWriter:
+    # Saves attendance evidence off the recognition path. Each mark gets a face
+    # thumbnail and optionally a downscaled full frame, written under a
+    # <root>/YYYY/MM/DD/ layout or packed into one <root>/YYYY/MM/DD.zip per day.
+    # When the queue is full new evidence is dropped rather than blocking. A
+    # failed item is logged and counted, and the writer carries on.
+
+    def __init__(self, root_dir, fmt='jpg', quality=85, thumb_size=160, full_frame=True,
+                 full_frame_width=640, archive=False, retention_days=0, queue_size=64, batch_size=16):
+        self.root_dir = root_dir
+        self.fmt = fmt if fmt in ENCODE_PARAMS else 'jpg'
+        self.quality = int(quality)
+        self.thumb_size = int(thumb_size)
+        self.full_frame = full_frame
+        self.full_frame_width = int(full_frame_width)
+        self.archive = archive
+        self.retention_days = int(retention_days)
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self._last_prune = 0.0
+        self._thread = threading.Thread(target=self._run, name="evidence-writer", daemon=True)
+        self._thread.start()
+
+    def _day_dir(self, when):
+        return os.path.join(self.root_dir, when.strftime('%Y'), when.strftime('%m'), when.strftime('%d'))
+
+    def _stem(self, name, student_id, when):
+        return f"{student_id}_{name}_{when.strftime('%H%M%S')}".replace(os.sep, '_')
+
+    def path_for(self, name, student_id, when):
+        # Where submit() will store a mark's thumbnail, so the path can be
+        # recorded before the evidence is queued. None while the queue is full.
+        if self.queue.full():
+            return None
+        stem = self._stem(name, student_id, when)
+        if self.archive:
+            return f"{self._day_dir(when)}.zip::{stem}_face.{self.fmt}"
+        return os.path.join(self._day_dir(when), f"{stem}_face.{self.fmt}")
+
+    def submit(self, frame, box, name, student_id, when=None):
+        # box is (left, top, right, bottom) in frame coordinates. Returns the path
+        # recorded with the mark, or None when the evidence had to be dropped.
+        when = when or datetime.now()
+        stem = self._stem(name, student_id, when)
+        if self.archive:
+            path = f"{self._day_dir(when)}.zip::{stem}_face.{self.fmt}"
+        else:
+            path = os.path.join(self._day_dir(when), f"{stem}_face.{self.fmt}")
+        try:
+            self.queue.put_nowait((frame, box, stem, when))
+        except queue.Full:
+            self.dropped += 1
+            METRICS.inc("evidence_dropped")
+            return None
+        METRICS.set_gauge("evidence_queue_depth", self.queue.qsize())
+        return path
+
+    def _crop(self, frame, box):
+        left, top, right, bottom = box
+        # Pad the face box by 25% so the thumbnail shows the whole head
+        pad_x, pad_y = (right - left) // 4, (bottom - top) // 4
+        h, w = frame.shape[:2]
+        crop = frame[max(0, top - pad_y):min(h, bottom + pad_y), max(0, left - pad_x):min(w, right + pad_x)]
+        if crop.size == 0:
+            crop = frame
+        scale = self.thumb_size / float(max(crop.shape[:2]))
+        if scale < 1:
+            crop = cv2.resize(crop, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return crop
+
+    def _encode(self, image):
+        ok, data = cv2.imencode(f".{self.fmt}", image, [ENCODE_PARAMS[self.fmt], self.quality])
+        return data.tobytes() if ok else None
+
+    def _render(self, frame, box, stem):
+        files = [(f"{stem}_face.{self.fmt}", self._encode(self._crop(frame, box)))]
+        if self.full_frame:
+            scale = self.full_frame_width / float(frame.shape[1])
+            small = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA) \
+                if scale < 1 else frame
+            files.append((f"{stem}_frame.{self.fmt}", self._encode(small)))
+        return [(name, data) for name, data in files if data is not None]
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            METRICS.set_gauge("evidence_queue_depth", self.queue.qsize())
+            stop = any(item is None for item in batch)
+            started = time.perf_counter()
+            by_day = {}
+            for item in batch:
+                if item is None:
+                    continue
+                frame, box, stem, when = item
+                try:
+                    by_day.setdefault(self._day_dir(when), []).extend(self._render(frame, box, stem))
+                except Exception:
+                    self._failed(f"encoding evidence {stem}")
+            for day_dir, files in by_day.items():
+                try:
+                    self._write_day(day_dir, files)
+                except Exception:
+                    self._failed(f"writing {len(files)} evidence files to {day_dir}")
+            if by_day:
+                METRICS.observe("evidence_write", time.perf_counter() - started)
+
+            if self.retention_days and time.time() - self._last_prune > 3600:
+                try:
+                    self.prune()
+                except Exception:
+                    self._failed("pruning old evidence")
+            if stop:
+                return
+
+    def _failed(self, what):
+        log.exception("Evidence writer failed %s", what)
+        METRICS.inc("evidence_errors")
+
+    def _write_day(self, day_dir, files):
+        if self.archive:
+            # One archive open per batch keeps daily containers consistent on disk
+            os.makedirs(os.path.dirname(day_dir), exist_ok=True)
+            with zipfile.ZipFile(f"{day_dir}.zip", 'a', compression=zipfile.ZIP_STORED) as archive:
+                for name, data in files:
+                    archive.writestr(name, data)
+        else:
+            os.makedirs(day_dir, exist_ok=True)
+            for name, data in files:
+                with open(os.path.join(day_dir, name), 'wb') as f:
+                    f.write(data)
+        self.written += len(files)
+        METRICS.inc("evidence_written", len(files))
+
+    def prune(self):
+        # Drops day directories and archives older than the retention window
+        self._last_prune = time.time()
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y%m%d')
+        removed = 0
+        for year in sorted(os.listdir(self.root_dir)) if os.path.isdir(self.root_dir) else []:
+            year_dir = os.path.join(self.root_dir, year)
+            if not (year.isdigit() and os.path.isdir(year_dir)):
+                continue
+            for month in sorted(os.listdir(year_dir)):
+                month_dir = os.path.join(year_dir, month)
+                if not os.path.isdir(month_dir):
+                    continue
+                for entry in os.listdir(month_dir):
+                    day = entry.split('.')[0]
+                    if not day.isdigit() or f"{year}{month}{day}" >= cutoff:
+                        continue
+                    path = os.path.join(month_dir, entry)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+                    removed += 1
+                if not os.listdir(month_dir):
+                    os.rmdir(month_dir)
+        return removed
+
+    def stats(self):
+        return {"queue_depth": self.queue.qsize(), "written": self.written, "dropped": self.dropped}
+
+    def close(self, timeout=5):
+        if not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
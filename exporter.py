@@ -0,0 +1,219 @@
+import argparse
+import csv
+import os
+import sys
+
+from ledger import COLUMNS, SUMMARY_COLUMNS
+
+EXPORT_FORMATS = ('csv', 'parquet', 'xlsx')
+# Excel's hard row limit per sheet, header included
+XLSX_MAX_ROWS = 1048576
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def iter_chunks(ledger, filters=None, chunk_size=5000):
+    # Keyset pages in id order: memory stays bounded by chunk_size no matter how
+    # long the history is, and works against a local or a served ledger
+    last_id = 0
+    while True:
+        rows = ledger.query(dict(filters or {}, after_id=last_id), 'id', False, chunk_size)
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [row[1:] for row in rows]
+
+
+class _CsvWriter:
+    def __init__(self, path):
+        self.paths = [path]
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+        self._path = path
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def summary(self, rows):
+        path = os.path.splitext(self._path)[0] + "_summary.csv"
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(SUMMARY_COLUMNS)
+            writer.writerows(rows)
+        self.paths.append(path)
+
+    def close(self):
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow (pip install pyarrow)")
+        self._pa, self._pq = pyarrow, pyarrow.parquet
+        self._schema = pyarrow.schema([(name, pyarrow.string()) for name in COLUMNS])
+        self._writer = self._pq.ParquetWriter(path, self._schema)
+        self._path = path
+        self.paths = [path]
+
+    def write(self, rows):
+        # One row group per chunk
+        columns = list(zip(*rows))
+        self._writer.write_table(self._pa.Table.from_arrays(
+            [self._pa.array([None if v is None else str(v) for v in col], self._pa.string()) for col in columns],
+            schema=self._schema))
+
+    def summary(self, rows):
+        path = os.path.splitext(self._path)[0] + "_summary.parquet"
+        columns = list(zip(*rows)) if rows else [[] for _ in SUMMARY_COLUMNS]
+        self._pq.write_table(self._pa.table(dict(zip(SUMMARY_COLUMNS, map(list, columns)))), path)
+        self.paths.append(path)
+
+    def close(self):
+        self._writer.close()
+
+    def abort(self):
+        # pyarrow has no way to drop an open file; the partial one is removed
+        self._writer.close()
+
+
+class _XlsxWriter:
+    # openpyxl's write-only mode streams rows to disk instead of building the
+    # whole sheet in memory; records spill onto further sheets past Excel's limit
+    def __init__(self, path):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise ImportError("XLSX export needs openpyxl (pip install openpyxl)")
+        self._book = Workbook(write_only=True)
+        self._path = path
+        self.paths = [path]
+        self._sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self._sheets += 1
+        self._sheet = self._book.create_sheet("Records" if self._sheets == 1 else f"Records {self._sheets}")
+        self._sheet.append(COLUMNS)
+        self._rows = 1
+
+    def write(self, rows):
+        for row in rows:
+            if self._rows >= XLSX_MAX_ROWS:
+                self._new_sheet()
+            self._sheet.append(list(row))
+            self._rows += 1
+
+    def summary(self, rows):
+        sheet = self._book.create_sheet("Summary")
+        sheet.append(SUMMARY_COLUMNS)
+        for row in rows:
+            sheet.append(list(row))
+
+    def close(self):
+        self._book.save(self._path)
+
+    def abort(self):
+        # Nothing reaches the output path until save, so there is nothing to write
+        self._book = None
+
+
+WRITERS = {'csv': _CsvWriter, 'parquet': _ParquetWriter, 'xlsx': _XlsxWriter}
+
+
+def export_records(ledger, path, fmt='csv', filters=None, roster=None, chunk_size=5000,
+                   progress=None, cancel=None):
+    # Streams the filtered records to path in chunks. With a roster ({student_id:
+    # name}) a per-student summary from the aggregate tables is added: a Summary
+    # sheet for XLSX, a <name>_summary file otherwise. progress(done, total) is
+    # called after each chunk; setting the cancel event stops the export and
+    # removes the partial output without finishing it. Returns the paths written.
+    if fmt not in WRITERS:
+        raise ValueError(f"unknown export format: {fmt}")
+    filters = dict(filters or {})
+    total = ledger.count(filters)
+    writer = WRITERS[fmt](path)
+    done = 0
+    closed = False
+    try:
+        for rows in iter_chunks(ledger, filters, chunk_size):
+            if cancel is not None and cancel.is_set():
+                raise ExportCancelled()
+            writer.write(rows)
+            done += len(rows)
+            if progress is not None:
+                progress(done, total)
+        if roster is not None:
+            if filters.get('student_ids') is not None:
+                wanted = set(str(i) for i in filters['student_ids'])
+                roster = {sid: name for sid, name in roster.items() if str(sid) in wanted}
+            writer.summary(ledger.student_summary(roster, filters.get('date_from'), filters.get('date_to')))
+        # Set first: a close that raises is not retried below
+        closed = True
+        writer.close()
+    except BaseException:
+        if not closed:
+            try:
+                writer.abort()
+            except Exception:
+                # The error that stopped the export is the one to report
+                pass
+        for written in writer.paths:
+            if os.path.exists(written):
+                os.remove(written)
+        raise
+    return writer.paths
+
+
+def main(argv=None):
+    import engine
+    from ledger_service import open_ledger
+    from rosters import Rosters
+
+    parser = argparse.ArgumentParser(description="Export attendance records in chunks.")
+    parser.add_argument("output", help="output file; the extension picks the format unless --format is given")
+    parser.add_argument("--format", choices=EXPORT_FORMATS)
+    parser.add_argument("--from", dest="date_from", help="first date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="last date (YYYY-MM-DD)")
+    parser.add_argument("--student", help="student ID or part of a name")
+    parser.add_argument("--section", help="roster shard from rosters.json")
+    parser.add_argument("--summary", action="store_true", help="add per-student summary sheets")
+    parser.add_argument("--config", default=engine.CONFIG_FILE)
+    args = parser.parse_args(argv)
+
+    config = engine.load_config(args.config)
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower() or 'csv'
+    filters = {key: value for key, value in (('date_from', args.date_from), ('date_to', args.date_to),
+                                             ('student', args.student)) if value}
+    if args.section:
+        filters['student_ids'] = sorted(Rosters.load(config['roster_file']).members([args.section]))
+
+    roster = None
+    if args.summary:
+        faces = engine.FaceStore(config)
+        roster = dict(zip(faces.gallery.ids, faces.gallery.names))
+
+    ledger, _ = open_ledger(config, engine.ATTENDANCE_DB, serve=False)
+
+    def report(done, total):
+        sys.stdout.write(f"\r{done}/{total} records")
+        sys.stdout.flush()
+
+    try:
+        paths = export_records(ledger, args.output, fmt, filters, roster, progress=report)
+    finally:
+        ledger.close()
+    print("\nWrote " + ", ".join(paths))
+
+
+if __name__ == "__main__":
+    main()
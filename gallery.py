@@ -0,0 +1,217 @@
+import threading
+import numpy as np
+
+
+class FaceGallery:
+    # Enrolled encodings kept as one contiguous float32 matrix so every face in a
+    # frame can be matched against the whole gallery with a single matrix product.
+
+    def __init__(self, dim=128, approximate=False, n_lists=0, n_probe=8, approximate_min_size=100000):
+        self.dim = dim
+        self.names = []
+        self.ids = []
+        self._matrix = np.empty((64, dim), dtype=np.float32)
+        self._sq_norms = np.empty(64, dtype=np.float32)
+        self._count = 0
+        self._lock = threading.RLock()
+        # Bumped on every change so derived views (roster shards) know to rebuild
+        self.version = 0
+
+        # IVF-style partitioning, only used once the gallery is large enough
+        self.approximate = approximate
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.approximate_min_size = approximate_min_size
+        self._centroids = None
+        self._lists = None
+        self._index_dirty = True
+
+    @classmethod
+    def from_lists(cls, encodings, names, ids, **kwargs):
+        gallery = cls(**kwargs)
+        gallery.extend(encodings, names, ids)
+        return gallery
+
+    @classmethod
+    def from_matrix(cls, matrix, names, ids, **kwargs):
+        # Adopts the matrix without copying (e.g. a read-only np.memmap); it is
+        # copied into an owned buffer on the first in-place change
+        gallery = cls(dim=matrix.shape[1], **kwargs)
+        if matrix.dtype != np.float32:
+            matrix = matrix.astype(np.float32)
+        gallery._matrix = matrix
+        gallery._sq_norms = np.einsum('ij,ij->i', matrix, matrix).astype(np.float32)
+        gallery._count = len(matrix)
+        gallery.names = list(names)
+        gallery.ids = list(ids)
+        return gallery
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def encodings(self):
+        return self._matrix[:self._count]
+
+    def _reserve(self, size):
+        if size <= len(self._matrix) and self._matrix.flags.writeable:
+            return
+        capacity = max(size, len(self._matrix) * 2, 64)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        matrix[:self._count] = self._matrix[:self._count]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:self._count] = self._sq_norms[:self._count]
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+
+    def add(self, encoding, name, student_id):
+        with self._lock:
+            self._reserve(self._count + 1)
+            row = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+            idx = self._count
+            self._matrix[idx] = row
+            self._sq_norms[idx] = np.dot(row, row)
+            self._count += 1
+            self.names.append(name)
+            self.ids.append(student_id)
+            self.version += 1
+
+            if self._lists is not None and not self._index_dirty:
+                nearest = int(np.argmin(((self._centroids - row) ** 2).sum(axis=1)))
+                self._lists[nearest] = np.append(self._lists[nearest], idx)
+            return idx
+
+    def extend(self, encodings, names, ids):
+        with self._lock:
+            rows = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+            start = self._count
+            self._reserve(start + len(rows))
+            self._matrix[start:start + len(rows)] = rows
+            self._sq_norms[start:start + len(rows)] = np.einsum('ij,ij->i', rows, rows)
+            self._count += len(rows)
+            self.names.extend(names)
+            self.ids.extend(ids)
+            self._index_dirty = True
+            self.version += 1
+
+    def remove(self, index):
+        with self._lock:
+            if not 0 <= index < self._count:
+                raise IndexError("gallery index out of range")
+            self._reserve(self._count)
+            # Shift rows down in place so indexes stay aligned with names/ids
+            self._matrix[index:self._count - 1] = self._matrix[index + 1:self._count]
+            self._sq_norms[index:self._count - 1] = self._sq_norms[index + 1:self._count]
+            self._count -= 1
+            self.names.pop(index)
+            self.ids.pop(index)
+            self._index_dirty = True
+            self.version += 1
+
+    def replace(self, index, encoding):
+        # Overwrites one row in place; names, ids and indexes are unchanged
+        with self._lock:
+            if not 0 <= index < self._count:
+                raise IndexError("gallery index out of range")
+            self._reserve(self._count)
+            row = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+            self._matrix[index] = row
+            self._sq_norms[index] = np.dot(row, row)
+            self._index_dirty = True
+            self.version += 1
+
+    def subset(self, student_ids):
+        # Exact-search copy holding only the given students' rows
+        wanted = set(str(i) for i in student_ids)
+        with self._lock:
+            rows = [i for i, sid in enumerate(self.ids) if str(sid) in wanted]
+            return FaceGallery.from_lists(self.encodings[rows], [self.names[i] for i in rows],
+                                          [self.ids[i] for i in rows], dim=self.dim)
+
+    def build_index(self, iterations=10, seed=0):
+        with self._lock:
+            data = self.encodings
+            n_lists = self.n_lists or max(1, int(np.sqrt(self._count)))
+            n_lists = min(n_lists, self._count)
+            if n_lists == 0:
+                self._centroids = None
+                self._lists = None
+                self._index_dirty = False
+                return
+
+            # Plain k-means on a sample is enough to get balanced partitions
+            rng = np.random.default_rng(seed)
+            sample_size = min(self._count, n_lists * 256)
+            sample = data[rng.choice(self._count, sample_size, replace=False)]
+            centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                assign = self._nearest(sample, centroids)
+                for c in range(n_lists):
+                    members = sample[assign == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+
+            assign = self._nearest(data, centroids)
+            order = np.argsort(assign, kind='stable')
+            bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+            self._centroids = centroids
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+            self._index_dirty = False
+
+    @staticmethod
+    def _centroid_distances(points, centroids):
+        c_norms = (centroids ** 2).sum(axis=1)
+        return c_norms[None, :] - 2.0 * points @ centroids.T
+
+    @classmethod
+    def _nearest(cls, points, centroids):
+        return np.argmin(cls._centroid_distances(points, centroids), axis=1)
+
+    def _use_index(self):
+        return self.approximate and self._count >= self.approximate_min_size
+
+    def search(self, encodings, tolerance=0.6):
+        # Returns one (index, distance) pair per query; index is -1 when the
+        # nearest enrolled face is farther than the tolerance.
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(queries) == 0:
+            return []
+        with self._lock:
+            if self._count == 0:
+                return [(-1, float('inf'))] * len(queries)
+            if self._use_index():
+                if self._index_dirty:
+                    self.build_index()
+                best_idx, best_dist = self._search_ivf(queries)
+            else:
+                best_idx, best_dist = self._search_exact(queries, self.encodings, self._sq_norms[:self._count])
+
+        results = []
+        for idx, dist in zip(best_idx, best_dist):
+            dist = float(dist)
+            results.append((int(idx) if dist <= tolerance else -1, dist))
+        return results
+
+    @staticmethod
+    def _search_exact(queries, matrix, sq_norms):
+        # ||q - g||^2 = ||q||^2 + ||g||^2 - 2 q.g for every pair at once
+        q_norms = np.einsum('ij,ij->i', queries, queries)
+        d2 = q_norms[:, None] + sq_norms[None, :] - 2.0 * queries @ matrix.T
+        best = np.argmin(d2, axis=1)
+        best_d2 = d2[np.arange(len(queries)), best]
+        return best, np.sqrt(np.maximum(best_d2, 0.0))
+
+    def _search_ivf(self, queries):
+        n_probe = min(self.n_probe, len(self._centroids))
+        probes = np.argsort(self._centroid_distances(queries, self._centroids), axis=1)[:, :n_probe]
+        best_idx = np.empty(len(queries), dtype=np.int64)
+        best_dist = np.empty(len(queries), dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([self._lists[c] for c in probes[i]])
+            if len(candidates) == 0:
+                best_idx[i], best_dist[i] = -1, np.inf
+                continue
+            idx, dist = self._search_exact(query[None, :], self._matrix[candidates], self._sq_norms[candidates])
+            best_idx[i] = candidates[idx[0]]
+            best_dist[i] = dist[0]
+        return best_idx, best_dist
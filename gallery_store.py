@@ -0,0 +1,163 @@
+import json
+import os
+import pickle
+import struct
+
+import numpy as np
+
+from gallery import FaceGallery
+
+FORMAT_VERSION = 1
+MAGIC = b'FGAL'
+# magic, format version, dtype code, encoding dimension, generation
+HEADER = struct.Struct('<4sHHII')
+DTYPES = {1: np.float32, 2: np.float16}
+DTYPE_CODES = {'float32': 1, 'float16': 2}
+
+
+class GalleryFormatError(Exception):
+    pass
+
+
+def _write_json_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class GalleryFile:
+    # On-disk gallery: one contiguous encoding matrix per generation
+    # (<name>.<gen>.bin, memory-mapped on load) plus a small JSON metadata file.
+    # The metadata is the commit point and is always replaced atomically:
+    # appends write rows past the committed count and then bump it, deletes only
+    # add tombstones, and compaction writes a new generation before switching.
+
+    def __init__(self, meta_file, dtype='float32', compact_ratio=0.25):
+        self.meta_file = meta_file
+        self.dtype = dtype
+        self.compact_ratio = compact_ratio
+        self.meta = None
+        self.rows = []
+
+    @property
+    def base(self):
+        return os.path.splitext(self.meta_file)[0]
+
+    def exists(self):
+        return os.path.exists(self.meta_file)
+
+    def _data_path(self, name):
+        return os.path.join(os.path.dirname(os.path.abspath(self.meta_file)), name)
+
+    def load(self, **gallery_options):
+        with open(self.meta_file) as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise GalleryFormatError(f"unsupported gallery version {meta.get('version')}")
+
+        path = self._data_path(meta['data_file'])
+        with open(path, 'rb') as f:
+            magic, version, dtype_code, dim, generation = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION or generation != meta['generation']:
+            raise GalleryFormatError(f"{path} does not match {self.meta_file}")
+
+        dtype = DTYPES[dtype_code]
+        count = meta['count']
+        matrix = np.memmap(path, dtype=dtype, mode='r', offset=HEADER.size, shape=(count, dim)) \
+            if count else np.empty((0, dim), dtype=dtype)
+
+        deleted = set(meta['deleted'])
+        self.rows = [row for row in range(count) if row not in deleted]
+        if deleted:
+            # Tombstoned rows force a copy; without them the memmap is used as-is
+            matrix = matrix[self.rows]
+        self.meta = meta
+        names = [meta['names'][row] for row in self.rows]
+        ids = [meta['ids'][row] for row in self.rows]
+        return FaceGallery.from_matrix(matrix, names, ids, **gallery_options)
+
+    def write(self, gallery):
+        # Full rewrite into a new generation, e.g. after too many tombstones
+        generation = (self.meta['generation'] + 1) if self.meta else 1
+        data_file = f"{os.path.basename(self.base)}.{generation}.bin"
+        path = self._data_path(data_file)
+        dtype_code = DTYPE_CODES[self.dtype]
+
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, dtype_code, gallery.dim, generation))
+            f.write(np.ascontiguousarray(gallery.encodings, dtype=DTYPES[dtype_code]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+        old_data = self.meta['data_file'] if self.meta else None
+        meta = {
+            "version": FORMAT_VERSION,
+            "dtype": self.dtype,
+            "dim": gallery.dim,
+            "generation": generation,
+            "data_file": data_file,
+            "count": len(gallery),
+            "names": list(gallery.names),
+            "ids": list(gallery.ids),
+            "deleted": []
+        }
+        _write_json_atomic(self.meta_file, meta)
+        self.meta = meta
+        self.rows = list(range(len(gallery)))
+
+        if old_data and old_data != data_file:
+            try:
+                os.remove(self._data_path(old_data))
+            except OSError:
+                # Still mapped somewhere (Windows); it is unreferenced and harmless
+                pass
+
+    def append(self, encodings, names, ids):
+        # New enrollments go to the end of the current data file
+        if self.meta is None:
+            raise GalleryFormatError("gallery must be written before appending")
+        rows = np.ascontiguousarray(encodings, dtype=DTYPES[DTYPE_CODES[self.meta['dtype']]])
+        rows = rows.reshape(-1, self.meta['dim'])
+        path = self._data_path(self.meta['data_file'])
+        count = self.meta['count']
+
+        with open(path, 'r+b') as f:
+            # Anything past the committed count is debris from an interrupted append
+            f.truncate(HEADER.size + count * self.meta['dim'] * rows.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(rows.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        meta = dict(self.meta)
+        meta['count'] = count + len(rows)
+        meta['names'] = self.meta['names'] + list(names)
+        meta['ids'] = self.meta['ids'] + list(ids)
+        _write_json_atomic(self.meta_file, meta)
+        self.meta = meta
+        self.rows.extend(range(count, count + len(rows)))
+
+    def delete(self, index, gallery):
+        # Tombstone the row behind gallery position `index`; compact when many are dead
+        row = self.rows.pop(index)
+        meta = dict(self.meta)
+        meta['deleted'] = self.meta['deleted'] + [row]
+        if len(meta['deleted']) > self.compact_ratio * max(1, meta['count']):
+            self.write(gallery)
+            return
+        _write_json_atomic(self.meta_file, meta)
+        self.meta = meta
+
+
+def migrate_pickle(pickle_file, gallery_file, **gallery_options):
+    # One-time conversion of the old face_encodings.pkl; the pickle is kept as a backup
+    with open(pickle_file, 'rb') as f:
+        data = pickle.load(f)
+    gallery = FaceGallery.from_lists(data['encodings'], data['names'], data['ids'], **gallery_options)
+    gallery_file.write(gallery)
+    os.replace(pickle_file, pickle_file + '.migrated')
+    return gallery_file.load(**gallery_options)
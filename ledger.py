@@ -0,0 +1,451 @@
+import csv
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+COLUMNS = ['Name', 'Student_ID', 'Date', 'Time', 'Status', 'Photo_Path', 'Location']
+
+AGGREGATES_VERSION = '1'
+SUMMARY_COLUMNS = ['Student_ID', 'Name', 'Present', 'Late', 'Attended', 'Absent', 'Rate',
+                   'Late_Streak', 'Longest_Late_Streak']
+SESSION_COLUMNS = ['Date', 'Session', 'Student_ID', 'Name', 'Location', 'Check_In', 'Check_Out', 'Status']
+
+# Sortable columns of the Records view, each backed by an index
+SORT_COLUMNS = {
+    'id': 'id',
+    'Name': 'name',
+    'Student_ID': 'student_id',
+    'Date': 'date, time',
+    'Time': 'time',
+    'Status': 'status',
+    'Location': 'location'
+}
+
+
+class AttendanceLedger:
+    # Append-only attendance store backed by SQLite in WAL mode. Marks are single
+    # row inserts, and "already marked today" is answered from an in-memory set of
+    # (student_id, date) keys so the camera thread never scans history.
+
+    def __init__(self, db_file, legacy_csv=None):
+        self.db_file = db_file
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS attendance (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                status TEXT NOT NULL,
+                photo_path TEXT,
+                location TEXT DEFAULT ''
+            );
+            CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(date, student_id);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(attendance)")]
+        if 'location' not in columns:
+            self._conn.execute("ALTER TABLE attendance ADD COLUMN location TEXT DEFAULT ''")
+        self._conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_attendance_name ON attendance(name);
+            CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance(student_id, date);
+            CREATE INDEX IF NOT EXISTS idx_attendance_status ON attendance(status, date);
+            CREATE INDEX IF NOT EXISTS idx_attendance_location ON attendance(location, date);
+            CREATE INDEX IF NOT EXISTS idx_attendance_time ON attendance(time);
+            CREATE TABLE IF NOT EXISTS session_attendance (
+                date TEXT, session TEXT, student_id TEXT, name TEXT, location TEXT,
+                check_in TEXT, check_out TEXT, status TEXT NOT NULL,
+                PRIMARY KEY (date, session, student_id)
+            ) WITHOUT ROWID;
+        """)
+        self._conn.commit()
+        self._create_aggregates()
+
+        self._marked = set()
+        self._loaded_dates = set()
+
+        if legacy_csv:
+            self.import_csv(legacy_csv)
+
+    def import_csv(self, csv_file):
+        # One-time migration of the old attendance.csv; remembered in the meta table
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'csv_imported'").fetchone()
+            if done or not os.path.exists(csv_file):
+                return 0
+
+            with open(csv_file, newline='') as f:
+                rows = [
+                    (r.get('Name', ''), str(r.get('Student_ID', '')), r.get('Date', ''),
+                     r.get('Time', ''), r.get('Status', ''), r.get('Photo_Path', ''), r.get('Location', ''))
+                    for r in csv.DictReader(f)
+                ]
+            self._conn.executemany(
+                "INSERT INTO attendance (name, student_id, date, time, status, photo_path, location) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('csv_imported', ?)", (os.path.abspath(csv_file),))
+            self._rebuild_aggregates()
+            self._conn.commit()
+            self._marked.clear()
+            self._loaded_dates.clear()
+            return len(rows)
+
+    def _load_date(self, date):
+        # Pull one day's keys into memory the first time that day is asked about
+        if date in self._loaded_dates:
+            return
+        for (student_id,) in self._conn.execute(
+                "SELECT DISTINCT student_id FROM attendance WHERE date = ?", (date,)):
+            self._marked.add((student_id, date))
+        self._loaded_dates.add(date)
+
+    def is_marked(self, student_id, date):
+        key = (str(student_id), date)
+        if key in self._marked:
+            return True
+        with self._lock:
+            self._load_date(date)
+            return key in self._marked
+
+    def append(self, name, student_id, date, time, status, photo_path='', location=''):
+        student_id = str(student_id)
+        with self._lock:
+            self._load_date(date)
+            self._conn.execute(
+                "INSERT INTO attendance (name, student_id, date, time, status, photo_path, location) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", (name, student_id, date, time, status, photo_path, location))
+            self._update_aggregates(student_id, date, status)
+            self._conn.commit()
+            self._marked.add((student_id, date))
+
+    def mark_many(self, rows):
+        # Group commit: rows of (name, student_id, date, time, status, photo_path,
+        # location) go in one transaction. A row whose student is already marked
+        # that day is skipped; returns one bool per row, True if it was written.
+        written = []
+        with self._lock:
+            for name, student_id, date, time, status, photo_path, location in rows:
+                student_id = str(student_id)
+                self._load_date(date)
+                if (student_id, date) in self._marked:
+                    written.append(False)
+                    continue
+                self._conn.execute(
+                    "INSERT INTO attendance (name, student_id, date, time, status, photo_path, location) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", (name, student_id, date, time, status, photo_path, location))
+                self._update_aggregates(student_id, date, status)
+                self._marked.add((student_id, date))
+                written.append(True)
+            self._conn.commit()
+        return written
+
+    def mark(self, name, student_id, date, time, status, photo_path='', location=''):
+        # Check-and-insert in one step, so concurrent writers cannot double-mark
+        return self.mark_many([(name, student_id, date, time, status, photo_path, location)])[0]
+
+    @contextmanager
+    def snapshot(self):
+        # Reads inside one transaction see a single committed state of the WAL
+        with self._lock:
+            started = not self._conn.in_transaction
+            if started:
+                self._conn.execute("BEGIN")
+            try:
+                yield self
+            finally:
+                if started:
+                    self._conn.commit()
+
+    def _create_aggregates(self):
+        # Materialized counters kept in step with every mark
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS agg_daily (
+                date TEXT, status TEXT, count INTEGER NOT NULL,
+                PRIMARY KEY (date, status)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS agg_student (
+                student_id TEXT, status TEXT, count INTEGER NOT NULL, last_date TEXT,
+                PRIMARY KEY (student_id, status)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS agg_student_day (
+                student_id TEXT, date TEXT, status TEXT,
+                PRIMARY KEY (student_id, date)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_agg_student_day_date ON agg_student_day(date, status);
+            CREATE TABLE IF NOT EXISTS agg_streak (
+                student_id TEXT PRIMARY KEY, last_date TEXT,
+                late_streak INTEGER NOT NULL, longest_late_streak INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        version = self._conn.execute("SELECT value FROM meta WHERE key = 'aggregates_version'").fetchone()
+        if not version or version[0] != AGGREGATES_VERSION:
+            self._rebuild_aggregates()
+        self._conn.commit()
+
+    def _rebuild_aggregates(self):
+        # Full recount from history; only needed on upgrade or after a CSV import
+        conn = self._conn
+        for table in ('agg_daily', 'agg_student', 'agg_student_day', 'agg_streak'):
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("INSERT INTO agg_daily SELECT date, status, COUNT(*) FROM attendance GROUP BY date, status")
+        conn.execute("INSERT INTO agg_student SELECT student_id, status, COUNT(*), MAX(date) "
+                     "FROM attendance GROUP BY student_id, status")
+        conn.execute("INSERT INTO agg_student_day SELECT student_id, date, status FROM attendance "
+                     "WHERE id IN (SELECT MIN(id) FROM attendance GROUP BY student_id, date)")
+        streaks = {}
+        for student_id, date, status in conn.execute(
+                "SELECT student_id, date, status FROM agg_student_day ORDER BY student_id, date"):
+            streaks[student_id] = self._next_streak(streaks.get(student_id, (None, 0, 0)), date, status)
+        conn.executemany("INSERT INTO agg_streak VALUES (?, ?, ?, ?)",
+                         [(sid,) + values for sid, values in streaks.items()])
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('aggregates_version', ?)",
+                     (AGGREGATES_VERSION,))
+
+    @staticmethod
+    def _next_streak(previous, date, status):
+        # (last_date, late_streak, longest_late_streak) after one more day, in date order
+        _, streak, longest = previous
+        streak = streak + 1 if status == 'Late' else 0
+        return date, streak, max(longest, streak)
+
+    def _recompute_streak(self, student_id):
+        # One student's streak from scratch, for marks that arrive out of date order
+        streak = (None, 0, 0)
+        for date, status in self._conn.execute(
+                "SELECT date, status FROM agg_student_day WHERE student_id = ? ORDER BY date", (student_id,)):
+            streak = self._next_streak(streak, date, status)
+        self._conn.execute("INSERT OR REPLACE INTO agg_streak VALUES (?, ?, ?, ?)", (student_id,) + streak)
+
+    def _update_aggregates(self, student_id, date, status):
+        # O(1) upserts, committed in the same transaction as the mark
+        conn = self._conn
+        conn.execute("INSERT INTO agg_daily VALUES (?, ?, 1) "
+                     "ON CONFLICT(date, status) DO UPDATE SET count = count + 1", (date, status))
+        conn.execute("INSERT INTO agg_student VALUES (?, ?, 1, ?) "
+                     "ON CONFLICT(student_id, status) DO UPDATE SET count = count + 1, "
+                     "last_date = MAX(last_date, excluded.last_date)", (student_id, status, date))
+        first_today = conn.execute("INSERT OR IGNORE INTO agg_student_day VALUES (?, ?, ?)",
+                                   (student_id, date, status)).rowcount
+        if not first_today:
+            return
+        last = conn.execute("SELECT last_date FROM agg_streak WHERE student_id = ?", (student_id,)).fetchone()
+        if last is not None and date < last[0]:
+            # Backdated, e.g. by replay.py: the streak no longer ends at this day
+            self._recompute_streak(student_id)
+        else:
+            late = 1 if status == 'Late' else 0
+            conn.execute("INSERT INTO agg_streak VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT(student_id) DO UPDATE SET last_date = excluded.last_date, "
+                         "late_streak = CASE WHEN ? THEN late_streak + 1 ELSE 0 END, "
+                         "longest_late_streak = MAX(longest_late_streak, "
+                         "CASE WHEN ? THEN late_streak + 1 ELSE 0 END)",
+                         (student_id, date, late, late, late, late))
+
+    def status_counts(self, date):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, count FROM agg_daily WHERE date = ?", (date,)).fetchall()
+        return dict(rows)
+
+    @staticmethod
+    def _date_range(column, date_from, date_to):
+        clauses, params = [], []
+        if date_from:
+            clauses.append(f"{column} >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append(f"{column} <= ?")
+            params.append(date_to)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def session_days(self, date_from=None, date_to=None):
+        # Days on which anyone was marked stand in for the school calendar
+        where, params = self._date_range("date", date_from, date_to)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(DISTINCT date) FROM agg_daily{where}", params).fetchone()[0]
+
+    def absentees(self, date, roster):
+        # roster: {student_id: name}
+        with self._lock:
+            present = {row[0] for row in self._conn.execute(
+                "SELECT student_id FROM agg_student_day WHERE date = ?", (date,))}
+        return {sid: name for sid, name in roster.items() if str(sid) not in present}
+
+    def period_rates(self, roster_size, period='week', date_from=None, date_to=None):
+        # [(period, student-days attended, session days, attendance rate)]
+        fmt = '%Y-W%W' if period == 'week' else '%Y-%m'
+        where, params = self._date_range("date", date_from, date_to)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT strftime('{fmt}', date) AS period, COUNT(*), COUNT(DISTINCT date) "
+                f"FROM agg_student_day{where} GROUP BY period ORDER BY period", params).fetchall()
+        return [
+            (name, attended, days, attended / float(roster_size * days) if roster_size and days else 0.0)
+            for name, attended, days in rows
+        ]
+
+    def late_streaks(self, min_length=2):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT student_id, late_streak, last_date FROM agg_streak WHERE late_streak >= ? "
+                "ORDER BY late_streak DESC", (min_length,)).fetchall()
+
+    def student_summary(self, roster, date_from=None, date_to=None):
+        # One row per rostered student, in SUMMARY_COLUMNS order
+        where, params = self._date_range("date", date_from, date_to)
+        counts = {}
+        with self.snapshot():
+            days = self.session_days(date_from, date_to)
+            for student_id, status, count in self._conn.execute(
+                    f"SELECT student_id, status, COUNT(*) FROM agg_student_day{where} "
+                    "GROUP BY student_id, status", params):
+                counts.setdefault(student_id, {})[status] = count
+            streaks = {row[0]: row[1:] for row in self._conn.execute(
+                "SELECT student_id, late_streak, longest_late_streak FROM agg_streak")}
+
+        rows = []
+        for student_id, name in roster.items():
+            student_counts = counts.get(str(student_id), {})
+            attended = sum(student_counts.values())
+            streak, longest = streaks.get(str(student_id), (0, 0))
+            rows.append([
+                student_id, name, student_counts.get('Present', 0), student_counts.get('Late', 0),
+                attended, max(0, days - attended), round(attended / float(days), 3) if days else 0.0,
+                streak, longest
+            ])
+        return rows
+
+    def export_summary_csv(self, path, roster, date_from=None, date_to=None):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(SUMMARY_COLUMNS)
+            writer.writerows(self.student_summary(roster, date_from, date_to))
+
+    @staticmethod
+    def _where(filters):
+        # filters: date_from, date_to, student (ID or part of a name), student_ids
+        # (e.g. a roster section), status, location, after_id
+        clauses, params = [], []
+        filters = filters or {}
+        if filters.get('date_from'):
+            clauses.append("date >= ?")
+            params.append(filters['date_from'])
+        if filters.get('date_to'):
+            clauses.append("date <= ?")
+            params.append(filters['date_to'])
+        if filters.get('student'):
+            clauses.append("(student_id = ? OR name LIKE ?)")
+            params.extend([filters['student'], f"%{filters['student']}%"])
+        if filters.get('student_ids') is not None:
+            # One JSON parameter instead of one per ID, so large sections fit
+            clauses.append("student_id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps([str(i) for i in filters['student_ids']]))
+        if filters.get('status'):
+            clauses.append("status = ?")
+            params.append(filters['status'])
+        if filters.get('location'):
+            clauses.append("location = ?")
+            params.append(filters['location'])
+        if filters.get('after_id') is not None:
+            clauses.append("id > ?")
+            params.append(filters['after_id'])
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count(self, filters=None):
+        where, params = self._where(filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM attendance{where}", params).fetchone()[0]
+
+    def query(self, filters=None, sort='id', descending=True, limit=100, offset=0):
+        # One page of (id, name, student_id, date, time, status, photo_path, location)
+        where, params = self._where(filters)
+        direction = "DESC" if descending else "ASC"
+        order = ", ".join(f"{col.strip()} {direction}" for col in SORT_COLUMNS[sort].split(','))
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, name, student_id, date, time, status, photo_path, location FROM attendance"
+                f"{where} ORDER BY {order}, id {direction} LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+
+    def session_state(self, session, date, student_id):
+        # (check_in, check_out, status) of one student in one timetabled session, or None
+        with self._lock:
+            return self._conn.execute(
+                "SELECT check_in, check_out, status FROM session_attendance "
+                "WHERE date = ? AND session = ? AND student_id = ?", (date, session, str(student_id))).fetchone()
+
+    def check_in(self, session, name, student_id, date, time, status, location=''):
+        # First sighting in a session's check-in window; later ones are ignored
+        with self._lock:
+            written = self._conn.execute(
+                "INSERT OR IGNORE INTO session_attendance "
+                "(date, session, student_id, name, location, check_in, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (date, session, str(student_id), name, location, time, status)).rowcount
+            self._conn.commit()
+        return bool(written)
+
+    def check_out(self, session, student_id, date, time):
+        # A sighting in the check-out window of a student who checked in
+        with self._lock:
+            written = self._conn.execute(
+                "UPDATE session_attendance SET check_out = ? "
+                "WHERE date = ? AND session = ? AND student_id = ? AND check_in IS NOT NULL",
+                (time, date, session, str(student_id))).rowcount
+            self._conn.commit()
+        return bool(written)
+
+    def close_session(self, session, date, roster, location='', checkout=False):
+        # Settles a session once its windows have passed: rostered students never
+        # seen are Absent and, if it takes a check-out, those who checked in but
+        # were not seen leaving are Left early. Safe to repeat; returns {status: count}.
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO session_attendance (date, session, student_id, name, location, status) "
+                "VALUES (?, ?, ?, ?, ?, 'Absent')",
+                [(date, session, str(sid), name, location) for sid, name in roster.items()])
+            if checkout:
+                self._conn.execute(
+                    "UPDATE session_attendance SET status = 'Left early' "
+                    "WHERE date = ? AND session = ? AND check_in IS NOT NULL AND check_out IS NULL",
+                    (date, session))
+            self._conn.commit()
+            return dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM session_attendance WHERE date = ? AND session = ? "
+                "GROUP BY status", (date, session)).fetchall())
+
+    def session_report(self, date_from=None, date_to=None, session=None):
+        # Rows in SESSION_COLUMNS order
+        where, params = self._date_range("date", date_from, date_to)
+        if session:
+            where += (" AND " if where else " WHERE ") + "session = ?"
+            params.append(session)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT date, session, student_id, name, location, check_in, check_out, status "
+                f"FROM session_attendance{where} ORDER BY date, session, name", params).fetchall()
+
+    def export_csv(self, path):
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT name, student_id, date, time, status, photo_path, location FROM attendance ORDER BY id")
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(COLUMNS)
+                while True:
+                    rows = cursor.fetchmany(1000)
+                    if not rows:
+                        break
+                    writer.writerows(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,340 @@
+import argparse
+import csv
+import queue
+import signal
+import socket
+import threading
+import time
+from multiprocessing.connection import Connection, Listener, answer_challenge, deliver_challenge
+
+from ledger import COLUMNS, AttendanceLedger
+from metrics import METRICS
+
+# Read calls a client may make; each runs as one snapshot on the server
+READ_OPS = ('is_marked', 'status_counts', 'session_days', 'absentees', 'period_rates', 'late_streaks',
+            'student_summary', 'count', 'query', 'session_state', 'session_report')
+# Shipped as the default before keys were generated per install; never served
+LEGACY_AUTHKEY = b'attendance'
+# Timetabled session writes are rare and run directly instead of being group committed
+SESSION_OPS = ('check_in', 'check_out', 'close_session')
+# Seconds a connecting client or server gets to complete the authkey handshake
+HANDSHAKE_TIMEOUT = 5.0
+
+
+def _cut_off(conn):
+    # Wakes a thread blocked reading conn by shutting the socket down under it
+    try:
+        with socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class LedgerServer:
+    # Single writer for one attendance database, shared by several processes over
+    # a local socket. Marks from every client are queued and committed together
+    # (group commit); reads run on the server's connection between commits, so
+    # each sees a consistent snapshot. The authkey handshake runs on each
+    # connection's own thread, so a bad or silent client never holds up others.
+
+    def __init__(self, ledger, host='127.0.0.1', port=6001, authkey=None, max_batch=64, max_wait=0.005,
+                 handshake_timeout=HANDSHAKE_TIMEOUT):
+        # Connections exchange pickles, so the key is all that keeps other local
+        # users from running code in this process
+        if not authkey or authkey == LEGACY_AUTHKEY:
+            raise ValueError("refusing to serve the ledger without a private ledger_authkey; "
+                             "clear it in config.json to have one generated")
+        self.ledger = ledger
+        self.address = (host, int(port))
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.handshake_timeout = handshake_timeout
+        self.rejected = 0
+        self.commits = 0
+        self.marks = 0
+        self._queue = queue.Queue()
+        self._listener = None
+        self.running = False
+
+    def start(self):
+        # No authkey on the listener: accept() would run the handshake inline
+        self._listener = Listener(self.address)
+        self.address = self._listener.address
+        self.running = True
+        threading.Thread(target=self._accept, name="ledger-accept", daemon=True).start()
+        threading.Thread(target=self._write, name="ledger-writer", daemon=True).start()
+        return self
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn = self._listener.accept()
+            except Exception:
+                if not self.running:
+                    return
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="ledger-client", daemon=True).start()
+
+    def _handshake(self, conn):
+        timer = threading.Timer(self.handshake_timeout, _cut_off, args=(conn,))
+        timer.daemon = True
+        timer.start()
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+        finally:
+            timer.cancel()
+
+    def _serve(self, conn):
+        with conn:
+            try:
+                self._handshake(conn)
+            except Exception:
+                # Wrong key, garbage or a client that never answered
+                self.rejected += 1
+                METRICS.inc("ledger_clients_rejected")
+                return
+            while self.running:
+                try:
+                    op, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if op == 'mark_many':
+                        result = self.submit(args[0])
+                    elif op in READ_OPS:
+                        with self.ledger.snapshot():
+                            result = getattr(self.ledger, op)(*args, **kwargs)
+                    elif op in SESSION_OPS:
+                        result = getattr(self.ledger, op)(*args, **kwargs)
+                    else:
+                        raise ValueError(f"unknown ledger operation: {op}")
+                    conn.send((True, result))
+                except Exception as e:
+                    conn.send((False, f"{type(e).__name__}: {e}"))
+
+    def submit(self, rows):
+        # Blocks until the rows are committed; returns one bool per row
+        done = threading.Event()
+        slot = [rows, None, done]
+        self._queue.put(slot)
+        done.wait()
+        if isinstance(slot[1], Exception):
+            raise slot[1]
+        return slot[1]
+
+    def _write(self):
+        while self.running:
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # Give concurrent marks a moment to join the same transaction
+            deadline = time.perf_counter() + self.max_wait
+            while sum(len(slot[0]) for slot in batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+
+            rows = [row for slot in batch for row in slot[0]]
+            try:
+                with METRICS.timer("ledger_group_commit"):
+                    written = self.ledger.mark_many(rows)
+            except Exception as e:
+                for slot in batch:
+                    slot[1] = e
+                    slot[2].set()
+                continue
+            self.commits += 1
+            self.marks += sum(written)
+            METRICS.inc("ledger_group_commits")
+            METRICS.set_gauge("ledger_group_commit_size", len(rows))
+
+            offset = 0
+            for slot in batch:
+                slot[1] = written[offset:offset + len(slot[0])]
+                offset += len(slot[0])
+                slot[2].set()
+
+    def stop(self):
+        self.running = False
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+
+class LedgerClient:
+    # Drop-in stand-in for AttendanceLedger that talks to a LedgerServer. Calls
+    # are serialized per client; keep one client per process.
+
+    def __init__(self, host='127.0.0.1', port=6001, authkey=b'', timeout=HANDSHAKE_TIMEOUT):
+        self._conn = self._connect((host, int(port)), authkey, timeout)
+        self._lock = threading.Lock()
+        # Marks are never undone, so positive answers can be cached locally
+        self._marked = set()
+
+    @staticmethod
+    def _connect(address, authkey, timeout):
+        # multiprocessing.connection.Client with a timeout on the connect and on
+        # the server's first handshake message
+        sock = socket.create_connection(address, timeout)
+        sock.setblocking(True)
+        conn = Connection(sock.detach())
+        try:
+            if not conn.poll(timeout):
+                raise TimeoutError(f"ledger server at {address[0]}:{address[1]} did not answer")
+            answer_challenge(conn, authkey)
+            deliver_challenge(conn, authkey)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def _call(self, op, *args, **kwargs):
+        with self._lock:
+            self._conn.send((op, args, kwargs))
+            ok, result = self._conn.recv()
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def is_marked(self, student_id, date):
+        key = (str(student_id), date)
+        if key in self._marked:
+            return True
+        if self._call('is_marked', student_id, date):
+            self._marked.add(key)
+            return True
+        return False
+
+    def mark_many(self, rows):
+        written = self._call('mark_many', [tuple(row) for row in rows])
+        self._marked.update((str(row[1]), row[2]) for row in rows)
+        return written
+
+    def mark(self, name, student_id, date, time, status, photo_path='', location=''):
+        return self.mark_many([(name, student_id, date, time, status, photo_path, location)])[0]
+
+    def append(self, name, student_id, date, time, status, photo_path='', location=''):
+        self.mark(name, student_id, date, time, status, photo_path, location)
+
+    def status_counts(self, date):
+        return self._call('status_counts', date)
+
+    def session_days(self, date_from=None, date_to=None):
+        return self._call('session_days', date_from, date_to)
+
+    def absentees(self, date, roster):
+        return self._call('absentees', date, roster)
+
+    def period_rates(self, roster_size, period='week', date_from=None, date_to=None):
+        return self._call('period_rates', roster_size, period, date_from, date_to)
+
+    def late_streaks(self, min_length=2):
+        return self._call('late_streaks', min_length)
+
+    def student_summary(self, roster, date_from=None, date_to=None):
+        return self._call('student_summary', roster, date_from, date_to)
+
+    def export_summary_csv(self, path, roster, date_from=None, date_to=None):
+        AttendanceLedger.export_summary_csv(self, path, roster, date_from, date_to)
+
+    def count(self, filters=None):
+        return self._call('count', filters)
+
+    def query(self, filters=None, sort='id', descending=True, limit=100, offset=0):
+        return self._call('query', filters, sort, descending, limit, offset)
+
+    def session_state(self, session, date, student_id):
+        return self._call('session_state', session, date, student_id)
+
+    def check_in(self, session, name, student_id, date, time, status, location=''):
+        return self._call('check_in', session, name, student_id, date, time, status, location)
+
+    def check_out(self, session, student_id, date, time):
+        return self._call('check_out', session, student_id, date, time)
+
+    def close_session(self, session, date, roster, location='', checkout=False):
+        return self._call('close_session', session, date, roster, location, checkout)
+
+    def session_report(self, date_from=None, date_to=None, session=None):
+        return self._call('session_report', date_from, date_to, session)
+
+    def export_csv(self, path, chunk=1000):
+        # Keyset pages by id, so the export never holds the server's lock for long
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            last_id = 0
+            while True:
+                rows = self.query({'after_id': last_id}, 'id', False, chunk)
+                if not rows:
+                    break
+                writer.writerows(row[1:] for row in rows)
+                last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_ledger(config, db_file, legacy_csv=None, serve=True):
+    # ledger_mode: "local" opens the database directly, "serve" also shares it with
+    # other processes, "connect" uses the ledger served by another process.
+    # One-off tools pass serve=False: in "serve" mode they go through the running
+    # server like any client, since writing behind its back would leave its
+    # marked-today cache stale. Only when no server is up is the file opened
+    # directly. Returns (ledger, server or None).
+    mode = config.get('ledger_mode', 'local')
+    authkey = config['ledger_authkey'].encode()
+    if mode == 'connect':
+        return LedgerClient(config['ledger_host'], config['ledger_port'], authkey), None
+    if mode == 'serve' and not serve:
+        try:
+            return LedgerClient(config['ledger_host'], config['ledger_port'], authkey), None
+        except ConnectionRefusedError:
+            pass
+    ledger = AttendanceLedger(db_file, legacy_csv=legacy_csv)
+    if mode == 'serve' and serve:
+        try:
+            server = LedgerServer(ledger, config['ledger_host'], config['ledger_port'], authkey).start()
+        except Exception:
+            ledger.close()
+            raise
+        return ledger, server
+    return ledger, None
+
+
+def main(argv=None):
+    import engine
+
+    parser = argparse.ArgumentParser(description="Serve the attendance ledger to camera and reporting processes.")
+    parser.add_argument("--config", default=engine.CONFIG_FILE)
+    parser.add_argument("--db", default=engine.ATTENDANCE_DB)
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    args = parser.parse_args(argv)
+
+    config = engine.load_config(args.config)
+    ledger = AttendanceLedger(args.db, legacy_csv=engine.ATTENDANCE_FILE)
+    server = LedgerServer(ledger, args.host or config['ledger_host'], args.port or config['ledger_port'],
+                          config['ledger_authkey'].encode()).start()
+    print(f"Serving {args.db} on {server.address[0]}:{server.address[1]}", flush=True)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        ledger.close()
+        print(f"Stopped after {server.marks} marks in {server.commits} commits", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import time
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+from quality import pose_from_landmarks
+
+# Side of the square grey crop the texture spectrum is computed on
+TEXTURE_SIZE = 128
+
+
+def eye_aspect_ratio(eye):
+    # Six eye landmarks (corner, two upper lid, corner, two lower lid points);
+    # the ratio of lid opening to eye width drops sharply during a blink
+    p = np.asarray(eye, dtype=np.float32)
+    width = float(np.linalg.norm(p[0] - p[3]))
+    if not width:
+        return 0.0
+    return float(np.linalg.norm(p[1] - p[5]) + np.linalg.norm(p[2] - p[4])) / (2.0 * width)
+
+
+def texture_scores(gray):
+    # (high-frequency energy share, moire peak ratio) of a grey face crop.
+    # Printed photos and screens lose fine skin detail, so little energy sits in
+    # the upper half of the spectrum; a screen filmed by a camera adds moire, a
+    # few isolated peaks that stand far above the rest of that band.
+    gray = cv2.resize(gray, (TEXTURE_SIZE, TEXTURE_SIZE), interpolation=cv2.INTER_LINEAR).astype(np.float32)
+    gray -= gray.mean()
+    window = np.outer(np.hanning(TEXTURE_SIZE), np.hanning(TEXTURE_SIZE)).astype(np.float32)
+    spectrum = np.abs(np.fft.fftshift(np.fft.fft2(gray * window)))
+    freq = np.fft.fftshift(np.fft.fftfreq(TEXTURE_SIZE))
+    radius = np.hypot(*np.meshgrid(freq, freq))
+    high = spectrum[radius > 0.25]
+    total = float(spectrum.sum()) or 1.0
+    return float(high.sum()) / total, float(high.max() / (high.mean() or 1.0))
+
+
+class LivenessState:
+    # Evidence gathered for one track; the verdict is cached once reached, a
+    # failure only until failed_at + retry_seconds
+    def __init__(self):
+        self.samples = 0
+        self.blinks = 0
+        self.eyes_open = False
+        self.eyes_closed = False
+        self.yaws = []
+        self.textures = []
+        self.moire = []
+        self.live = None
+        self.reasons = []
+        self.failed_at = None
+
+
+class LivenessChecker:
+    # Anti-spoofing for tracks that already matched a known identity: a blink
+    # (eye aspect ratio dipping below blink_ear and recovering) or a small head
+    # turn (yaw range of at least min_head_motion) must be seen, and the crop's
+    # texture must look like skin rather than paper or a screen. Each call adds
+    # one sample to the track; the verdict is None until decided, then cached on
+    # the track so settled tracks cost nothing. Samples only arrive on processed
+    # frames, so a failure is held for retry_seconds and then the track starts
+    # gathering fresh evidence, giving a real student who was simply still
+    # another chance.
+
+    def __init__(self, blink_ear=0.21, min_head_motion=0.08, min_texture=0.01, max_moire=30.0,
+                 min_samples=3, max_samples=40, retry_seconds=5.0):
+        self.blink_ear = blink_ear
+        self.min_head_motion = min_head_motion
+        self.min_texture = min_texture
+        self.max_moire = max_moire
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.retry_seconds = retry_seconds
+        self.checks = 0
+        self.seconds = 0.0
+
+    def check(self, track, frame, box):
+        # frame is the full-resolution BGR frame, box the track's (top, right,
+        # bottom, left) in that frame's pixels
+        state = track.liveness
+        if state is not None and state.live is False and time.monotonic() - state.failed_at >= self.retry_seconds:
+            state = None
+        if state is None:
+            state = track.liveness = LivenessState()
+        if state.live is not None:
+            return state.live
+
+        started = time.perf_counter()
+        with METRICS.timer("liveness"):
+            self._sample(state, frame, box)
+            self._decide(state)
+        self.checks += 1
+        self.seconds += time.perf_counter() - started
+        METRICS.inc("liveness_checks")
+        if state.live is not None:
+            METRICS.inc("liveness_passed" if state.live else "liveness_failed")
+        return state.live
+
+    def _sample(self, state, frame, box):
+        import face_recognition
+
+        top, right, bottom, left = box
+        height, width = frame.shape[:2]
+        margin = max(1, (bottom - top) // 4)
+        y0, y1 = max(0, top - margin), min(height, bottom + margin)
+        x0, x1 = max(0, left - margin), min(width, right + margin)
+        if y1 <= y0 or x1 <= x0:
+            return
+        crop = frame[y0:y1, x0:x1]
+
+        face = frame[max(0, top):max(0, bottom), max(0, left):max(0, right)]
+        if face.size:
+            texture, moire = texture_scores(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY))
+            state.textures.append(texture)
+            state.moire.append(moire)
+
+        # 68-point landmarks on the crop only, not the whole frame
+        local = (top - y0, right - x0, bottom - y0, left - x0)
+        marks = face_recognition.face_landmarks(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB), [local])
+        state.samples += 1
+        if not marks:
+            return
+        marks = marks[0]
+        left_eye, right_eye = marks['left_eye'], marks['right_eye']
+
+        ear = (eye_aspect_ratio(left_eye) + eye_aspect_ratio(right_eye)) / 2.0
+        if ear >= self.blink_ear:
+            # A closed-then-open sequence after the eyes were first seen open
+            if state.eyes_closed:
+                state.blinks += 1
+                state.eyes_closed = False
+            state.eyes_open = True
+        elif state.eyes_open:
+            state.eyes_closed = True
+
+        # Eye corners and nose tip in dlib's 5-point layout. Signed, so turning
+        # from one side to the other spans the whole range instead of folding
+        # onto itself at frontal.
+        points = [left_eye[0], left_eye[3], right_eye[3], right_eye[0], marks['nose_tip'][2]]
+        state.yaws.append(pose_from_landmarks(points, signed=True)[0])
+
+    def _decide(self, state):
+        if state.samples < self.min_samples:
+            return
+        reasons = []
+        if state.textures and float(np.median(state.textures)) < self.min_texture:
+            reasons.append("flat texture")
+        if state.moire and float(np.median(state.moire)) > self.max_moire:
+            reasons.append("moire")
+        moved = bool(state.yaws) and max(state.yaws) - min(state.yaws) >= self.min_head_motion
+        if not reasons and (state.blinks or moved):
+            state.live = True
+        elif reasons or state.samples >= self.max_samples:
+            state.live = False
+            state.reasons = reasons or ["no blink or head motion"]
+            state.failed_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "checks": self.checks,
+            "latency_ms": round(1000.0 * self.seconds / self.checks, 1) if self.checks else 0.0
+        }
+
+
+def liveness_options(config):
+    return {
+        "blink_ear": float(config['liveness_blink_ear']),
+        "min_head_motion": float(config['liveness_min_head_motion']),
+        "min_texture": float(config['liveness_min_texture']),
+        "max_moire": float(config['liveness_max_moire']),
+        "max_samples": int(config['liveness_max_samples']),
+        "retry_seconds": float(config['liveness_retry_seconds'])
+    }
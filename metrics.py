@@ -0,0 +1,176 @@
+import collections
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "attendance"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Metrics:
+    # Process-wide counters and per-stage timers. Each stage keeps running
+    # totals for Prometheus plus a rolling window for percentiles in the GUI.
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self._samples = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = collections.deque(maxlen=self.window)
+                self._totals[stage] = [0.0, 0]
+            self._samples[stage].append(seconds)
+            self._totals[stage][0] += seconds
+            self._totals[stage][1] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def reset(self):
+        # Clears everything, e.g. between benchmark runs in one process
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self._samples.clear()
+            self._totals.clear()
+
+    def snapshot(self):
+        # numpy only for the percentiles, so the GUI can start the metrics
+        # endpoint before the recognition pipeline is imported
+        import numpy as np
+        with self._lock:
+            counters = dict(self.counters)
+            stages = {
+                stage: {
+                    "p50_ms": float(np.percentile(samples, 50)) * 1000,
+                    "p95_ms": float(np.percentile(samples, 95)) * 1000,
+                    "count": self._totals[stage][1]
+                }
+                for stage, samples in self._samples.items() if samples
+            }
+        return counters, stages
+
+    def prometheus_text(self):
+        import numpy as np
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            stages = sorted((stage, list(samples), list(self._totals[stage]))
+                            for stage, samples in self._samples.items())
+
+        lines = []
+        for name, value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        for name, value in gauges:
+            metric = f"{PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+
+        metric = f"{PREFIX}_stage_seconds"
+        lines.append(f"# HELP {metric} Per-stage latency over the last {self.window} observations")
+        lines.append(f"# TYPE {metric} summary")
+        for stage, samples, (total, count) in stages:
+            for q in QUANTILES:
+                value = float(np.quantile(samples, q)) if samples else float('nan')
+                lines.append(f'{metric}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = METRICS.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host='127.0.0.1', port=9108):
+    # Serves /metrics in Prometheus text format; port 0 disables it
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class StackSampler:
+    # Low-overhead sampling profiler across all threads (cProfile only sees the
+    # thread that enabled it). Writes collapsed stacks ("thread;frame;frame N"),
+    # the format flamegraph.pl, speedscope and py-spy's output tooling read.
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while self.running:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = [f"{fs.name} ({fs.filename.rsplit('/', 1)[-1]}:{fs.lineno})"
+                          for fs in traceback.extract_stack(frame)]
+                self.stacks[";".join([names.get(ident, str(ident))] + frames)] += 1
+            time.sleep(self.interval)
+
+    def stop(self, path=None):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        if path:
+            with open(path, 'w') as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        return path
+
+
+SAMPLER = StackSampler()
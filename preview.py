@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from engine import draw_overlay
+
+PREVIEW_SIZE = (640, 480)
+
+
+def preview_interval(config):
+    # Milliseconds between preview refreshes: preview_fps, but never faster
+    # than the display can actually show
+    fps = min(int(config['preview_fps']), int(config['display_refresh_hz']))
+    return int(1000 / max(1, fps))
+
+
+class PreviewRenderer:
+    # Renders camera frames into one persistent Tk photo image. The display-size
+    # BGR and RGBA buffers are allocated once: each frame is resized straight
+    # into the first with a bilinear filter, the overlay is drawn on it at
+    # display resolution, and the colour conversion writes into the second,
+    # which a PIL image shares without copying. That image is pasted into the
+    # same PhotoImage every time, so nothing full-frame is allocated per frame.
+
+    def __init__(self, size=PREVIEW_SIZE, interpolation=cv2.INTER_LINEAR):
+        self.size = tuple(size)
+        self.interpolation = interpolation
+        width, height = self.size
+        self._bgr = np.empty((height, width, 3), np.uint8)
+        self._rgba = np.empty((height, width, 4), np.uint8)
+        self._image = Image.frombuffer('RGBA', self.size, self._rgba, 'raw', 'RGBA', 0, 1)
+        # Needs a Tk root, so it is created on the first render
+        self.photo = None
+
+    def render(self, frame, overlay=(), title=None):
+        # overlay boxes are in frame coordinates; returns the updated PhotoImage
+        height, width = frame.shape[:2]
+        cv2.resize(frame, self.size, dst=self._bgr, interpolation=self.interpolation)
+        sx, sy = self.size[0] / width, self.size[1] / height
+        draw_overlay(self._bgr, [
+            ((int(left * sx), int(top * sy), int(right * sx), int(bottom * sy)), name, color)
+            for (left, top, right, bottom), name, color in overlay
+        ], title)
+        cv2.cvtColor(self._bgr, cv2.COLOR_BGR2RGBA, dst=self._rgba)
+        if self.photo is None:
+            self.photo = ImageTk.PhotoImage('RGBA', self.size)
+        self.photo.paste(self._image)
+        return self.photo
@@ -0,0 +1,132 @@
+import math
+
+import cv2
+import numpy as np
+
+# Side of the grey square blur is measured on. Faces are cut from the
+# full-resolution frame and scaled to it, so quality_min_blur means the same at
+# any detector_scale and in registration, enrollment and attendance alike.
+# Faces that pass quality_min_face_size (60) are almost always scaled down, which
+# keeps their edges; upsampled chips of small detections used to read as blurred.
+BLUR_SIZE = 64
+
+
+def blur_variance(gray):
+    # Variance of the Laplacian; sharp crops have strong edges and a high variance
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def face_blur(image, box, scale=1.0):
+    # Blur of a face box (top, right, bottom, left) in image coordinates times
+    # scale, e.g. a box from a downscaled detection frame. Colour order does not
+    # matter for sharpness, so BGR frames and RGB photos are treated alike.
+    top, right, bottom, left = (int(round(v / scale)) for v in box)
+    height, width = image.shape[:2]
+    crop = image[max(0, top):min(height, bottom), max(0, left):min(width, right)]
+    if not crop.size:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+    return blur_variance(cv2.resize(gray, (BLUR_SIZE, BLUR_SIZE), interpolation=cv2.INTER_AREA))
+
+
+def brightness(chip):
+    return float(cv2.cvtColor(chip, cv2.COLOR_RGB2GRAY).mean())
+
+
+def pose_from_landmarks(points, signed=False):
+    # dlib 5-point landmarks: 0-1 one eye's corners, 2-3 the other's, 4 the nose.
+    # Returns (yaw, roll): yaw is the nose's horizontal offset from the eye
+    # midpoint as a fraction of eye distance (0 = frontal), roll is in degrees.
+    # Both are magnitudes unless signed, which keeps the turn's direction.
+    points = np.asarray(points, dtype=np.float32)
+    eye_a, eye_b = points[0:2].mean(axis=0), points[2:4].mean(axis=0)
+    eye_vector = eye_b - eye_a
+    eye_distance = float(np.hypot(*eye_vector)) or 1.0
+    roll = math.degrees(math.atan2(eye_vector[1], eye_vector[0]))
+    # Eyes may come in either order; fold the angle into [-90, 90]
+    if roll > 90:
+        roll -= 180
+    elif roll < -90:
+        roll += 180
+    midpoint = (eye_a + eye_b) / 2
+    # Offset measured along the eye line, so roll does not read as yaw
+    yaw = float(np.dot(points[4] - midpoint, eye_vector / eye_distance)) / eye_distance
+    if signed:
+        return yaw, roll
+    return abs(yaw), abs(roll)
+
+
+def perceptual_hash(chip):
+    # 64-bit difference hash of the aligned crop; near-identical crops share
+    # a hash or differ by a few bits
+    gray = cv2.resize(cv2.cvtColor(chip, cv2.COLOR_RGB2GRAY), (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (gray[:, 1:] > gray[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class FaceQuality:
+    def __init__(self, score, reasons, blur, size, yaw, roll, light):
+        self.score = score
+        self.reasons = reasons
+        self.blur = blur
+        self.size = size
+        self.yaw = yaw
+        self.roll = roll
+        self.brightness = light
+
+    @property
+    def ok(self):
+        return not self.reasons
+
+
+class QualityGate:
+    # Scores an aligned face chip so blurred, tiny, turned or badly lit faces are
+    # not encoded. size is the face box's shorter side in source-frame pixels and
+    # blur its face_blur; None leaves blur to the caller (see sharp()).
+
+    def __init__(self, min_blur=40.0, min_size=60, max_yaw=0.3, max_roll=25.0,
+                 min_brightness=40.0, max_brightness=220.0):
+        self.min_blur = min_blur
+        self.min_size = min_size
+        self.max_yaw = max_yaw
+        self.max_roll = max_roll
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+
+    def sharp(self, blur):
+        return blur >= self.min_blur
+
+    def assess(self, chip, points, size, blur=None):
+        light = brightness(chip)
+        yaw, roll = pose_from_landmarks(points)
+
+        reasons = []
+        if blur is not None and not self.sharp(blur):
+            reasons.append("blurred")
+        if size < self.min_size:
+            reasons.append("too small")
+        if yaw > self.max_yaw or roll > self.max_roll:
+            reasons.append("off-angle")
+        if not self.min_brightness <= light <= self.max_brightness:
+            reasons.append("too dark" if light < self.min_brightness else "too bright")
+
+        # 0..1 per factor, averaged, for picking the best of several frames
+        score = np.mean([
+            min(blur / (3.0 * self.min_blur), 1.0) if blur is not None and self.min_blur else 1.0,
+            min(size / (2.0 * self.min_size), 1.0),
+            max(0.0, 1.0 - yaw / self.max_yaw) if self.max_yaw else 1.0,
+            max(0.0, 1.0 - roll / self.max_roll) if self.max_roll else 1.0,
+            1.0 - min(abs(light - 128.0) / 128.0, 1.0)
+        ])
+        return FaceQuality(float(score), reasons, blur, size, yaw, roll, light)
+
+
+def quality_options(config):
+    return {
+        "min_blur": float(config['quality_min_blur']),
+        "min_size": int(config['quality_min_face_size']),
+        "max_yaw": float(config['quality_max_yaw']),
+        "max_roll": float(config['quality_max_roll']),
+        "min_brightness": float(config['quality_min_brightness']),
+        "max_brightness": float(config['quality_max_brightness'])
+    }
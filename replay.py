@@ -0,0 +1,211 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import cv2
+
+import engine
+from cameras import DETECT_SCALE, detect_and_gate
+from detectors import detector_options
+from encoders import encoder_options, get_encoder
+from ledger_service import open_ledger
+from quality import quality_options
+from rosters import ShardManager
+from timetable import Timetable
+from tracking import FaceTracker
+
+
+def parse_video(spec, default_location=''):
+    # PATH@START[@LOCATION], START as an ISO timestamp, e.g.
+    # gate_a.mp4@2024-03-04T08:30:00@Gate A
+    parts = spec.split('@')
+    if len(parts) < 2:
+        raise ValueError(f"expected PATH@START[@LOCATION], got {spec!r}")
+    path, start = parts[0], datetime.fromisoformat(parts[1])
+    return path, start, parts[2] if len(parts) > 2 else default_location
+
+
+def plan_segments(path, segment_seconds=60.0):
+    # [(start_frame, end_frame)] covering the whole file, plus its frame rate.
+    # Streams that do not report a frame count cannot be split and are decoded
+    # in one sequential segment, end_frame None.
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"cannot open video: {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if frames <= 0:
+        print(f"warning: {path} does not report its length; decoding it sequentially", file=sys.stderr, flush=True)
+        return [(0, None)], fps
+    step = max(1, int(segment_seconds * fps))
+    return [(start, min(start + step, frames)) for start in range(0, frames, step)], fps
+
+
+def process_segment(task):
+    # Pool worker: decodes one segment, detects every stride-th frame and encodes
+    # the gated faces of the whole segment in batches. Returns
+    # [(frame_index, locations, encodings with None for rejected faces)].
+    path, start, end, stride, scale, detect_opts, quality_opts, encode_opts, max_batch = task
+    cap = cv2.VideoCapture(path)
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frames, pending = [], []
+    encoder = get_encoder(encode_opts)
+
+    def flush():
+        encodings = encoder.encode([chip for _, _, chip in pending])
+        for (slot, i, _), encoding in zip(pending, encodings):
+            slot[i] = encoding
+        pending.clear()
+
+    index = start
+    while end is None or index < end:
+        # grab() skips the colour conversion for frames that are not sampled
+        if (index - start) % stride:
+            if not cap.grab():
+                break
+            index += 1
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        small = cv2.cvtColor(cv2.resize(frame, (0, 0), fx=scale, fy=scale), cv2.COLOR_BGR2RGB)
+        locations, todo, chips, _, _ = detect_and_gate(small, (), 0.3, detect_opts, quality_opts, frame)
+        encodings = [None] * len(locations)
+        pending.extend((encodings, i, chip) for i, chip in zip(todo, chips))
+        if len(pending) >= max_batch:
+            flush()
+        frames.append((index, locations, encodings))
+        index += 1
+    if pending:
+        flush()
+    cap.release()
+    return frames
+
+
+class Replay:
+    # Rebuilds attendance from recorded footage. Segments are decoded in
+    # parallel; results are replayed in order through the same tracker, roster
+    # shards and vote confirmation as live cameras, with marks stamped at video
+    # time. Scheduled locations get the same session check-ins and check-outs
+    # the live engine records. Ledger writes skip anyone already marked that
+    # day, so re-running a replay is harmless.
+
+    def __init__(self, config, faces, ledger, workers=None, stride=5, segment_seconds=60.0):
+        self.config = config
+        self.ledger = ledger
+        self.workers = workers or os.cpu_count() or 1
+        self.stride = max(1, int(stride))
+        self.segment_seconds = segment_seconds
+        self.shards = ShardManager(faces, config['roster_file'], fallback=bool(config['shard_fallback']))
+        self.timetable = Timetable.load(config['roster_file'], int(config['late_threshold']))
+        self.marked = []
+        self.skipped = 0
+        self.video_seconds = 0.0
+
+    def _tasks(self, path, segments):
+        scale = float(self.config['detector_scale'] or DETECT_SCALE)
+        quality = quality_options(self.config) if self.config['quality_gate'] else None
+        encode = encoder_options(self.config)
+        if encode['backend'] == 'inline':
+            encode = dict(encode, backend='dlib')
+        return [
+            (path, start, end, self.stride, scale, detector_options(self.config), quality, encode,
+             int(self.config['encoder_max_batch']))
+            for start, end in segments
+        ]
+
+    def run(self, videos, progress=None):
+        # videos: [(path, start datetime, location)]
+        tolerance = float(self.config['recognition_tolerance'])
+        with multiprocessing.get_context('spawn').Pool(self.workers) as pool:
+            for path, video_start, location in videos:
+                segments, fps = plan_segments(path, self.segment_seconds)
+                tracker = FaceTracker(**engine.tracker_options(self.config))
+                sample = 0
+                last_frame = 0
+                for done, frames in enumerate(pool.imap(process_segment, self._tasks(path, segments)), 1):
+                    for frame_index, locations, encodings in frames:
+                        when = video_start + timedelta(seconds=frame_index / fps)
+                        self._handle(tracker, sample, when, path, frame_index / fps, location,
+                                     locations, encodings, tolerance)
+                        sample += 1
+                        last_frame = frame_index + 1
+                    if progress is not None:
+                        progress(path, done, len(segments))
+                if segments and segments[-1][1] is not None:
+                    last_frame = segments[-1][1]
+                self.video_seconds += last_frame / fps
+
+    def _handle(self, tracker, sample, when, path, offset, location, locations, encodings, tolerance):
+        tracks = tracker.update(locations, sample)
+        fresh = [(track, encoding) for track, encoding in zip(tracks, encodings) if encoding is not None]
+        if fresh:
+            matches = self.shards.search(location, [encoding for _, encoding in fresh], tolerance, when)
+            for (track, _), (identity, distance) in zip(fresh, matches):
+                track.vote(identity, distance, sample)
+
+        location = location or self.config['location']
+        for track in tracks:
+            if track.identity is None or not tracker.is_confirmed(track):
+                continue
+            name, student_id = track.identity
+            # As in RecognitionEngine.handle_result: a newly opened session
+            # window is owed a check-in or check-out by whoever is still in view
+            windows = engine.window_keys(self.timetable, location, student_id, when)
+            if track.marked and windows <= track.windows:
+                continue
+            track.marked = True
+            track.windows = windows
+            # The footage itself is the evidence: file plus offset into it
+            evidence = f"{os.path.abspath(path)}#t={offset:.1f}"
+            status, _ = engine.record_mark(self.config, self.ledger, self.timetable, name, student_id,
+                                           evidence, location, when)
+            if status is not None:
+                self.marked.append((name, student_id, status, when))
+            else:
+                self.skipped += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild attendance from recorded footage.")
+    parser.add_argument("video", nargs='+', help="PATH@START[@LOCATION], START as YYYY-MM-DDTHH:MM:SS")
+    parser.add_argument("--location", help="location for videos that do not name one")
+    parser.add_argument("--stride", type=int, default=5, help="process every Nth frame")
+    parser.add_argument("--segment-seconds", type=float, default=60.0, help="video seconds per pool task")
+    parser.add_argument("--workers", type=int, help="decoder processes (defaults to CPU count)")
+    parser.add_argument("--config", default=engine.CONFIG_FILE)
+    args = parser.parse_args(argv)
+
+    config = engine.load_config(args.config)
+    videos = [parse_video(spec, args.location or config['location']) for spec in args.video]
+    faces = engine.FaceStore(config)
+    ledger, _ = open_ledger(config, engine.ATTENDANCE_DB, engine.ATTENDANCE_FILE, serve=False)
+
+    def report(path, done, total):
+        sys.stdout.write(f"\r{os.path.basename(path)}: segment {done}/{total}")
+        sys.stdout.flush()
+        if done == total:
+            sys.stdout.write("\n")
+
+    replay = Replay(config, faces, ledger, args.workers, args.stride, args.segment_seconds)
+    started = time.perf_counter()
+    try:
+        replay.run(videos, report)
+    finally:
+        ledger.close()
+    elapsed = time.perf_counter() - started
+
+    for name, student_id, status, when in replay.marked:
+        print(f"{when.strftime('%Y-%m-%d %H:%M:%S')} {name} ({student_id}) marked {status}")
+    speed = replay.video_seconds / elapsed if elapsed else 0.0
+    print(f"{len(replay.marked)} marks written, {replay.skipped} already in the ledger; "
+          f"{replay.video_seconds:.0f}s of video in {elapsed:.0f}s ({speed:.1f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import collections
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from metrics import METRICS
+from settings import ROSTER_FILE
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+class Rosters:
+    # rosters.json maps shard names (a building, a class section) to student IDs,
+    # plus an optional schedule of which shards a location sees and when:
+    #
+    #   {"shards": {"Building A": ["S001", ...], "10B": ["S104", ...]},
+    #    "schedule": [{"location": "Room 12", "shard": "10B", "days": ["Mon", "Wed"],
+    #                  "start": "09:00", "end": "10:30"}]}
+    #
+    # With no schedule entry in effect, a location uses the shard of the same name.
+
+    def __init__(self, shards=None, schedule=None):
+        self.shards = {name: [str(i) for i in ids] for name, ids in (shards or {}).items()}
+        self.schedule = schedule or []
+
+    @classmethod
+    def load(cls, path=ROSTER_FILE):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get('shards'), data.get('schedule'))
+
+    def active_shards(self, location, now=None):
+        now = now or datetime.now()
+        day, clock = WEEKDAYS[now.weekday()], now.strftime('%H:%M')
+        names = [
+            entry['shard'] for entry in self.schedule
+            if entry.get('location') == location
+            and day in entry.get('days', WEEKDAYS)
+            and entry.get('start', '00:00') <= clock < entry.get('end', '24:00')
+            and entry['shard'] in self.shards
+        ]
+        if not names and location in self.shards:
+            names = [location]
+        return tuple(sorted(set(names)))
+
+    def members(self, names):
+        return {student_id for name in names for student_id in self.shards.get(name, ())}
+
+
+class ShardManager:
+    # Matches each camera against its location's roster shard first and only
+    # falls back to the whole gallery on a miss, so matching cost follows the
+    # local roster size. Shards are built on first use, re-resolved against the
+    # schedule every recheck_interval seconds and swapped in when they change.
+    # Students' adaptive templates (templates.py), if any, are matched too.
+
+    def __init__(self, faces, roster_file=ROSTER_FILE, recheck_interval=30.0, fallback=True, cache_size=16):
+        self.faces = faces
+        self.roster_file = roster_file
+        self.recheck_interval = recheck_interval
+        self.fallback = fallback
+        self.cache_size = cache_size
+        self.rosters = Rosters()
+        self._mtime = None
+        self._built = collections.OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._reload()
+
+    def _reload(self):
+        mtime = os.path.getmtime(self.roster_file) if os.path.exists(self.roster_file) else None
+        if mtime != self._mtime:
+            self.rosters = Rosters.load(self.roster_file)
+            self._mtime = mtime
+            self._built.clear()
+            self._active.clear()
+
+    def _templates(self):
+        templates = getattr(self.faces, 'templates', None)
+        return templates.gallery if templates is not None else None
+
+    def _build(self, names):
+        gallery, templates = self.faces.gallery, self._templates()
+        key = (names, id(gallery), gallery.version, id(templates), templates.version if templates else None)
+        if key not in self._built:
+            with METRICS.timer("shard_build"):
+                members = self.rosters.members(names)
+                shard = gallery.subset(members)
+                if templates is not None and len(templates):
+                    learned = templates.subset(members)
+                    if len(learned):
+                        shard.extend(learned.encodings, learned.names, learned.ids)
+                self._built[key] = shard
+            while len(self._built) > self.cache_size:
+                self._built.popitem(last=False)
+        self._built.move_to_end(key)
+        return self._built[key]
+
+    def shard_for(self, location, now=None):
+        # The location's current shard gallery, or None when it has no roster
+        with self._lock:
+            active = self._active.get(location)
+            current = time.time()
+            # An explicit time (e.g. replayed footage) is always resolved afresh
+            if now is not None or active is None or current - active[0] >= self.recheck_interval:
+                self._reload()
+                names = self.rosters.active_shards(location, now)
+                if active is not None and active[1] != names:
+                    METRICS.inc("shard_swaps")
+                active = (current, names)
+                self._active[location] = active
+            if not active[1]:
+                return None
+            return self._build(active[1])
+
+    def preload(self, locations):
+        for location in set(locations):
+            self.shard_for(location)
+
+    def search(self, location, encodings, tolerance=0.6, now=None):
+        # One (identity or None, distance) pair per encoding
+        results = [(None, float('inf'))] * len(encodings)
+        pending = list(range(len(encodings)))
+        shard = self.shard_for(location, now)
+        if shard is not None and len(shard):
+            misses = []
+            for i, (idx, distance) in zip(pending, shard.search(encodings, tolerance)):
+                if idx >= 0:
+                    results[i] = ((shard.names[idx], shard.ids[idx]), distance)
+                else:
+                    results[i] = (None, distance)
+                    misses.append(i)
+            METRICS.inc("shard_hits", len(pending) - len(misses))
+            pending = misses
+            if not self.fallback:
+                return results
+
+        if pending:
+            if shard is not None:
+                METRICS.inc("shard_fallbacks", len(pending))
+            queries = [encodings[i] for i in pending]
+            for gallery in (self.faces.gallery, self._templates()):
+                if gallery is None or not len(gallery):
+                    continue
+                for i, (idx, distance) in zip(pending, gallery.search(queries, tolerance)):
+                    # Nearest of the enrolled faces and the learned templates
+                    if distance < results[i][1]:
+                        results[i] = ((gallery.names[idx], gallery.ids[idx]) if idx >= 0 else None, distance)
+        return results
+
+    def describe(self, location):
+        # (shard names, shard size) currently used for a location
+        shard = self.shard_for(location)
+        active = self._active.get(location)
+        return (active[1] if active else ()), (len(shard) if shard is not None else 0)
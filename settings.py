@@ -0,0 +1,143 @@
+import json
+import os
+import secrets
+
+# Paths, defaults and config.json handling. Only the standard library, so the
+# GUI can read its settings and build the window before OpenCV, numpy and the
+# recognition pipeline are imported.
+
+FACES_DIR = "registered_faces"
+ATTENDANCE_DIR = "attendance_photos"
+REPORT_DIR = "reports"
+ATTENDANCE_FILE = "attendance.csv"
+ATTENDANCE_DB = "attendance.db"
+FACE_DATA_FILE = "face_encodings.pkl"
+GALLERY_FILE = "face_gallery.json"
+CONFIG_FILE = "config.json"
+TEMPLATE_FILE = "face_templates.json"
+ROSTER_FILE = "rosters.json"
+
+DETECTOR_BACKENDS = ('hog', 'dnn', 'haar')
+ENCODER_BACKENDS = ('inline', 'dlib', 'onnx')
+
+# Default OpenCV res10 SSD face detector files; paths are configurable
+DNN_PROTOTXT = "models/deploy.prototxt"
+DNN_MODEL = "models/res10_300x300_ssd_iter_140000.caffemodel"
+
+DEFAULT_CONFIG = {
+    "work_start": "09:00",
+    "work_end": "17:00",
+    "late_threshold": 15,
+    "recognition_tolerance": 0.6,
+    "location": "Main Office",
+    "gallery_approximate": False,
+    "gallery_ivf_lists": 0,
+    "gallery_ivf_probe": 8,
+    "gallery_dtype": "float32",
+    "camera_sources": [{"name": "Camera 0", "source": 0}],
+    "recognition_workers": 2,
+    "frame_queue_size": 1,
+    "max_frame_age": 1.0,
+    "preview_fps": 15,
+    "display_refresh_hz": 60,
+    "detect_every_n_frames": 2,
+    "track_iou_threshold": 0.3,
+    "track_min_votes": 3,
+    "track_reencode_interval": 30,
+    "detector_backend": "hog",
+    "detector_scale": 0.25,
+    "detector_upsample": 1,
+    "detector_haar_prefilter": False,
+    "dnn_prototxt": DNN_PROTOTXT,
+    "dnn_model": DNN_MODEL,
+    "dnn_confidence": 0.5,
+    "motion_threshold": 0.005,
+    "idle_frame_stride": 10,
+    "idle_motion_threshold": 0.01,
+    "idle_detector_upsample": 0,
+    "schedule_check_seconds": 15,
+    "encoder_backend": "dlib",
+    "encoder_max_batch": 16,
+    "encoder_max_wait_ms": 20,
+    "onnx_model": "models/face_embedding.onnx",
+    "onnx_input_size": 112,
+    "quality_gate": True,
+    "quality_min_blur": 40.0,
+    "quality_min_face_size": 60,
+    "quality_max_yaw": 0.3,
+    "quality_max_roll": 25.0,
+    "quality_min_brightness": 40.0,
+    "quality_max_brightness": 220.0,
+    "embedding_cache_size": 256,
+    "liveness_check": False,
+    "liveness_blink_ear": 0.21,
+    "liveness_min_head_motion": 0.08,
+    "liveness_min_texture": 0.01,
+    "liveness_max_moire": 30.0,
+    "liveness_max_samples": 40,
+    "liveness_retry_seconds": 5.0,
+    "adaptive_templates": True,
+    "template_file": TEMPLATE_FILE,
+    "template_max_per_student": 5,
+    "template_fold_distance": 0.45,
+    "template_merge_distance": 0.2,
+    "template_max_drift": 0.55,
+    "template_margin": 0.08,
+    "template_min_confidence": 0.8,
+    "roster_file": ROSTER_FILE,
+    "shard_fallback": True,
+    "shard_recheck_seconds": 30,
+    "ledger_mode": "local",
+    "ledger_host": "127.0.0.1",
+    "ledger_port": 6001,
+    # Generated on first run (load_config); the ledger socket unpickles requests
+    "ledger_authkey": "",
+    "startup_profile_file": "startup_profile.json",
+    "metrics_host": "127.0.0.1",
+    "metrics_port": 9108,
+    "evidence_format": "jpg",
+    "evidence_quality": 85,
+    "evidence_thumb_size": 160,
+    "evidence_full_frame": True,
+    "evidence_full_frame_width": 640,
+    "evidence_archive": False,
+    "evidence_retention_days": 0,
+    "evidence_queue_size": 64
+}
+
+
+def load_config(config_file=CONFIG_FILE, save=True):
+    # Fills in missing keys and writes them back unless save is False
+    default = json.loads(json.dumps(DEFAULT_CONFIG))
+    if os.path.exists(config_file):
+        try:
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+        except json.JSONDecodeError:
+            config = default
+    else:
+        config = default
+
+    updated = False
+    for key, value in default.items():
+        if key not in config:
+            config[key] = value
+            updated = True
+    # Installs still on the old shipped key get a private one as well
+    if config['ledger_authkey'] in ("", "attendance"):
+        config['ledger_authkey'] = secrets.token_hex(16)
+        updated = True
+
+    if save and (updated or not os.path.exists(config_file)):
+        save_config(config, config_file)
+    return config
+
+
+def save_config(config, config_file=CONFIG_FILE):
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+
+
+def missing_dnn_models(config):
+    # The res10 model files are not shipped; list whichever ones are absent
+    return [path for path in (config['dnn_prototxt'], config['dnn_model']) if not os.path.isfile(path)]
@@ -0,0 +1,40 @@
+import importlib
+import json
+import sys
+import time
+
+# Imported first by the GUI, so this is as close to process start as Python allows
+STARTED = time.perf_counter()
+
+
+class StartupProfile:
+    # Cold-start timeline: named phases (seconds since start) and the cost of
+    # each deferred import, written as JSON so slow starts show up in diffs.
+
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.phases = {}
+        self.imports = {}
+
+    def mark(self, phase):
+        self.phases[phase] = round(time.perf_counter() - self.started, 4)
+        return self.phases[phase]
+
+    def timed_import(self, name):
+        if name in sys.modules:
+            return sys.modules[name]
+        began = time.perf_counter()
+        module = importlib.import_module(name)
+        self.imports[name] = round(time.perf_counter() - began, 4)
+        return module
+
+    def report(self):
+        return {"phases": dict(self.phases), "imports": dict(self.imports)}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+
+PROFILE = StartupProfile()
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from gallery import FaceGallery
+from gallery_store import GalleryFile, GalleryFormatError
+from metrics import METRICS
+from settings import TEMPLATE_FILE
+
+# Per-student history of (date, match distance, distance to the enrolled face)
+TREND_LENGTH = 90
+
+
+def _lock_exclusive(path):
+    # Non-blocking exclusive lock held until the returned file is closed or the
+    # process exits; None when another process holds it
+    f = open(path, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _distances(matrix, encoding):
+    if not len(matrix):
+        return np.empty(0, dtype=np.float32)
+    return np.linalg.norm(np.asarray(matrix, dtype=np.float32) - encoding, axis=1)
+
+
+class TemplateSet:
+    # Adaptive templates learned from confident live matches, kept in their own
+    # gallery next to the enrolled faces so enrollment photos stay the fixed
+    # anchors. Each student holds at most max_per_student templates, each the
+    # running centre of the matches it absorbed. A match is folded in only when:
+    #   - its distance is within fold_distance,
+    #   - it is at least margin closer than any other student,
+    #   - the result stays within max_drift of the student's enrolled face.
+    # A match within merge_distance of a template moves that template; one
+    # within merge_distance of the enrolled face teaches nothing new. Anything
+    # else becomes a new template, evicting the one that absorbed the fewest
+    # matches (least recently used on ties).
+    #
+    # Folds only change memory; flush() persists the whole set from the
+    # engine's scheduler thread. Several processes (the GUI, daemons with
+    # --ledger connect) may share the template files, so only the one holding
+    # <template_file>.lock learns and writes. The others match with the
+    # templates as last flushed and reload them when the files change.
+
+    def __init__(self, store, template_file=TEMPLATE_FILE, dtype='float32', max_per_student=5,
+                 fold_distance=0.45, merge_distance=0.2, max_drift=0.55, margin=0.08, max_weight=20):
+        self.store = store
+        self.file = GalleryFile(template_file, dtype=dtype)
+        self.stats_file = os.path.splitext(template_file)[0] + "_stats.json"
+        self.max_per_student = max_per_student
+        self.fold_distance = fold_distance
+        self.merge_distance = merge_distance
+        self.max_drift = max_drift
+        self.margin = margin
+        # Caps a template's inertia so it keeps following slow change
+        self.max_weight = max_weight
+        self.gallery = None
+        self.info = []
+        self.trends = {}
+        self._owner = _lock_exclusive(os.path.splitext(template_file)[0] + ".lock")
+        self._loaded_mtime = None
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self.load()
+
+    @property
+    def writable(self):
+        return self._owner is not None
+
+    def load(self):
+        dim = self.store.gallery.dim
+        gallery = None
+        self._loaded_mtime = self._files_mtime()
+        if self.file.exists():
+            try:
+                gallery = self.file.load()
+            except (GalleryFormatError, OSError, ValueError):
+                gallery = None
+        # Templates from another encoder backend cannot be compared; start over
+        if gallery is None or gallery.dim != dim:
+            gallery = FaceGallery(dim=dim)
+            if self.writable:
+                self.file.write(gallery)
+        self.gallery = gallery
+
+        data = {}
+        if os.path.exists(self.stats_file):
+            try:
+                with open(self.stats_file) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+        info = data.get('templates', [])
+        # A crash between the two files leaves them misaligned; keep the vectors
+        if len(info) != len(gallery):
+            info = [self._new_info() for _ in range(len(gallery))]
+        self.info = info
+        self.trends = data.get('trends', {})
+
+    def _new_info(self, now=None):
+        now = now or time.time()
+        return {"weight": 1, "hits": 0, "created": now, "last_used": now}
+
+    def _files_mtime(self):
+        paths = (self.file.meta_file, self.stats_file)
+        return tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in paths)
+
+    def flush(self):
+        # Called periodically by the engine's scheduler and when it stops. The
+        # owner rewrites the templates and stats if anything changed since the
+        # last flush; other processes pick up what the owner last wrote.
+        if not self.writable:
+            if self._files_mtime() != self._loaded_mtime:
+                with self._lock:
+                    self.load()
+            return
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                gallery = FaceGallery.from_lists(self.gallery.encodings, list(self.gallery.names),
+                                                 list(self.gallery.ids), dim=self.gallery.dim)
+                data = json.dumps({"templates": self.info, "trends": self.trends})
+                self._dirty = False
+            try:
+                self.file.write(gallery)
+                tmp = self.stats_file + '.tmp'
+                with open(tmp, 'w') as f:
+                    f.write(data)
+                os.replace(tmp, self.stats_file)
+            except OSError:
+                with self._lock:
+                    self._dirty = True
+                raise
+
+    def _rows(self, gallery, student_id):
+        return [i for i, sid in enumerate(gallery.ids) if str(sid) == student_id]
+
+    def _anchor_distance(self, student_id, encoding):
+        enrolled = self.store.gallery
+        rows = self._rows(enrolled, student_id)
+        if not rows:
+            return None
+        return float(_distances(enrolled.encodings[rows], encoding).min())
+
+    def _rival_distance(self, student_id, encoding):
+        # Nearest enrolled face or template of anybody else
+        best = float('inf')
+        for gallery in (self.store.gallery, self.gallery):
+            others = [i for i, sid in enumerate(gallery.ids) if str(sid) != student_id]
+            if others:
+                best = min(best, float(_distances(gallery.encodings[others], encoding).min()))
+        return best
+
+    def _remove(self, index):
+        self.gallery.remove(index)
+        self.info.pop(index)
+
+    def _add(self, encoding, name, student_id, info):
+        self.gallery.add(encoding, name, student_id)
+        self.info.append(info)
+
+    def _replace(self, index, encoding, info):
+        self.gallery.replace(index, encoding)
+        self.info[index] = info
+
+    def _record(self, student_id, distance, anchor):
+        trend = self.trends.setdefault(student_id, [])
+        trend.append([datetime.now().strftime("%Y-%m-%d"), round(float(distance), 4),
+                      None if anchor is None else round(anchor, 4)])
+        del trend[:-TREND_LENGTH]
+
+    def fold(self, name, student_id, encoding, distance):
+        # Offers one confident live match; returns True if the templates changed
+        if not self.writable:
+            return False
+        student_id = str(student_id)
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(self.gallery.dim)
+        with self._lock:
+            anchor = self._anchor_distance(student_id, encoding)
+            self._record(student_id, distance, anchor)
+            changed = self._fold(name, student_id, encoding, distance, anchor)
+            self._dirty = True
+        METRICS.inc("templates_folded" if changed else "templates_skipped")
+        return changed
+
+    def _fold(self, name, student_id, encoding, distance, anchor):
+        if anchor is None or distance > self.fold_distance or anchor > self.max_drift:
+            return False
+        if self._rival_distance(student_id, encoding) - distance < self.margin:
+            return False
+
+        now = time.time()
+        rows = self._rows(self.gallery, student_id)
+        if rows:
+            gaps = _distances(self.gallery.encodings[rows], encoding)
+            nearest = rows[int(np.argmin(gaps))]
+            if gaps.min() <= self.merge_distance:
+                info = self.info[nearest]
+                weight = min(info['weight'], self.max_weight)
+                centre = (np.asarray(self.gallery.encodings[nearest], dtype=np.float32) * weight + encoding) / (weight + 1)
+                info = dict(info, weight=info['weight'] + 1, hits=info['hits'] + 1, last_used=now)
+                if self._anchor_distance(student_id, centre) > self.max_drift:
+                    self.info[nearest] = info
+                    return False
+                self._replace(nearest, centre, info)
+                return True
+        if anchor <= self.merge_distance:
+            return False
+
+        if len(rows) >= self.max_per_student:
+            victim = min(rows, key=lambda i: (self.info[i]['hits'], self.info[i]['last_used']))
+            self._remove(victim)
+            METRICS.inc("templates_evicted")
+        self._add(encoding, name, student_id, self._new_info(now))
+        return True
+
+    def forget(self, student_id):
+        # Drops a student's templates and history, e.g. when they are deleted
+        student_id = str(student_id)
+        with self._lock:
+            for index in reversed(self._rows(self.gallery, student_id)):
+                self._remove(index)
+            self.trends.pop(student_id, None)
+            self._dirty = True
+        self.flush()
+
+    def restart_trend(self, student_id):
+        # A fresh enrollment resets the drift history it is measured against
+        with self._lock:
+            if self.trends.pop(str(student_id), None) is None:
+                return
+            self._dirty = True
+        self.flush()
+
+    def count(self, student_id):
+        return len(self._rows(self.gallery, str(student_id)))
+
+    def report(self, recent=5):
+        # One row per student with history, most drifted first:
+        # (student_id, points, recent match distance, recent distance to the
+        # enrolled face, change of the latter per day)
+        rows = []
+        with self._lock:
+            trends = {sid: list(trend) for sid, trend in self.trends.items()}
+        for student_id, trend in trends.items():
+            last = trend[-recent:]
+            match = float(np.mean([point[1] for point in last]))
+            anchors = [(point[0], point[2]) for point in trend if point[2] is not None]
+            anchor = float(np.mean([a for _, a in anchors[-recent:]])) if anchors else None
+            slope = 0.0
+            if len(anchors) >= 2:
+                first = datetime.strptime(anchors[0][0], "%Y-%m-%d")
+                days = [(datetime.strptime(day, "%Y-%m-%d") - first).days for day, _ in anchors]
+                if days[-1] > days[0]:
+                    slope = float(np.polyfit(days, [a for _, a in anchors], 1)[0])
+            rows.append((student_id, len(trend), match, anchor, slope))
+        rows.sort(key=lambda row: -1.0 if row[3] is None else row[3], reverse=True)
+        return rows
+
+
+def template_options(config):
+    return {
+        "template_file": config['template_file'],
+        "dtype": config['gallery_dtype'],
+        "max_per_student": int(config['template_max_per_student']),
+        "fold_distance": float(config['template_fold_distance']),
+        "merge_distance": float(config['template_merge_distance']),
+        "max_drift": float(config['template_max_drift']),
+        "margin": float(config['template_margin'])
+    }
+
+
+def main(argv=None):
+    import engine
+
+    parser = argparse.ArgumentParser(description="Show who is drifting away from their enrollment photo.")
+    parser.add_argument("--config", default=engine.CONFIG_FILE)
+    parser.add_argument("--threshold", type=float,
+                        help="only list students whose recent distance to their enrolled face exceeds this")
+    args = parser.parse_args(argv)
+
+    config = engine.load_config(args.config)
+    faces = engine.FaceStore(dict(config, adaptive_templates=True))
+    names = dict(zip((str(i) for i in faces.gallery.ids), faces.gallery.names))
+    threshold = args.threshold if args.threshold is not None else 0.85 * float(config['recognition_tolerance'])
+
+    print(f"{'Student':<28} {'Marks':>5} {'Match':>6} {'Enrolled':>8} {'Per day':>8} {'Templates':>9}")
+    for student_id, points, match, anchor, slope in faces.templates.report():
+        if anchor is None or anchor < threshold:
+            continue
+        label = f"{names.get(student_id, '?')} ({student_id})"
+        print(f"{label:<28} {points:>5} {match:>6.3f} {anchor:>8.3f} {slope:>+8.4f} "
+              f"{faces.templates.count(student_id):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exporter
+from exporter import ExportCancelled, export_records
+
+
+class FakeLedger:
+    # Two chunks of records in the ledger's query layout (id first)
+    def __init__(self, rows=4):
+        self.rows = [(i, f"S{i}", f"Student {i}", "2024-09-02", "09:00:00", "Present", "Main Office", "")
+                     for i in range(1, rows + 1)]
+
+    def count(self, filters):
+        return len(self.rows)
+
+    def query(self, filters, order, descending, limit):
+        rows = [row for row in self.rows if row[0] > filters['after_id']]
+        return rows[:limit]
+
+
+class FailingCloseWriter(exporter._CsvWriter):
+    def __init__(self, path):
+        super().__init__(path)
+        self.closes = self.aborts = 0
+
+    def close(self):
+        self.closes += 1
+        super().close()
+        raise OSError("disk full")
+
+    def abort(self):
+        self.aborts += 1
+        super().abort()
+
+
+def test_cancel_aborts_and_removes_output(tmp_path):
+    path = str(tmp_path / "records.csv")
+    cancel = threading.Event()
+    with pytest.raises(ExportCancelled):
+        export_records(FakeLedger(), path, chunk_size=2, cancel=cancel,
+                       progress=lambda done, total: cancel.set())
+    assert not os.path.exists(path)
+
+
+def test_failing_close_is_not_repeated(tmp_path, monkeypatch):
+    writers = []
+
+    def make_writer(path):
+        writers.append(FailingCloseWriter(path))
+        return writers[-1]
+
+    monkeypatch.setitem(exporter.WRITERS, 'csv', make_writer)
+    path = str(tmp_path / "records.csv")
+    with pytest.raises(OSError, match="disk full"):
+        export_records(FakeLedger(), path, chunk_size=2)
+    assert (writers[0].closes, writers[0].aborts) == (1, 0)
+    assert not os.path.exists(path)
@@ -0,0 +1,48 @@
+import os
+import sys
+from multiprocessing import AuthenticationError
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import AttendanceLedger
+from ledger_service import LedgerClient, LedgerServer
+
+AUTHKEY = b'0123456789abcdef'
+
+
+@pytest.fixture
+def server(tmp_path):
+    ledger = AttendanceLedger(str(tmp_path / "attendance.db"))
+    server = LedgerServer(ledger, '127.0.0.1', 0, AUTHKEY, handshake_timeout=0.5).start()
+    yield server
+    server.stop()
+    ledger.close()
+
+
+def test_bad_key_client_does_not_stop_later_clients(server):
+    host, port = server.address
+    with pytest.raises(AuthenticationError):
+        LedgerClient(host, port, b'wrong key', timeout=2)
+
+    client = LedgerClient(host, port, AUTHKEY, timeout=2)
+    try:
+        assert client.mark("Ada", "1", "2024-01-05", "09:00:00", "Present")
+        assert client.is_marked("1", "2024-01-05")
+    finally:
+        client.close()
+    assert server.rejected == 1
+
+
+def test_silent_client_does_not_block_others(server):
+    import socket
+
+    host, port = server.address
+    with socket.create_connection((host, port)):
+        # Never answers the challenge; other clients are served meanwhile
+        client = LedgerClient(host, port, AUTHKEY, timeout=2)
+        try:
+            assert client.count() == 0
+        finally:
+            client.close()
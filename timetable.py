@@ -0,0 +1,150 @@
+import argparse
+from datetime import datetime, timedelta
+
+from rosters import ROSTER_FILE, WEEKDAYS, Rosters
+
+
+def _minutes(clock):
+    hours, minutes = clock.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class Session:
+    # One timetabled class: a roster schedule entry (see rosters.py) read as a
+    # session with a check-in window around its start and, optionally, a
+    # check-out window around its end. Optional entry keys, in minutes:
+    #   checkin_before (10), checkin_after (30): check-in window around start
+    #   late_after (late_threshold): check-ins after start + late_after are Late
+    #   checkout (false), checkout_before (10), checkout_after (10): check-out
+    #   window around end; students who checked in but are not seen in it are
+    #   Left early
+
+    def __init__(self, entry, late_after=15):
+        self.location = entry.get('location', '')
+        self.shard = entry['shard']
+        self.days = tuple(entry.get('days', WEEKDAYS))
+        self.start = entry.get('start', '00:00')
+        self.end = entry.get('end', '24:00')
+        self.name = entry.get('name') or f"{self.shard} {self.start}"
+        self.checkin_before = int(entry.get('checkin_before', 10))
+        self.checkin_after = int(entry.get('checkin_after', 30))
+        self.late_after = int(entry.get('late_after', late_after))
+        self.checkout = bool(entry.get('checkout', False))
+        self.checkout_before = int(entry.get('checkout_before', 10))
+        self.checkout_after = int(entry.get('checkout_after', 10))
+
+    @property
+    def key(self):
+        # Stored in the ledger's session column
+        return f"{self.location}/{self.name}"
+
+    def on(self, now):
+        return WEEKDAYS[now.weekday()] in self.days
+
+    def phase(self, now):
+        # 'checkin', 'checkout' or None when neither window is open
+        if not self.on(now):
+            return None
+        clock = now.hour * 60 + now.minute + now.second / 60.0
+        start, end = _minutes(self.start), _minutes(self.end)
+        if start - self.checkin_before <= clock < min(start + self.checkin_after, end):
+            return 'checkin'
+        if self.checkout and end - self.checkout_before <= clock < end + self.checkout_after:
+            return 'checkout'
+        return None
+
+    def closes_at(self, now):
+        # When the day's statuses can be settled: after the last window
+        start, end = _minutes(self.start), _minutes(self.end)
+        last = end + self.checkout_after if self.checkout else min(start + self.checkin_after, end)
+        return datetime.combine(now.date(), datetime.min.time()) + timedelta(minutes=last)
+
+    def status(self, now):
+        clock = now.hour * 60 + now.minute + now.second / 60.0
+        return "Late" if clock > _minutes(self.start) + self.late_after else "Present"
+
+
+class Timetable:
+    # All sessions across locations and sections. Locations without sessions
+    # are never throttled and keep the single work_start/late_threshold rule.
+
+    def __init__(self, rosters=None, late_after=15):
+        self.rosters = rosters or Rosters()
+        self.sessions = [Session(entry, late_after) for entry in self.rosters.schedule]
+        self._members = {name: set(ids) for name, ids in self.rosters.shards.items()}
+
+    @classmethod
+    def load(cls, path=ROSTER_FILE, late_after=15):
+        return cls(Rosters.load(path), late_after)
+
+    def scheduled(self, location):
+        return any(session.location == location for session in self.sessions)
+
+    def windows(self, location, now, student_id=None):
+        # [(session, phase)] open at a location now, optionally only the
+        # sessions a student is rostered for
+        open_windows = []
+        for session in self.sessions:
+            if session.location != location:
+                continue
+            if student_id is not None and str(student_id) not in self._members.get(session.shard, ()):
+                continue
+            phase = session.phase(now)
+            if phase is not None:
+                open_windows.append((session, phase))
+        return open_windows
+
+    def busy(self, location, now):
+        # Full-rate recognition: always for unscheduled locations, otherwise
+        # only while a check-in or check-out window is open
+        return not self.scheduled(location) or bool(self.windows(location, now))
+
+    def due(self, now, locations=None):
+        # Today's sessions whose windows have all passed
+        return [
+            session for session in self.sessions
+            if session.on(now) and now >= session.closes_at(now)
+            and (locations is None or session.location in locations)
+        ]
+
+    def roster(self, session, names=None):
+        # {student_id: name} of a session's section
+        names = names or {}
+        return {sid: names.get(sid, '') for sid in sorted(self._members.get(session.shard, ()))}
+
+
+def main(argv=None):
+    import engine
+    from ledger_service import open_ledger
+
+    parser = argparse.ArgumentParser(description="Settle and print per-session attendance.")
+    parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"), help="YYYY-MM-DD")
+    parser.add_argument("--close", action="store_true",
+                        help="settle the day's finished sessions (Absent / Left early) before printing")
+    parser.add_argument("--config", default=engine.CONFIG_FILE)
+    args = parser.parse_args(argv)
+
+    config = engine.load_config(args.config)
+    timetable = Timetable.load(config['roster_file'], int(config['late_threshold']))
+    ledger, _ = open_ledger(config, engine.ATTENDANCE_DB, serve=False)
+    try:
+        if args.close:
+            day = datetime.strptime(args.date, "%Y-%m-%d")
+            if day.date() > datetime.now().date():
+                parser.error("cannot settle a day that has not happened yet")
+            # Every window of a past day has passed; today only those already over
+            now = min(datetime.now(), day + timedelta(days=1, seconds=-1))
+            faces = engine.FaceStore(dict(config, adaptive_templates=False))
+            names = dict(zip((str(i) for i in faces.gallery.ids), faces.gallery.names))
+            for session in timetable.due(now):
+                counts = ledger.close_session(session.key, args.date, timetable.roster(session, names),
+                                              session.location, session.checkout)
+                print(f"{session.key}: " + ", ".join(f"{status} {n}" for status, n in sorted(counts.items())))
+        for row in ledger.session_report(args.date, args.date):
+            print("  ".join(str(value or '-') for value in row))
+    finally:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
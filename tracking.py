@@ -0,0 +1,129 @@
+import itertools
+import threading
+from collections import Counter
+
+
+def iou(a, b):
+    # Boxes use face_recognition's (top, right, bottom, left) order
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    inter = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+def box_area(box):
+    return max(0, box[2] - box[0]) * max(0, box[1] - box[3])
+
+
+class Track:
+    def __init__(self, track_id, box, frame_no):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = frame_no
+        self.last_seen = frame_no
+        self.last_encoded = None
+        self.encoded_box = None
+        self.votes = Counter()
+        self.best_distance = {}
+        # Encoding behind each identity's best distance
+        self.best_encoding = {}
+        self.marked = False
+        # Timetabled (session, phase) windows already handled while marked
+        self.windows = frozenset()
+        # Per-track liveness evidence and verdict (see liveness.py)
+        self.liveness = None
+
+    def vote(self, identity, distance, frame_no, encoding=None):
+        # identity is (name, student_id) or None for an unknown face
+        self.votes[identity] += 1
+        if identity is not None and distance <= self.best_distance.get(identity, distance):
+            self.best_distance[identity] = distance
+            if encoding is not None:
+                self.best_encoding[identity] = encoding
+        self.last_encoded = frame_no
+        self.encoded_box = self.box
+
+    @property
+    def total_votes(self):
+        return sum(self.votes.values())
+
+    @property
+    def identity(self):
+        if not self.votes:
+            return None
+        return self.votes.most_common(1)[0][0]
+
+    @property
+    def confidence(self):
+        if not self.votes:
+            return 0.0
+        return self.votes.most_common(1)[0][1] / float(self.total_votes)
+
+
+class FaceTracker:
+    # Associates detections across frames by IoU so each person is encoded a few
+    # times when they appear rather than on every frame, and collects per-track
+    # identity votes before a mark is committed.
+
+    def __init__(self, iou_threshold=0.3, max_missed=30, min_votes=3, min_confidence=0.6,
+                 reencode_interval=30, max_drift=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_votes = min_votes
+        self.min_confidence = min_confidence
+        self.reencode_interval = reencode_interval
+        self.max_drift = max_drift
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def update(self, locations, frame_no):
+        # Greedy IoU association; returns one track per location, in order
+        with self._lock:
+            pairs = sorted(
+                ((iou(loc, track.box), i, j) for i, loc in enumerate(locations)
+                 for j, track in enumerate(self.tracks)),
+                reverse=True
+            )
+            assigned = [None] * len(locations)
+            used = set()
+            for overlap, i, j in pairs:
+                if overlap < self.iou_threshold:
+                    break
+                if assigned[i] is not None or j in used:
+                    continue
+                assigned[i] = self.tracks[j]
+                used.add(j)
+
+            for i, loc in enumerate(locations):
+                if assigned[i] is None:
+                    assigned[i] = Track(next(self._ids), loc, frame_no)
+                    self.tracks.append(assigned[i])
+                assigned[i].box = loc
+                assigned[i].last_seen = frame_no
+
+            self.tracks = [t for t in self.tracks if frame_no - t.last_seen <= self.max_missed]
+            return assigned
+
+    def is_confirmed(self, track):
+        return track.total_votes >= self.min_votes and track.confidence >= self.min_confidence
+
+    def needs_encoding(self, track, frame_no):
+        if not self.is_confirmed(track) or track.last_encoded is None:
+            return True
+        if frame_no - track.last_encoded >= self.reencode_interval:
+            return True
+        # Re-encode when the face has grown or shrunk a lot since the last encoding
+        encoded_area = box_area(track.encoded_box)
+        if encoded_area and abs(box_area(track.box) - encoded_area) / float(encoded_area) > self.max_drift:
+            return True
+        return False
+
+    def frozen_boxes(self, frame_no):
+        # Boxes whose identity is settled; detections overlapping them are not re-encoded
+        with self._lock:
+            return [t.box for t in self.tracks if not self.needs_encoding(t, frame_no)]